@@ -0,0 +1,336 @@
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import contextlib
+
+from QCOMEmulator import QCOM, Profile, FRAMEBUFFER_SIZE, FRAME_SIDE, run, frame_to_rgb, png_bytes
+import QCOMpiler
+
+# QCOM emulator benchmarks
+#
+# With --suite every benchmark below runs and the results (all rates,
+# higher is better) can be written as JSON with --json and checked
+# against an earlier --json file with --baseline; a result more than
+# --tolerance percent below its baseline fails the run.
+
+DEFAULT_ROMS = ["Walker.qcom", "Painter.qcom"]
+
+
+def bench_machine(machine, cycles, repeat=3):
+    """Run ``machine`` from reset for ``cycles`` instructions and return the
+    best instructions-per-second figure over ``repeat`` runs."""
+    best = 0.0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            machine.reset()
+            start = time.perf_counter()
+            ran = machine.run(cycles)
+            elapsed = time.perf_counter() - start
+            if elapsed > 0:
+                best = max(best, ran / elapsed)
+    return best
+
+
+def bench_rom(rom_path, cycles, repeat=3, block_cache=True):
+    """Run a ROM headless for ``cycles`` instructions and return the best
+    instructions-per-second figure over ``repeat`` runs."""
+    return bench_machine(QCOM.from_file(rom_path, block_cache=block_cache), cycles, repeat)
+
+
+# ============================
+# Opcode families
+# ============================
+
+# Family -> (setup, loop body). The body is repeated FAMILY_REPEAT times
+# inside a JMP loop; {a}..{e} are fresh label numbers for each copy. The
+# bodies keep every store inside the framebuffer so no code is rewritten.
+OPCODE_FAMILIES = {
+    "io": ("", "DIS $0x12\nDIS R0\nDIS 0x20\nIN R1\nOUT $1 $2\nOUT $1 R0\nOUT $1 0x20\n"),
+    "transfer": ("", "MOV R0 $0x12\nMOV 0x20 R0\nMOV R1 0x20\nMOV R2 R1\nCLS $0\n"),
+    "shift": ("", "SBL R0\nSBL 0x20\nSBR R1\nSBR 0x21\nRBL R2\nRBL 0x22\nRBR R3\nRBR 0x23\n"),
+    "logic": ("", "AND R0 $0x0F\nAND 0x20 R1\nAND R2 0x21\nAND R3 R0\n"
+                  "OR R0 $0x30\nOR 0x22 R1\nOR R2 0x23\nOR R3 R1\n"
+                  "XOR R0 $0x55\nXOR 0x24 R1\nXOR R2 0x25\nXOR R3 R2\nNOT R0\nNOT 0x26\n"),
+    "arith": ("", "ADD R0 $3\nADD 0x20 R1\nADD R2 0x21\nADD R3 R0\n"
+                  "SUB R0 $1\nSUB 0x22 R1\nSUB R2 0x23\nSUB R3 R1\n"
+                  "INC R0\nINC 0x24\nDEC R1\nDEC 0x25\n"),
+    "branch": ("", "JIF $1 #{a}\n#{a}\nJIF $0 #{b}\n#{b}\nJNI $1 #{c}\n#{c}\n"
+                   "JNI $0 #{d}\n#{d}\nJMP #{e}\n#{e}\n"),
+    # R1 and the byte at 0x70 are pointers into the framebuffer
+    "indirect": ("MOV R1 $0x10\nMOV R2 $0x55\nMOV 0x70 R1\n",
+                 "MIL R1 $0x33\nMIL R1 R2\nMIL R1 0x40\nMIL 0x70 R2\n"
+                 "MFI R2 R1\nMFI R2 0x70\nMFI 0x30 R1\nMFI 0x30 0x70\n"),
+}
+FAMILY_REPEAT = 8
+
+
+def family_source(family):
+    setup, body = OPCODE_FAMILIES[family]
+    copies = [body.format(a=5 * i + 1, b=5 * i + 2, c=5 * i + 3, d=5 * i + 4, e=5 * i + 5)
+              for i in range(FAMILY_REPEAT)]
+    return setup + "#0\n" + "".join(copies) + "JMP #0\n"
+
+
+def bench_family(family, cycles, repeat=3, block_cache=True):
+    """Instructions per second of a loop of one opcode family."""
+    rom = QCOMpiler.assemble(family_source(family))
+    return bench_machine(QCOM(rom, block_cache=block_cache), cycles, repeat)
+
+
+# ============================
+# Whole programs and rendering
+# ============================
+
+SCRIPTED_BUTTONS = (0x80, 0x40, 0x20, 0x10, 0x08, 0x00, 0x88, 0x28)
+INPUT_INTERVAL = 5000  # cycles between scripted controller changes
+
+
+def scripted_input(cycles, seed=0):
+    """(cycle, controller byte) pairs: a button change every INPUT_INTERVAL cycles."""
+    rng = random.Random(seed)
+    return [(cycle, rng.choice(SCRIPTED_BUTTONS)) for cycle in range(INPUT_INTERVAL, cycles, INPUT_INTERVAL)]
+
+
+def bench_program(rom_path, cycles, repeat=3, block_cache=True):
+    """Instructions per second of a ROM driven by scripted_input()."""
+    with open(rom_path, "rb") as f:
+        rom = f.read()
+    inputs = scripted_input(cycles)
+    best = 0.0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            machine = run(rom, cycles, inputs, block_cache=block_cache)
+            elapsed = time.perf_counter() - start
+            if elapsed > 0:
+                best = max(best, machine.cycles / elapsed)
+    return best
+
+
+def bench_render(frames, repeat=3, png=False):
+    """Frames per second of the SHW path: a framebuffer store, take_frame()
+    and the RGB conversion the front-end blits (and PNG encoding with ``png``)."""
+    machine = QCOM()
+    rng = random.Random(0)
+    stores = [(rng.randrange(FRAMEBUFFER_SIZE), rng.randrange(256)) for _ in range(frames)]
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for addr, value in stores:
+            machine.write_byte(addr, value)
+            frame = machine.take_frame()
+            if frame is not None:
+                rgb = frame_to_rgb(frame)
+                if png:
+                    png_bytes(rgb, FRAME_SIDE, FRAME_SIDE)
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            best = max(best, frames / elapsed)
+    return best
+
+
+# Instruction shapes for generated sources; {t} is a label target
+SOURCE_TEMPLATES = [
+    "MOV R{r} ${imm}", "MOV R{r} R{s}", "MOV 0x{addr:02X} R{r}", "MOV R{r} 0x{addr:02X}",
+    "ADD R{r} ${imm}", "ADD R{r} R{s}", "SUB R{r} ${imm}", "AND R{r} $0x{imm:02X}",
+    "OR R{r} R{s}", "XOR 0x{addr:02X} R{r}", "SBL R{r}", "INC R{r}",
+    "MIL R{r} ${imm}", "MFI R{r} R{s}", "DIS R{r}", "IN R{r}", "SHW",
+    "JMP #{t}", "JIF $1 #{t}", "JNI $1 #{t}",
+]
+
+
+def generate_source(n_lines, seed=0):
+    """Return ``n_lines`` of assembly with a label every few lines, like
+    macro-generated code, plus comments and label-relative jumps."""
+    rng = random.Random(seed)
+    shapes = []
+    labels = 0
+    for _ in range(n_lines):
+        roll = rng.random()
+        if roll < 0.2:
+            shapes.append(f"#{labels}")
+            labels += 1
+        elif roll < 0.25:
+            shapes.append("/ generated")
+        else:
+            shapes.append(rng.choice(SOURCE_TEMPLATES))
+    lines = []
+    for shape in shapes:
+        lines.append(shape.format(r=rng.randrange(7), s=rng.randrange(7), imm=rng.randrange(256),
+                                  addr=rng.randrange(0x80), t=rng.randrange(max(labels, 1))) + "\n")
+    return lines
+
+
+def bench_assembler(n_lines, repeat=3):
+    """Assemble a generated ``n_lines`` source and return the best lines per second."""
+    lines = generate_source(n_lines)
+    best = 0.0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            QCOMpiler.compile_lines(lines)
+            elapsed = time.perf_counter() - start
+            if elapsed > 0:
+                best = max(best, n_lines / elapsed)
+    return best
+
+
+def bench_page_elision(source_path, cycles):
+    """Assemble a source with redundant page setups removed and count, over
+    ``cycles`` cycles of the unoptimized ROM, how many executed instructions
+    were removed setups. Returns (page report, executed, saved)."""
+    with open(source_path, "r") as f:
+        lines = f.readlines()
+    report = {}
+    QCOMpiler.compile_lines(lines, elide_pages=True, page_report=report)
+    profile = Profile()
+    machine = QCOM(bytes(QCOMpiler.compile_lines(lines)), profile=profile)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        machine.run(cycles)
+    counts = profile.instruction_counts()
+    removed = set(report["addresses"])
+    saved = sum(n for (pc, _), n in counts.items() if pc in removed)
+    return report, sum(counts.values()), saved
+
+
+# ============================
+# Suite and baselines
+# ============================
+
+SUITE_FAMILY_CYCLES = 200_000
+SUITE_PROGRAM_CYCLES = 500_000
+SUITE_RENDER_FRAMES = 20_000
+ASSEMBLER_SIZES = {"small": 200, "medium": 5_000, "huge": 50_000}  # lines
+DEFAULT_TOLERANCE = 10.0  # percent
+
+
+def run_suite(repeat=3, roms=DEFAULT_ROMS, on_result=None):
+    """Run every benchmark. Returns {name: (rate, unit)}."""
+    results = {}
+
+    def record(name, rate, unit):
+        results[name] = (rate, unit)
+        if on_result is not None:
+            on_result(name, rate, unit)
+
+    for mode, block_cache in (("interp", False), ("blocks", True)):
+        for family in OPCODE_FAMILIES:
+            record(f"opcodes/{family}/{mode}",
+                   bench_family(family, SUITE_FAMILY_CYCLES, repeat, block_cache), "instr/s")
+        for rom_path in roms:
+            record(f"program/{os.path.basename(rom_path)}/{mode}",
+                   bench_program(rom_path, SUITE_PROGRAM_CYCLES, repeat, block_cache), "instr/s")
+    record("render/shw", bench_render(SUITE_RENDER_FRAMES, repeat), "frames/s")
+    record("render/png", bench_render(SUITE_RENDER_FRAMES, repeat, png=True), "frames/s")
+    for size, n_lines in ASSEMBLER_SIZES.items():
+        record(f"assembler/{size}", bench_assembler(n_lines, repeat), "lines/s")
+    return results
+
+
+def results_json(results):
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": {name: {"value": round(rate, 1), "unit": unit} for name, (rate, unit) in results.items()},
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Print each result against ``baseline`` (a results_json() dict) and
+    return the names that are more than ``tolerance`` percent slower."""
+    old = baseline.get("results", {})
+    regressions = []
+    print(f"{'benchmark':<28} {'now':>14} {'baseline':>14} {'change':>8}")
+    for name, (rate, unit) in results.items():
+        if name not in old:
+            print(f"{name:<28} {rate:>14,.0f} {'-':>14} {'new':>8}")
+            continue
+        base = old[name]["value"]
+        change = 100 * (rate / base - 1) if base else 0.0
+        flag = ""
+        if change < -tolerance:
+            regressions.append(name)
+            flag = "  SLOWER"
+        elif change > tolerance:
+            flag = "  faster"
+        print(f"{name:<28} {rate:>14,.0f} {base:>14,.0f} {change:>+7.1f}%{flag}")
+    for name in old:
+        if name not in results:
+            print(f"{name:<28} {'-':>14} {old[name]['value']:>14,.0f} {'gone':>8}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure QCOM emulator instructions per second.")
+    parser.add_argument("roms", nargs="*", default=DEFAULT_ROMS)
+    parser.add_argument("--cycles", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-block-cache", action="store_true",
+                        help="benchmark the plain interpreter")
+    parser.add_argument("--asm", type=int, metavar="LINES",
+                        help="benchmark QCOMpiler on a generated source of LINES lines instead")
+    parser.add_argument("--pages", metavar="SOURCE", nargs="+",
+                        help="report what page-setup elimination saves on assembly SOURCEs instead")
+    parser.add_argument("--suite", action="store_true",
+                        help="run opcode-family, whole-program, render and assembler benchmarks")
+    parser.add_argument("--json", metavar="FILE",
+                        help="with --suite, write the results as JSON to FILE (use it as a later --baseline)")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="with --suite, compare against a --json file; exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"percent slower than the baseline that still passes (default: {DEFAULT_TOLERANCE:g})")
+    args = parser.parse_args()
+
+    if args.suite:
+        baseline = None
+        if args.baseline:
+            try:
+                with open(args.baseline, "r") as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error: baseline '{args.baseline}': {e}")
+                sys.exit(1)
+        for rom_path in args.roms:
+            if not os.path.exists(rom_path):
+                print(f"Error: File '{rom_path}' does not exist.")
+                sys.exit(1)
+        progress = None if baseline else lambda name, rate, unit: print(f"{name:<28} {rate:>14,.0f} {unit}")
+        results = run_suite(args.repeat, args.roms, on_result=progress)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results_json(results), f, indent=2)
+        if baseline is not None:
+            regressions = compare(results, baseline, args.tolerance)
+            if regressions:
+                print(f"{len(regressions)} benchmark(s) more than {args.tolerance:g}% slower than the baseline")
+                sys.exit(1)
+        return
+
+    if args.asm:
+        lps = bench_assembler(args.asm, args.repeat)
+        print(f"{'assembler':<20} {lps:>14,.0f} lines/s ({args.asm:,} lines)")
+        return
+
+    if args.pages:
+        for source_path in args.pages:
+            report, executed, saved = bench_page_elision(source_path, args.cycles)
+            share = 100 * saved / executed if executed else 0.0
+            print(f"{source_path:<20} {report['removed']} page setups, {report['bytes']} bytes, "
+                  f"{saved:,} of {executed:,} executed instructions ({share:.1f}%)")
+        return
+
+    for rom_path in args.roms:
+        if not os.path.exists(rom_path):
+            print(f"Error: File '{rom_path}' does not exist.")
+            sys.exit(1)
+        ips = bench_rom(rom_path, args.cycles, args.repeat, block_cache=not args.no_block_cache)
+        print(f"{rom_path:<20} {ips:>14,.0f} instr/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+import os
+import sys
+import stat
+import queue
+import asyncio
+import argparse
+import threading
+
+from QCOMEmulator import QCOM, MEMORY_SIZE, PROGRAM_START, read_rom
+from QCOMISA import listing
+
+# QCOM debug server
+#
+# A line protocol over a local TCP or UNIX socket. Every request line gets
+# exactly one reply line, "ok ..." or "error <message>"; numbers are
+# accepted in any Python base (0x80, 128) and printed in hex. When the
+# machine stops on its own, every client gets an event line:
+#
+#   * stopped reason=breakpoint pc=0x0C7 cycles=1234
+#   * stopped reason=watchpoint addr=0x080 value=0x01 pc=0x0A2 cycles=5678
+#
+# Commands:
+#   pause | continue | step [N]
+#   regs | set (r0..r7|pc) VALUE
+#   read ADDR [LEN] | write ADDR HEXBYTES | disas [ADDR] [N]
+#   break ADDR | delete ADDR | watch ADDR [LEN] | unwatch ADDR [LEN] | info
+#   quit
+#
+# Breakpoints and watchpoints live in the machine (QCOM.add_breakpoint and
+# QCOM.add_watchpoint), where they cost nothing until one is hit.
+#
+# Run headless with:  python QCOMDebug.py ROM --listen 6502
+# or attach to the pygame emulator with:  python QCOMEmulator.py ROM --debug 6502
+
+DEFAULT_HOST = "127.0.0.1"
+RUN_CHUNK = 20000    # instructions between looks at the socket when headless
+MAX_STEP = 1 << 20
+MAX_READ = MEMORY_SIZE
+
+
+def parse_address(text):
+    """'6502', 'host:6502' or 'unix:/path' (any path with a '/') -> (kind, target)."""
+    if text.startswith("unix:"):
+        return "unix", text[len("unix:"):]
+    if "/" in text:
+        return "unix", text
+    host, _, port = text.rpartition(":")
+    return "tcp", (host or DEFAULT_HOST, int(port))
+
+
+def _number(text, limit=None):
+    try:
+        value = int(text, 0)
+    except ValueError:
+        raise ValueError(f"Not a number: {text}")
+    if value < 0 or (limit is not None and value >= limit):
+        raise ValueError(f"Out of range: {text}")
+    return value
+
+
+class Debugger:
+    """Runs debug commands against one machine.
+
+    Not thread-safe: call execute() and stop_event() from the thread that
+    runs the machine, between run() calls.
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self._reported = machine.halted  # a stop from before we attached is old news
+
+    def execute(self, line):
+        """Run one command line and return its reply line."""
+        words = line.split()
+        if not words:
+            return "error empty command"
+        handler = getattr(self, "cmd_" + words[0].lower(), None)
+        if handler is None:
+            return f"error unknown command: {words[0]}"
+        try:
+            return handler(*words[1:])
+        except TypeError:
+            return f"error wrong arguments for {words[0]}"
+        except ValueError as e:
+            return f"error {e}"
+        except Exception as e:
+            return f"error {type(e).__name__}: {e}"
+
+    def stop_event(self):
+        """The event line for a stop not yet reported, else None."""
+        machine = self.machine
+        if not machine.halted:
+            self._reported = False
+            return None
+        if self._reported:
+            return None
+        self._reported = True
+        reason = machine.break_reason
+        text = f"* stopped reason={reason[0] if reason else 'brk'}"
+        if reason and reason[0] == "watchpoint":
+            text += f" addr=0x{reason[1]:03X} value=0x{machine.memory[reason[1]]:02X}"
+        return text + f" pc=0x{machine.pc:03X} cycles={machine.cycles}"
+
+    @property
+    def running(self):
+        return not self.machine.halted
+
+    def _state(self):
+        machine = self.machine
+        if not machine.halted:
+            return "running"
+        return "paused" if machine.break_reason else "halted"
+
+    # ============================
+    # Commands
+    # ============================
+
+    def cmd_pause(self):
+        if self.running:
+            self.machine.debug_stop(("pause", self.machine.pc))
+            self._reported = True
+        return f"ok pc=0x{self.machine.pc:03X}"
+
+    def cmd_continue(self):
+        machine = self.machine
+        if machine.break_reason is None:
+            raise ValueError("machine is halted" if machine.halted else "already running")
+        machine.resume()
+        if machine.pc in machine.breakpoints:
+            machine.step()  # off the breakpoint we are sitting on
+        return "ok"
+
+    cmd_c = cmd_continue
+
+    def cmd_step(self, count="1"):
+        machine = self.machine
+        count = _number(count, MAX_STEP + 1)
+        if machine.halted and machine.break_reason is None:
+            raise ValueError("machine is halted")
+        machine.resume()
+        for _ in range(count):
+            machine.step()
+            if machine.halted:
+                break
+        if not machine.halted:
+            machine.debug_stop(("step", machine.pc))
+        # A watchpoint or BRK during the step is in the reply, not an event
+        self._reported = True
+        reason = machine.break_reason[0] if machine.break_reason else "brk"
+        return f"ok pc=0x{machine.pc:03X} cycles={machine.cycles} reason={reason}"
+
+    cmd_s = cmd_step
+
+    def cmd_regs(self):
+        machine = self.machine
+        regs = " ".join(f"r{i}=0x{value:02X}" for i, value in enumerate(machine.registers))
+        return (f"ok pc=0x{machine.pc:03X} {regs} zf={machine.get_zero_flag()} "
+                f"display=0x{machine.display_value:02X} cycles={machine.cycles} state={self._state()}")
+
+    def cmd_set(self, name, value):
+        machine = self.machine
+        name = name.lower()
+        if name == "pc":
+            machine.pc = _number(value, MEMORY_SIZE)
+        elif len(name) == 2 and name[0] == "r" and name[1] in "01234567":
+            machine.registers[int(name[1])] = _number(value, 0x100)
+        else:
+            raise ValueError(f"Unknown register: {name}")
+        return "ok"
+
+    def cmd_read(self, addr, length="1"):
+        addr = _number(addr, MEMORY_SIZE)
+        length = _number(length, MAX_READ + 1)
+        return "ok " + self.machine.memory[addr:addr + length].hex()
+
+    def cmd_write(self, addr, data):
+        addr = _number(addr, MEMORY_SIZE)
+        try:
+            data = bytes.fromhex(data)
+        except ValueError:
+            raise ValueError(f"Not hex bytes: {data}")
+        if addr + len(data) > MEMORY_SIZE:
+            raise ValueError("Write runs past the end of memory")
+        self.machine.write_memory(addr, data)
+        return "ok"
+
+    def cmd_disas(self, addr=None, count="8"):
+        start = self.machine.pc if addr is None else _number(addr, MEMORY_SIZE)
+        count = _number(count, MEMORY_SIZE)
+        lines = []
+        for pc, _, text in listing(self.machine.memory, start):
+            if len(lines) == count:
+                break
+            lines.append(f"0x{pc:03X}: {text}")
+        return "ok " + "; ".join(lines)
+
+    def _instruction_at(self, addr):
+        """(start, text) of the instruction covering ``addr`` in a sweep from PROGRAM_START."""
+        for pc, length, text in listing(self.machine.memory, PROGRAM_START, addr + 1):
+            if pc <= addr < pc + length:
+                return pc, text
+        return addr, None
+
+    def cmd_break(self, addr):
+        addr = _number(addr, MEMORY_SIZE)
+        # run() only stops where an instruction starts, so a breakpoint in
+        # the middle of one would never be hit
+        if addr >= PROGRAM_START:
+            start, text = self._instruction_at(addr)
+            if start != addr:
+                raise ValueError(f"0x{addr:03X} is inside the instruction at 0x{start:03X} ({text})")
+        self.machine.add_breakpoint(addr)
+        return "ok"
+
+    def cmd_delete(self, addr):
+        addr = _number(addr, MEMORY_SIZE)
+        if addr not in self.machine.breakpoints:
+            raise ValueError(f"No breakpoint at 0x{addr:03X}")
+        self.machine.remove_breakpoint(addr)
+        return "ok"
+
+    def _range(self, addr, length):
+        addr = _number(addr, MEMORY_SIZE)
+        length = _number(length)
+        if not length or addr + length > MEMORY_SIZE:
+            raise ValueError("Watch range must be inside memory")
+        return addr, length
+
+    def cmd_watch(self, addr, length="1"):
+        self.machine.add_watchpoint(*self._range(addr, length))
+        return "ok"
+
+    def cmd_unwatch(self, addr, length="1"):
+        self.machine.remove_watchpoint(*self._range(addr, length))
+        return "ok"
+
+    def cmd_info(self):
+        machine = self.machine
+        breaks = ",".join(f"0x{addr:03X}" for addr in sorted(machine.breakpoints))
+        # contiguous watched addresses print as one range
+        spans = []
+        for addr in sorted(machine.watchpoints):
+            if spans and spans[-1][1] == addr:
+                spans[-1][1] = addr + 1
+            else:
+                spans.append([addr, addr + 1])
+        watches = ",".join(f"0x{lo:03X}" if hi == lo + 1 else f"0x{lo:03X}-0x{hi - 1:03X}"
+                           for lo, hi in spans)
+        return f"ok breakpoints={breaks or '-'} watchpoints={watches or '-'} state={self._state()}"
+
+
+# ============================
+# Server
+# ============================
+
+class DebugServer:
+    """Serves a Debugger over asyncio streams.
+
+    ``call`` runs a command line and returns the reply; by default it is
+    the debugger's own execute(), for a server that shares the machine's
+    thread. ThreadedDebugServer hands commands to another thread instead.
+    """
+
+    def __init__(self, debugger, call=None):
+        self.debugger = debugger
+        self.call = call
+        self.clients = set()
+        self.server = None
+        self.path = None
+
+    async def start(self, address):
+        kind, target = parse_address(address)
+        if kind == "unix":
+            # A socket left by a previous run that did not exit cleanly
+            if os.path.exists(target) and stat.S_ISSOCK(os.stat(target).st_mode):
+                os.unlink(target)
+            self.server = await asyncio.start_unix_server(self._client, path=target)
+            self.path = target
+        else:
+            self.server = await asyncio.start_server(self._client, *target)
+        return self.server
+
+    def remove_socket(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+        self.path = None
+
+    def describe(self):
+        sockname = self.server.sockets[0].getsockname()
+        return sockname if isinstance(sockname, str) else f"{sockname[0]}:{sockname[1]}"
+
+    async def _client(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode("ascii", "replace").strip()
+                if line.lower() == "quit":
+                    writer.write(b"ok\n")
+                    break
+                try:
+                    if self.call is None:
+                        reply = self.debugger.execute(line)
+                    else:
+                        reply = await self.call(line)
+                except Exception as e:
+                    reply = f"error {type(e).__name__}: {e}"
+                writer.write(reply.encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    def broadcast(self, line):
+        for writer in list(self.clients):
+            try:
+                writer.write(line.encode() + b"\n")
+            except ConnectionError:
+                self.clients.discard(writer)
+
+    async def run_machine(self):
+        """Headless: run the machine flat out, yielding to clients between chunks."""
+        machine = self.debugger.machine
+        while True:
+            if machine.halted:
+                await asyncio.sleep(0.01)
+            else:
+                machine.run(RUN_CHUNK)
+                await asyncio.sleep(0)
+            event = self.debugger.stop_event()
+            if event is not None:
+                self.broadcast(event)
+
+
+class ThreadedDebugServer(DebugServer):
+    """A DebugServer on a background thread, for a front-end that owns the machine.
+
+    Commands queue up until the front-end calls poll() between frames, so
+    the machine is only ever touched from its own thread.
+    """
+
+    def __init__(self, debugger, address):
+        super().__init__(debugger, call=self._submit)
+        self.pending = queue.SimpleQueue()
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        error = []
+
+        def serve():
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self.start(address))
+            except OSError as e:
+                error.append(e)
+                return
+            finally:
+                started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=serve, name="qcom-debug", daemon=True)
+        self.thread.start()
+        started.wait()
+        if error:
+            raise error[0]
+
+    async def _submit(self, line):
+        future = self.loop.create_future()
+        self.pending.put((line, future))
+        return await future
+
+    def poll(self):
+        """Run queued commands and report a new stop. Call from the machine's thread."""
+        while True:
+            try:
+                line, future = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            self.loop.call_soon_threadsafe(future.set_result, self.debugger.execute(line))
+        event = self.debugger.stop_event()
+        if event is not None:
+            self.loop.call_soon_threadsafe(self.broadcast, event)
+
+    def close(self):
+        def stop():
+            self.server.close()
+            self.loop.stop()
+        self.loop.call_soon_threadsafe(stop)
+        self.thread.join()
+        self.remove_socket()
+
+
+async def serve_headless(machine, address, start_paused=True):
+    debugger = Debugger(machine)
+    if start_paused:
+        machine.debug_stop(("pause", machine.pc))
+        debugger.stop_event()  # nobody is connected to hear it yet
+    server = DebugServer(debugger)
+    await server.start(address)
+    print(f"Debug server listening on {server.describe()}"
+          f" ({'paused' if start_paused else 'running'})", flush=True)
+    try:
+        async with server.server:
+            await server.run_machine()
+    finally:
+        server.remove_socket()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a QCOM ROM headless under a debug server.")
+    parser.add_argument("rom", help="ROM (.qcom) or assembly source")
+    parser.add_argument("--listen", default="6502", metavar="ADDRESS",
+                        help="PORT, HOST:PORT or unix:PATH (default: 6502 on 127.0.0.1)")
+    parser.add_argument("--run", action="store_true",
+                        help="start running instead of paused")
+    parser.add_argument("--no-block-cache", action="store_true",
+                        help="interpret every instruction instead of running translated blocks")
+    args = parser.parse_args()
+
+    try:
+        machine = QCOM(read_rom(args.rom), block_cache=not args.no_block_cache,
+                       on_out=lambda port, value: print(f"OUT port {port}, value {value}"))
+        asyncio.run(serve_headless(machine, args.listen, start_paused=not args.run))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
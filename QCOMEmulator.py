@@ -1,6 +1,15 @@
-import pygame
 import sys
 import os
+import time
+import argparse
+import struct
+import zlib
+import hashlib
+import json
+from bisect import bisect_right
+from collections import deque, Counter
+
+from QCOMISA import OPCODES, LENGTHS, handler_name, disassemble
 
 #  QQQQ   CCC   OOO  MM MM
 # Q    Q C   C O   O M M M
@@ -11,52 +20,30 @@ import os
 # QCOM Official emulator
 
 # ============================
-# Check for ROM argument
-# ============================
-if len(sys.argv) < 2:
-    print("Usage: python emulator.py <rom_file>")
-    sys.exit(1)
-
-rom_path = sys.argv[1]
-if not os.path.exists(rom_path):
-    print(f"Error: File '{rom_path}' does not exist.")
-    sys.exit(1)
-
-# ============================
-# Load ROM into memory
+# Machine Constants
 # ============================
-with open(rom_path, "rb") as f:
-    memory = list(f.read())
+MEMORY_SIZE = 0x1000    # 16 pages of 256 bytes, selected by the top nibble of R7
+PROGRAM_START = 0x90    # Default Program Counter
+CONTROLLER_ADDR = 0x80  # Memory-mapped controller byte
+FRAMEBUFFER_SIZE = 0x80  # Display buffer at 0x00-0x7F, two pixels per byte
 
-# Ensure memory is at least 256 bytes, pad with zeros if smaller
-MEMORY_SIZE = 256
-if len(memory) < MEMORY_SIZE:
-    memory.extend([0] * (MEMORY_SIZE - len(memory)))
+# Bits in the write-watch map. A store to a byte with any bit set takes the
+# slow path through QCOM.watched_write(); every other store costs one lookup.
+WATCH_CODE = 0x01         # byte is covered by a translated block
+WATCH_FRAMEBUFFER = 0x02  # first framebuffer write since the last take_frame()
+WATCH_DEBUG = 0x04        # debugger watchpoint
 
-pc = 0x90  # Program Counter (pointer into memory)
-display_value = 0
+_WATCH_BITS = (WATCH_CODE, WATCH_FRAMEBUFFER, WATCH_DEBUG)
+_WATCH_SET = {bit: bytes(b | bit for b in range(256)) for bit in _WATCH_BITS}
+_WATCH_CLEAR = {bit: bytes(b & ~bit for b in range(256)) for bit in _WATCH_BITS}
 
-# Registers (8 general purpose for now)
-registers = [0] * 8
+# Save state layout: this header, then the 4 KiB memory image (zlib-compressed
+# in save files, raw in QCOM.state_bytes()). The controller byte lives in memory.
+STATE_MAGIC = b"QCST"
+STATE_VERSION = 1
+# magic, version, pc, display_value, halted, cycles, registers[8]
+STATE_HEADER = struct.Struct("<4sBHBBQ8s")
 
-# ============================
-# Instruction Handling
-# ============================
-
-# Utility to set or clear the zero flag (bit 0 of register 3)
-def set_zero_flag(value):
-    if value == 0:
-        registers[7] |= 0b00000001  # Set bit 0
-    else:
-        registers[7] &= 0b11111110  # Clear bit 0
-
-def get_zero_flag():
-    return registers[7] & 0b00000001
-
-def effective_address(addr):
-    # Get page from R7 (upper 4 bits)
-    page = (registers[7] >> 4) & 0x0F
-    return ((page << 8) | (addr & 0xFF)) % len(memory)
 
 def byte_to_pixels(byte_val):
     # Left pixel (bits 7-5)
@@ -74,638 +61,2377 @@ def byte_to_pixels(byte_val):
 
     return color1, color2
 
-def fetch_byte():
-    global pc
-    if pc < len(memory):
-        val = memory[pc]
-        pc += 1
-        return val
-    else:
-        return 0
 
-def handle_instruction(opcode):
-    global display_value, pc
-    # DIS
-    if opcode == 0x01:  # DIS IMM
-        imm = fetch_byte()
-        display_value = imm & 0xFF
-        print(f"DIS IMM {display_value}")
+# Byte -> 6 bytes of packed RGB for its two pixels
+PIXEL_PAIR_RGB = tuple(bytes(c1 + c2) for c1, c2 in map(byte_to_pixels, range(256)))
 
-    elif opcode == 0x02:  # DIS REG
-        reg = fetch_byte() & 0x07
-        display_value = registers[reg] & 0xFF
-        print(f"DIS R{reg} = {display_value}")
 
-    elif opcode == 0x03:  # DIS ADDR
-        addr = effective_address(fetch_byte())
-        display_value = memory[addr] & 0xFF
-        print(f"DIS MEM[{addr}] = {display_value}")
+FRAME_SIDE = 16  # the framebuffer is 16x16 pixels, 8 bytes per row
 
-    # IN
-    elif opcode == 0x04:  # IN REG
-        reg = fetch_byte() & 0x07
-        registers[reg] = memory[0x80] & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"IN R{reg} <- MEM[0x80] ({registers[reg]:08b})")
 
-    # OUT
-    elif opcode == 0x05:  # OUT IMM, IMM
-        port = fetch_byte()
-        val = fetch_byte() & 0xFF
-        print(f"OUT port {port}, value {val}")
+def frame_to_rgb(frame):
+    """Convert 128 framebuffer bytes into a 16x16 packed RGB image."""
+    return b"".join(map(PIXEL_PAIR_RGB.__getitem__, frame))
 
-    elif opcode == 0x06:  # OUT IMM, REG
-        port = fetch_byte()
-        reg = fetch_byte() & 0x07
-        print(f"OUT port {port}, R{reg}={registers[reg] & 0xFF}")
 
-    elif opcode == 0x07:  # OUT IMM, ADDR
-        port = fetch_byte()
-        addr = effective_address(fetch_byte())
-        print(f"OUT port {port}, MEM[{addr}]={memory[addr] & 0xFF}")
-
-    # BRK
-    elif opcode == 0x0F:
-        print("BRK - Break / Halt")
-        pygame.quit()
-        sys.exit()
-
-    # MOV
-    elif opcode == 0x10:  # MOV REG, IMM
-        reg = fetch_byte() & 0x07
-        imm = fetch_byte() & 0xFF
-        old = int(registers[reg])
-        registers[reg] = imm
-        set_zero_flag(registers[reg])
-        print(f"MOV R{reg}, {imm} | old={old} -> new={registers[reg]}")
-
-    elif opcode == 0x11:  # MOV ADDR, REG
-        addr = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        old = int(memory[addr])
-        memory[addr] = registers[reg] & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"MOV MEM[{addr}], R{reg} | old={old} -> new={memory[addr]}")
-
-    elif opcode == 0x12:  # MOV REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr = effective_address(fetch_byte())
-        old = int(registers[reg])
-        registers[reg] = memory[addr] & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"MOV R{reg}, MEM[{addr}] | old={old} -> new={registers[reg]}")
-
-    elif opcode == 0x13:  # MOV REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        old = int(registers[reg1])
-        registers[reg1] = registers[reg2] & 0xFF
-        set_zero_flag(registers[reg1])
-        print(f"MOV R{reg1}, R{reg2} | old={old} -> new={registers[reg1]}")
-
-    # SHW
-    elif opcode == 0x14:  # SHW
-        print("SHW - Show frame")
-        
-        # --- Render Display ---
-        screen.fill((0, 0, 0))
+# ============================
+# CPU Core
+# ============================
 
-        # --- Draw Game Board ---
-        addr = 0x0
-        for y in range(BOARD_SIZE):
-            for x in range(0, BOARD_SIZE, 2):
-                byte_val = memory[addr]
-                addr += 1
-                color1, color2 = byte_to_pixels(byte_val)
+# Opcode -> (mnemonic, operand kinds) and opcode -> length in bytes (0 for
+# undefined opcodes), generated from the ISA table in QCOMISA.py
+OPCODE_SYNTAX = OPCODES
+OPCODE_LENGTHS = LENGTHS
+
+BRANCH_OPCODES = frozenset((0x40, 0x41, 0x42, 0x43, 0x44, 0x45))
+
+# Trace levels
+TRACE_OFF = 0
+TRACE_BRANCHES = 1
+TRACE_FULL = 2
+TRACE_LEVELS = {"off": TRACE_OFF, "branches": TRACE_BRANCHES, "full": TRACE_FULL}
+
+
+class QCOM:
+    """A headless QCOM machine.
+
+    Holds its own memory, registers and program counter so any number of
+    machines can run side by side in one process. Nothing here touches
+    pygame: SHW calls ``on_show(machine)`` if one is given, and BRK sets
+    ``halted`` instead of exiting. An undefined opcode calls
+    ``on_unknown(machine, pc, opcode)``, or prints a warning without one.
+
+    ``coverage`` is an optional set that collects every control-flow edge
+    taken, as ``branch_end << 16 | to_pc`` for each JMP/JIF/JNI executed,
+    where ``branch_end`` is the address just past the branch. Edges depend
+    only on control flow, not on where a run() budget split a block.
+
+    A breakpoint or watchpoint stops the machine the way BRK does, by
+    setting ``halted``, and records why in ``break_reason``; resume()
+    undoes such a stop but not a BRK.
+    """
+
+    def __init__(self, rom=b"", on_show=None, on_out=None,
+                 trace_level=TRACE_OFF, trace_file=None, history=0, block_cache=True,
+                 profile=None, coverage=None, on_unknown=None):
+        self.rom = bytes(rom)
+        self.on_show = on_show
+        self.on_out = on_out
+        self.on_unknown = on_unknown
+        self.coverage = coverage
+        # Blocks are translated with or without profiling counters, so this
+        # is fixed for the machine's lifetime
+        self.profile = profile
+        # Tracing is checked once per run() call, so leaving it off costs nothing
+        self.trace_level = trace_level
+        self.trace_file = trace_file
+        self.history_size = history
+        self.block_cache = block_cache
+        self.breakpoints = set()
+        self.watchpoints = set()
+        self.reset()
+
+    @classmethod
+    def from_file(cls, rom_path, **kwargs):
+        with open(rom_path, "rb") as f:
+            return cls(f.read(), **kwargs)
+
+    def reset(self):
+        """Reload the ROM and put the CPU back into its power-on state."""
+        if len(self.rom) > MEMORY_SIZE:
+            raise ValueError(f"ROM is {len(self.rom)} bytes; QCOM memory is {MEMORY_SIZE} bytes")
+        # The ROM image is laid out from address 0 across as many pages as it
+        # needs; the rest of the 4 KiB address space starts zeroed.
+        self.memory = bytearray(MEMORY_SIZE)
+        self.memory[:len(self.rom)] = self.rom
+
+        self.pc = PROGRAM_START  # Program Counter (pointer into memory)
+        self.display_value = 0
+        # Registers (8 general purpose for now)
+        self.registers = [0] * 8
+        self.halted = False
+        self.break_reason = None
+        self.cycles = 0
+        # Ring buffer of (address, instruction count) runs of recently
+        # executed code; a translated block is one entry. Nothing is
+        # formatted until dump_history().
+        self.history = deque(maxlen=self.history_size) if self.history_size else None
+        self._watch = bytearray(len(self.memory))
+        for addr in self.watchpoints:
+            self._watch[addr] |= WATCH_DEBUG
+        self.fb_dirty = True
+        self._last_frame = None
+        self.flush_blocks()
+
+    def load_rom(self, rom, keep_ram=False):
+        """Swap in a new ROM and restart the CPU at PROGRAM_START.
+
+        With ``keep_ram`` only the program bytes are replaced: memory below
+        PROGRAM_START and past the end of both the old and the new program
+        keeps its contents.
+        """
+        old_rom, memory = self.rom, self.memory
+        old_end = max(len(old_rom), PROGRAM_START)
+        self.rom = bytes(rom)
+        try:
+            self.reset()
+        except ValueError:
+            self.rom = old_rom  # too big; memory was not touched
+            raise
+        if keep_ram:
+            end = max(old_end, len(self.rom))
+            self.memory[:PROGRAM_START] = memory[:PROGRAM_START]
+            self.memory[end:] = memory[end:]
+
+    def set_controller(self, controller_byte):
+        # Only a change is a store, so a watchpoint on the controller byte
+        # fires when input changes rather than on every host frame
+        if self.memory[CONTROLLER_ADDR] != controller_byte & 0xFF:
+            self.write_byte(CONTROLLER_ADDR, controller_byte & 0xFF)
+
+    def write_byte(self, addr, value):
+        self.memory[addr] = value
+        if self._watch[addr]:
+            self.watched_write(addr)
+
+    def watched_write(self, addr):
+        """Slow path for a store to a watched byte.
+
+        Returns True if the store invalidated translated code.
+        """
+        flags = self._watch[addr]
+        leave = False
+        if flags & WATCH_FRAMEBUFFER:
+            # One dirty mark per frame is enough; disarm until take_frame()
+            self.fb_dirty = True
+            self._set_watch(0, FRAMEBUFFER_SIZE, WATCH_FRAMEBUFFER, False)
+        if flags & WATCH_CODE:
+            self.invalidate(addr)
+            leave = True
+        if flags & WATCH_DEBUG:
+            self.debug_stop(("watchpoint", addr))
+            leave = True
+        return leave
+
+    def _set_watch(self, start, end, bit, on):
+        table = _WATCH_SET[bit] if on else _WATCH_CLEAR[bit]
+        self._watch[start:end] = self._watch[start:end].translate(table)
+
+    def take_frame(self):
+        """Return the framebuffer if it changed since the last call, else None."""
+        if not self.fb_dirty:
+            return None
+        self.fb_dirty = False
+        self._set_watch(0, FRAMEBUFFER_SIZE, WATCH_FRAMEBUFFER, True)
+        frame = bytes(self.memory[0:FRAMEBUFFER_SIZE])
+        if frame == self._last_frame:
+            return None  # written, but back to what was last shown
+        self._last_frame = frame
+        return frame
+
+    # ============================
+    # Block cache bookkeeping
+    # ============================
+
+    def flush_blocks(self):
+        """Forget every translated block."""
+        self._blocks = [None] * len(self.memory)  # start -> (function, length, end) or False
+        self._block_ranges = {}                   # start -> end, for invalidation
+        self._branch_blocks = set()               # starts of blocks that end in a branch
+        self._set_watch(0, len(self.memory), WATCH_CODE, False)
+
+    def _translate(self, pc):
+        if pc in self.breakpoints:
+            entry = (_stop_at_breakpoint, 0, pc)
+        else:
+            entry = translate_block(self.memory, pc, self.profile, self.breakpoints)
+        if entry is None:
+            # Remember that the interpreter owns this address until it changes
+            self._blocks[pc] = False
+            end = pc + 1
+        else:
+            self._blocks[pc] = entry
+            end = entry[2]
+            if self.coverage is not None and self._ends_in_branch(pc, end):
+                self._branch_blocks.add(pc)
+        self._block_ranges[pc] = end
+        self._set_watch(pc, end, WATCH_CODE, True)
+        return self._blocks[pc]
+
+    def _ends_in_branch(self, start, end):
+        memory = self.memory
+        addr = start
+        while addr + OPCODE_LENGTHS[memory[addr]] < end:
+            addr += OPCODE_LENGTHS[memory[addr]]
+        return memory[addr] in BRANCH_OPCODES
+
+    def invalidate(self, addr):
+        """Drop every cached block that covers ``addr``."""
+        stale = [(start, end) for start, end in self._block_ranges.items() if start <= addr < end]
+        if not stale:
+            return
+        for start, _ in stale:
+            del self._block_ranges[start]
+            self._blocks[start] = None
+            self._branch_blocks.discard(start)
+        # Only the span the stale blocks covered needs its code bits rebuilt
+        lo = min(start for start, _ in stale)
+        hi = max(end for _, end in stale)
+        self._set_watch(lo, hi, WATCH_CODE, False)
+        for start, end in self._block_ranges.items():
+            if start < hi and end > lo:
+                self._set_watch(max(start, lo), min(end, hi), WATCH_CODE, True)
+
+    # Utility to set or clear the zero flag (bit 0 of register 7)
+    def set_zero_flag(self, value):
+        if value == 0:
+            self.registers[7] |= 0b00000001  # Set bit 0
+        else:
+            self.registers[7] &= 0b11111110  # Clear bit 0
+
+    def get_zero_flag(self):
+        return self.registers[7] & 0b00000001
+
+    def effective_address(self, addr):
+        # Get page from R7 (upper 4 bits)
+        page = (self.registers[7] >> 4) & 0x0F
+        return (page << 8) | (addr & 0xFF)
+
+    def fetch_byte(self):
+        if self.pc < len(self.memory):
+            val = self.memory[self.pc]
+            self.pc += 1
+            return val
+        else:
+            return 0
+
+    def step(self):
+        """Execute a single instruction. Does nothing once halted."""
+        if self.halted:
+            return
+        self.cycles += 1
+        pc = self.pc
+        if pc < len(self.memory):
+            if self.history is not None:
+                self.history.append((pc, 1))
+            opcode = self.memory[pc]
+            if self.profile is not None:
+                self.profile.count_step(self, pc)
+            self.pc = pc + 1
+            self.DISPATCH[opcode](self)
+            if self.profile is not None and opcode in BRANCH_OPCODES:
+                self.profile.count_branch(pc, self.pc)
+            if self.coverage is not None and opcode in BRANCH_OPCODES:
+                self.coverage.add((pc + OPCODE_LENGTHS[opcode]) << 16 | self.pc)
+            if self.trace_level:
+                self.trace(pc, opcode)
+
+    def run(self, max_cycles):
+        """Run until BRK or until ``max_cycles`` instructions have executed.
+
+        Returns the number of cycles actually run.
+        """
+        start = self.cycles
+        if self.trace_level or (not self.block_cache and (self.history is not None or self.profile
+                                                          or self.coverage is not None
+                                                          or self.breakpoints)):
+            breakpoints = self.breakpoints
+            while not self.halted and self.cycles - start < max_cycles:
+                if self.pc in breakpoints:
+                    self.debug_stop(("breakpoint", self.pc))
+                    break
+                self.step()
+            return self.cycles - start
+
+        memory = self.memory
+        dispatch = self.DISPATCH
+        n = len(memory)
+        ran = 0
+        if not self.block_cache:
+            while ran < max_cycles and not self.halted:
+                pc = self.pc
+                if pc < n:
+                    self.pc = pc + 1
+                    dispatch[memory[pc]](self)
+                ran += 1
+            self.cycles += ran
+            return ran
+
+        regs = self.registers
+        blocks = self._blocks
+        history = self.history
+        profile = self.profile
+        coverage = self.coverage
+        branch_blocks = self._branch_blocks
+        while ran < max_cycles and not self.halted:
+            pc = self.pc
+            if pc >= n:
+                # Ran off the end of memory: nothing left to execute
+                ran = max_cycles
+                break
+            entry = blocks[pc]
+            if entry is None:
+                entry = self._translate(pc)
+            if entry and entry[1] <= max_cycles - ran:
+                self.pc, k = entry[0](self, regs, memory, self._watch)
+                if history is not None:
+                    history.append((pc, k))
+                if profile is not None:
+                    profile.count_block(entry, k, self.pc)
+                if coverage is not None and k == entry[1] and pc in branch_blocks:
+                    # the block ran through to its closing branch
+                    coverage.add(entry[2] << 16 | self.pc)
+                ran += k
+            else:
+                # Untranslatable, or the block would overrun the budget
+                if history is not None:
+                    history.append((pc, 1))
+                opcode = memory[pc]
+                if profile is not None:
+                    profile.count_step(self, pc)
+                self.pc = pc + 1
+                dispatch[opcode](self)
+                if profile is not None and opcode in BRANCH_OPCODES:
+                    profile.count_branch(pc, self.pc)
+                if coverage is not None and opcode in BRANCH_OPCODES:
+                    coverage.add((pc + OPCODE_LENGTHS[opcode]) << 16 | self.pc)
+                ran += 1
+        self.cycles += ran
+        return ran
+
+    # ============================
+    # Save states
+    # ============================
+
+    def state_header(self):
+        """Everything but memory, packed as STATE_HEADER."""
+        # A debugger stop is not part of the machine's state; BRK is
+        halted = self.halted and self.break_reason is None
+        return STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, self.pc, self.display_value,
+                                 halted, self.cycles, bytes(self.registers))
+
+    def state_bytes(self):
+        """Snapshot the machine as STATE_HEADER followed by raw memory."""
+        return self.state_header() + self.memory
+
+    def restore_state_bytes(self, raw):
+        """Restore a snapshot taken by state_bytes()."""
+        if len(raw) < STATE_HEADER.size:
+            raise ValueError("Not a QCOM save state (too short)")
+        magic, version, pc, display_value, halted, cycles, registers = STATE_HEADER.unpack_from(raw)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise ValueError("Not a QCOM save state (or an unsupported version)")
+        memory = memoryview(raw)[STATE_HEADER.size:]
+        if len(memory) != MEMORY_SIZE:
+            raise ValueError(f"Save state holds {len(memory)} bytes of memory, expected {MEMORY_SIZE}")
+        # Translated blocks whose bytes are unchanged stay valid, so restoring
+        # a nearby state (rewind) does not re-translate the whole program.
+        # Usually no code changed at all, which one compare of the span
+        # covered by blocks shows.
+        stale = []
+        ranges = self._block_ranges
+        if ranges:
+            lo, hi = min(ranges), max(ranges.values())
+            if self.memory[lo:hi] != memory[lo:hi]:
+                stale = [start for start, end in ranges.items()
+                         if self.memory[start:end] != memory[start:end]]
+        self.memory[:] = memory
+        for start in stale:
+            if start in self._block_ranges:
+                self.invalidate(start)
+        self.pc = pc
+        self.display_value = display_value
+        self.halted = bool(halted)
+        self.break_reason = None
+        self.cycles = cycles
+        self.registers[:] = registers
+        self.fb_dirty = True
+
+    def save_state(self):
+        """Return a compact save state: header plus zlib-compressed memory."""
+        raw = self.state_bytes()
+        return raw[:STATE_HEADER.size] + zlib.compress(raw[STATE_HEADER.size:])
+
+    def load_state(self, data):
+        """Restore a save state produced by save_state()."""
+        try:
+            memory = zlib.decompress(data[STATE_HEADER.size:])
+        except zlib.error as e:
+            raise ValueError(f"Corrupt QCOM save state: {e}")
+        self.restore_state_bytes(data[:STATE_HEADER.size] + memory)
+
+    # ============================
+    # Breakpoints and watchpoints
+    # ============================
+
+    def add_breakpoint(self, addr):
+        """Stop run() before it executes the instruction at ``addr``.
+
+        Blocks are re-translated to end in front of every breakpoint and a
+        breakpoint address gets a block of its own that only stops, so code
+        without breakpoints runs exactly as fast as before. step() ignores
+        breakpoints, which is how a debugger moves past one.
+        """
+        self.breakpoints.add(addr)
+        self.flush_blocks()
+
+    def remove_breakpoint(self, addr):
+        self.breakpoints.discard(addr)
+        self.flush_blocks()
+
+    def add_watchpoint(self, start, length=1):
+        """Stop after any store by the program into ``start``..``start + length``."""
+        self.watchpoints.update(range(start, start + length))
+        self._set_watch(start, start + length, WATCH_DEBUG, True)
+
+    def remove_watchpoint(self, start, length=1):
+        self.watchpoints.difference_update(range(start, start + length))
+        self._set_watch(start, start + length, WATCH_DEBUG, False)
+
+    def debug_stop(self, reason):
+        """Halt with ``reason``, e.g. ("breakpoint", pc), until resume()."""
+        self.halted = True
+        self.break_reason = reason
+
+    def resume(self):
+        """Undo a debug_stop(). A machine halted by BRK stays halted."""
+        if self.break_reason is not None:
+            self.halted = False
+            self.break_reason = None
+
+    def write_memory(self, addr, data):
+        """Store bytes from the host, e.g. a debugger.
+
+        Keeps translated code and the framebuffer in step, but never trips
+        a watchpoint: those are for stores by the program.
+        """
+        end = addr + len(data)
+        self.memory[addr:end] = data
+        for a in range(addr, end):
+            if self._watch[a] & WATCH_CODE:
+                self.invalidate(a)
+        if addr < FRAMEBUFFER_SIZE:
+            self.fb_dirty = True
+
+    # ============================
+    # Tracing
+    # ============================
+
+    def trace(self, pc, opcode):
+        if self.trace_level == TRACE_BRANCHES and opcode not in BRANCH_OPCODES:
+            return
+        text, length = disassemble(self.memory, pc)
+        if opcode in BRANCH_OPCODES:
+            taken = "taken" if self.pc != pc + length else "not taken"
+            line = f"{pc:03X}: {text:<20} -> 0x{self.pc:03X} ({taken})"
+        else:
+            regs = " ".join(f"{r:02X}" for r in self.registers)
+            line = f"{pc:03X}: {text:<20} R=[{regs}] ZF={self.get_zero_flag()}"
+        print(line, file=self.trace_file)
+
+    def dump_history(self, file=None):
+        """Print the recently executed instructions, oldest first."""
+        if not self.history:
+            return
+        lines = []
+        for pc, count in self.history:
+            for _ in range(count):
+                text, length = disassemble(self.memory, pc)
+                lines.append(f"{pc:03X}: {text}")
+                pc += length
+        lines = lines[-self.history_size:]
+        print(f"--- last {len(lines)} instructions ---", file=file)
+        for line in lines:
+            print(line, file=file)
+
+    def handle_instruction(self, opcode):
+        self.DISPATCH[opcode](self)
 
-                rect1 = pygame.Rect(board_x + x*cell_size, board_y + y*cell_size, cell_size, cell_size)
-                rect2 = pygame.Rect(board_x + (x+1)*cell_size, board_y + y*cell_size, cell_size, cell_size)
+    # DIS
+    def op_dis_imm(self):
+        imm = self.fetch_byte()
+        self.display_value = imm & 0xFF
 
-                pygame.draw.rect(screen, color1, rect1)
-                pygame.draw.rect(screen, color2, rect2)
+    def op_dis_reg(self):
+        reg = self.fetch_byte() & 0x07
+        self.display_value = self.registers[reg] & 0xFF
 
-        if show_fps:
-            fps = clock.get_fps()
-            fps_text = fps_font.render(f"FPS: {fps:.2f}", True, (255, 255, 255))
-            screen.blit(fps_text, (10, 10))
+    def op_dis_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        self.display_value = self.memory[addr] & 0xFF
 
-            # Display the display_value in top-right corner:
-            bin_str = f"{display_value:08b}"  # 8-bit binary string
-            hex_str = f"0x{display_value:02X}"
+    # IN
+    def op_in_reg(self):
+        reg = self.fetch_byte() & 0x07
+        self.registers[reg] = self.memory[0x80] & 0xFF
+        self.set_zero_flag(self.registers[reg])
 
-            bin_text = fps_font.render(bin_str, True, (255, 255, 255))
-            hex_text = fps_font.render(hex_str, True, (255, 255, 255))
+    # OUT
+    def op_out_imm_imm(self):
+        port = self.fetch_byte()
+        val = self.fetch_byte() & 0xFF
+        if self.on_out is not None:
+            self.on_out(port, val)
+
+    def op_out_imm_reg(self):
+        port = self.fetch_byte()
+        reg = self.fetch_byte() & 0x07
+        if self.on_out is not None:
+            self.on_out(port, self.registers[reg] & 0xFF)
+
+    def op_out_imm_addr(self):
+        port = self.fetch_byte()
+        addr = self.effective_address(self.fetch_byte())
+        if self.on_out is not None:
+            self.on_out(port, self.memory[addr] & 0xFF)
 
-            padding = 10
-            bin_pos = (WIDTH - bin_text.get_width() - padding, padding)
-            hex_pos = (WIDTH - hex_text.get_width() - padding, padding + bin_text.get_height())
+    # BRK
+    def op_brk(self):
+        self.halted = True
 
-            screen.blit(bin_text, bin_pos)
-            screen.blit(hex_text, hex_pos)
+    # MOV
+    def op_mov_reg_imm(self):
+        reg = self.fetch_byte() & 0x07
+        imm = self.fetch_byte() & 0xFF
+        self.registers[reg] = imm
+        self.set_zero_flag(self.registers[reg])
+
+    def op_mov_addr_reg(self):
+        addr = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        self.write_byte(addr, self.registers[reg] & 0xFF)
+        self.set_zero_flag(self.memory[addr])
+
+    def op_mov_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr = self.effective_address(self.fetch_byte())
+        self.registers[reg] = self.memory[addr] & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_mov_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        self.registers[reg1] = self.registers[reg2] & 0xFF
+        self.set_zero_flag(self.registers[reg1])
 
-        pygame.display.flip()
+    # SHW
+    def op_shw(self):
+        if self.on_show is not None:
+            self.on_show(self)
 
     # CLS
-    elif opcode == 0x15:
-        color = fetch_byte() & 0xFF
-        print(f"CLS - Clear screen to color {color}")
+    def op_cls_imm(self):
+        color = self.fetch_byte() & 0xFF
 
     # SBL / SBR / RBL / RBR
-    elif opcode == 0x18:  # SBL REG (Shift Left)
-        reg = fetch_byte() & 0x07
-        registers[reg] = ((registers[reg] << 1) & 0xFF)
-        set_zero_flag(registers[reg])
-        print(f"SBL R{reg} -> {registers[reg]:02X}")
-
-    elif opcode == 0x19:  # SBL ADDR (Shift Left)
-        addr = effective_address(fetch_byte())
-        memory[addr] = ((memory[addr] << 1) & 0xFF)
-        set_zero_flag(memory[addr])
-        print(f"SBL MEM[{addr}] -> {memory[addr]:02X}")
-
-    elif opcode == 0x1A:  # SBR REG (Shift Right)
-        reg = fetch_byte() & 0x07
-        registers[reg] = ((registers[reg] >> 1) & 0xFF)
-        set_zero_flag(registers[reg])
-        print(f"SBR R{reg} -> {registers[reg]:02X}")
-
-    elif opcode == 0x1B:  # SBR ADDR (Shift Right)
-        addr = effective_address(fetch_byte())
-        memory[addr] = ((memory[addr] >> 1) & 0xFF)
-        set_zero_flag(memory[addr])
-        print(f"SBR MEM[{addr}] -> {memory[addr]:02X}")
-
-    elif opcode == 0x1C:  # RBL REG (Rotate Left)
-        reg = fetch_byte() & 0x07
-        val = registers[reg]
-        registers[reg] = ((val << 1) & 0xFF) | ((val >> 7) & 0x01)
-        set_zero_flag(registers[reg])
-        print(f"RBL R{reg} -> {registers[reg]:02X}")
-
-    elif opcode == 0x1D:  # RBL ADDR (Rotate Left)
-        addr = effective_address(fetch_byte())
-        val = memory[addr]
-        memory[addr] = ((val << 1) & 0xFF) | ((val >> 7) & 0x01)
-        set_zero_flag(memory[addr])
-        print(f"RBL MEM[{addr}] -> {memory[addr]:02X}")
-
-    elif opcode == 0x1E:  # RBR REG (Rotate Right)
-        reg = fetch_byte() & 0x07
-        val = registers[reg]
-        registers[reg] = ((val >> 1) & 0xFF) | ((val & 0x01) << 7)
-        set_zero_flag(registers[reg])
-        print(f"RBR R{reg} -> {registers[reg]:02X}")
-
-    elif opcode == 0x1F:  # RBR ADDR (Rotate Right)
-        addr = effective_address(fetch_byte())
-        val = memory[addr]
-        memory[addr] = ((val >> 1) & 0xFF) | ((val & 0x01) << 7)
-        set_zero_flag(memory[addr])
-        print(f"RBR MEM[{addr}] -> {memory[addr]:02X}")
+    def op_sbl_reg(self):
+        reg = self.fetch_byte() & 0x07
+        self.registers[reg] = ((self.registers[reg] << 1) & 0xFF)
+        self.set_zero_flag(self.registers[reg])
+
+    def op_sbl_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        self.write_byte(addr, ((self.memory[addr] << 1) & 0xFF))
+        self.set_zero_flag(self.memory[addr])
+
+    def op_sbr_reg(self):
+        reg = self.fetch_byte() & 0x07
+        self.registers[reg] = ((self.registers[reg] >> 1) & 0xFF)
+        self.set_zero_flag(self.registers[reg])
+
+    def op_sbr_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        self.write_byte(addr, ((self.memory[addr] >> 1) & 0xFF))
+        self.set_zero_flag(self.memory[addr])
+
+    def op_rbl_reg(self):
+        reg = self.fetch_byte() & 0x07
+        val = self.registers[reg]
+        self.registers[reg] = ((val << 1) & 0xFF) | ((val >> 7) & 0x01)
+        self.set_zero_flag(self.registers[reg])
+
+    def op_rbl_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        val = self.memory[addr]
+        self.write_byte(addr, ((val << 1) & 0xFF) | ((val >> 7) & 0x01))
+        self.set_zero_flag(self.memory[addr])
+
+    def op_rbr_reg(self):
+        reg = self.fetch_byte() & 0x07
+        val = self.registers[reg]
+        self.registers[reg] = ((val >> 1) & 0xFF) | ((val & 0x01) << 7)
+        self.set_zero_flag(self.registers[reg])
+
+    def op_rbr_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        val = self.memory[addr]
+        self.write_byte(addr, ((val >> 1) & 0xFF) | ((val & 0x01) << 7))
+        self.set_zero_flag(self.memory[addr])
 
     # === LOGIC OPERATIONS ===
     # AND
-    elif opcode == 0x20:  # AND REG, IMM
-        reg = fetch_byte() & 0x07
-        imm = fetch_byte() & 0xFF
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] & imm) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"AND R{reg}, {imm:#04x} | {old:#04x} & {imm:#04x} = {registers[reg]:#04x}")
-
-    elif opcode == 0x21:  # AND ADDR, REG
-        addr = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        old = int(memory[addr])
-        memory[addr] = (memory[addr] & registers[reg]) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"AND MEM[{addr}], R{reg} | {old:#04x} & {registers[reg]:#04x} = {memory[addr]:#04x}")
-
-    elif opcode == 0x22:  # AND REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr = effective_address(fetch_byte())
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] & memory[addr]) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"AND R{reg}, MEM[{addr}] | {old:#04x} & {memory[addr]:#04x} = {registers[reg]:#04x}")
-
-    elif opcode == 0x23:  # AND REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        old = int(registers[reg1])
-        registers[reg1] = (registers[reg1] & registers[reg2]) & 0xFF
-        set_zero_flag(registers[reg1])
-        print(f"AND R{reg1}, R{reg2} | {old:#04x} & {registers[reg2]:#04x} = {registers[reg1]:#04x}")
+    def op_and_reg_imm(self):
+        reg = self.fetch_byte() & 0x07
+        imm = self.fetch_byte() & 0xFF
+        self.registers[reg] = (self.registers[reg] & imm) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_and_addr_reg(self):
+        addr = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        self.write_byte(addr, (self.memory[addr] & self.registers[reg]) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
+
+    def op_and_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr = self.effective_address(self.fetch_byte())
+        self.registers[reg] = (self.registers[reg] & self.memory[addr]) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_and_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        self.registers[reg1] = (self.registers[reg1] & self.registers[reg2]) & 0xFF
+        self.set_zero_flag(self.registers[reg1])
 
     # OR
-    elif opcode == 0x24:  # OR REG, IMM
-        reg = fetch_byte() & 0x07
-        imm = fetch_byte() & 0xFF
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] | imm) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"OR R{reg}, {imm:#04x} | {old:#04x} | {imm:#04x} = {registers[reg]:#04x}")
-
-    elif opcode == 0x25:  # OR ADDR, REG
-        addr = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        old = int(memory[addr])
-        memory[addr] = (memory[addr] | registers[reg]) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"OR MEM[{addr}], R{reg} | {old:#04x} | {registers[reg]:#04x} = {memory[addr]:#04x}")
-
-    elif opcode == 0x26:  # OR REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr = effective_address(fetch_byte())
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] | memory[addr]) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"OR R{reg}, MEM[{addr}] | {old:#04x} | {memory[addr]:#04x} = {registers[reg]:#04x}")
-
-    elif opcode == 0x27:  # OR REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        old = int(registers[reg1])
-        registers[reg1] = (registers[reg1] | registers[reg2]) & 0xFF
-        set_zero_flag(registers[reg1])
-        print(f"OR R{reg1}, R{reg2} | {old:#04x} | {registers[reg2]:#04x} = {registers[reg1]:#04x}")
+    def op_or_reg_imm(self):
+        reg = self.fetch_byte() & 0x07
+        imm = self.fetch_byte() & 0xFF
+        self.registers[reg] = (self.registers[reg] | imm) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_or_addr_reg(self):
+        addr = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        self.write_byte(addr, (self.memory[addr] | self.registers[reg]) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
+
+    def op_or_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr = self.effective_address(self.fetch_byte())
+        self.registers[reg] = (self.registers[reg] | self.memory[addr]) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_or_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        self.registers[reg1] = (self.registers[reg1] | self.registers[reg2]) & 0xFF
+        self.set_zero_flag(self.registers[reg1])
     
     # XOR
-    elif opcode == 0x28:  # XOR REG, IMM
-        reg = fetch_byte() & 0x07
-        imm = fetch_byte() & 0xFF
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] ^ imm) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"XOR R{reg}, {imm:#04x} | {old:#04x} ^ {imm:#04x} = {registers[reg]:#04x}")
-
-    elif opcode == 0x29:  # XOR ADDR, REG
-        addr = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        old = int(memory[addr])
-        memory[addr] = (memory[addr] ^ registers[reg]) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"XOR MEM[{addr}], R{reg} | {old:#04x} ^ {registers[reg]:#04x} = {memory[addr]:#04x}")
-
-    elif opcode == 0x2A:  # XOR REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr = effective_address(fetch_byte())
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] ^ memory[addr]) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"XOR R{reg}, MEM[{addr}] | {old:#04x} ^ {memory[addr]:#04x} = {registers[reg]:#04x}")
-
-    elif opcode == 0x2B:  # XOR REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        old = int(registers[reg1])
-        registers[reg1] = (registers[reg1] ^ registers[reg2]) & 0xFF
-        set_zero_flag(registers[reg1])
-        print(f"XOR R{reg1}, R{reg2} | {old:#04x} ^ {registers[reg2]:#04x} = {registers[reg1]:#04x}")
+    def op_xor_reg_imm(self):
+        reg = self.fetch_byte() & 0x07
+        imm = self.fetch_byte() & 0xFF
+        self.registers[reg] = (self.registers[reg] ^ imm) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_xor_addr_reg(self):
+        addr = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        self.write_byte(addr, (self.memory[addr] ^ self.registers[reg]) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
+
+    def op_xor_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr = self.effective_address(self.fetch_byte())
+        self.registers[reg] = (self.registers[reg] ^ self.memory[addr]) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_xor_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        self.registers[reg1] = (self.registers[reg1] ^ self.registers[reg2]) & 0xFF
+        self.set_zero_flag(self.registers[reg1])
 
     # NOT
-    elif opcode == 0x2C:  # NOT REG
-        reg = fetch_byte() & 0x07
-        old = int(registers[reg])
-        registers[reg] = (~registers[reg]) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"NOT R{reg} | ~{old:#04x} = {registers[reg]:#04x}")
-
-    elif opcode == 0x2D:  # NOT ADDR
-        addr = effective_address(fetch_byte())
-        old = int(memory[addr])
-        memory[addr] = (~memory[addr]) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"NOT MEM[{addr}] | ~{old:#04x} = {memory[addr]:#04x}")
+    def op_not_reg(self):
+        reg = self.fetch_byte() & 0x07
+        self.registers[reg] = (~self.registers[reg]) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_not_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        self.write_byte(addr, (~self.memory[addr]) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
 
     # === ARITHMETIC ===
     # ADD
-    elif opcode == 0x30:  # ADD REG, IMM
-        reg = fetch_byte() & 0x07
-        imm = fetch_byte() & 0xFF
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] + imm) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"ADD R{reg}, {imm} | {old} + {imm} = {registers[reg]}")
-
-    elif opcode == 0x31:  # ADD ADDR, REG
-        addr = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        old = int(memory[addr])
-        memory[addr] = (memory[addr] + registers[reg]) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"ADD MEM[{addr}], R{reg} | {old} + {registers[reg]} = {memory[addr]}")
-
-    elif opcode == 0x32:  # ADD REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr = effective_address(fetch_byte())
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] + memory[addr]) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"ADD R{reg}, MEM[{addr}] | {old} + {memory[addr]} = {registers[reg]}")
-
-    elif opcode == 0x33:  # ADD REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        old = int(registers[reg1])
-        registers[reg1] = (registers[reg1] + registers[reg2]) & 0xFF
-        set_zero_flag(registers[reg1])
-        print(f"ADD R{reg1}, R{reg2} | {old} + {registers[reg2]} = {registers[reg1]}")
+    def op_add_reg_imm(self):
+        reg = self.fetch_byte() & 0x07
+        imm = self.fetch_byte() & 0xFF
+        self.registers[reg] = (self.registers[reg] + imm) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_add_addr_reg(self):
+        addr = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        self.write_byte(addr, (self.memory[addr] + self.registers[reg]) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
+
+    def op_add_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr = self.effective_address(self.fetch_byte())
+        self.registers[reg] = (self.registers[reg] + self.memory[addr]) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_add_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        self.registers[reg1] = (self.registers[reg1] + self.registers[reg2]) & 0xFF
+        self.set_zero_flag(self.registers[reg1])
 
     # SUB
-    elif opcode == 0x34:  # SUB REG, IMM
-        reg = fetch_byte() & 0x07
-        imm = fetch_byte() & 0xFF
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] - imm) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"SUB R{reg}, {imm} | {old} - {imm} = {registers[reg]}")
-
-    elif opcode == 0x35:  # SUB ADDR, REG
-        addr = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        old = int(memory[addr])
-        memory[addr] = (memory[addr] - registers[reg]) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"SUB MEM[{addr}], R{reg} | {old} - {registers[reg]} = {memory[addr]}")
-
-    elif opcode == 0x36:  # SUB REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr = effective_address(fetch_byte())
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] - memory[addr]) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"SUB R{reg}, MEM[{addr}] | {old} - {memory[addr]} = {registers[reg]}")
-
-    elif opcode == 0x37:  # SUB REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        old = int(registers[reg1])
-        registers[reg1] = (registers[reg1] - registers[reg2]) & 0xFF
-        set_zero_flag(registers[reg1])
-        print(f"SUB R{reg1}, R{reg2} | {old} - {registers[reg2]} = {registers[reg1]}")
+    def op_sub_reg_imm(self):
+        reg = self.fetch_byte() & 0x07
+        imm = self.fetch_byte() & 0xFF
+        self.registers[reg] = (self.registers[reg] - imm) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_sub_addr_reg(self):
+        addr = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        self.write_byte(addr, (self.memory[addr] - self.registers[reg]) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
+
+    def op_sub_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr = self.effective_address(self.fetch_byte())
+        self.registers[reg] = (self.registers[reg] - self.memory[addr]) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_sub_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        self.registers[reg1] = (self.registers[reg1] - self.registers[reg2]) & 0xFF
+        self.set_zero_flag(self.registers[reg1])
 
     # INC
-    elif opcode == 0x38:  # INC REG
-        reg = fetch_byte() & 0x07
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] + 1) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"INC R{reg} | {old} + 1 = {registers[reg]}")
-
-    elif opcode == 0x39:  # INC ADDR
-        addr = effective_address(fetch_byte())
-        old = int(memory[addr])
-        memory[addr] = (memory[addr] + 1) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"INC MEM[{addr}] | {old} + 1 = {memory[addr]}")
+    def op_inc_reg(self):
+        reg = self.fetch_byte() & 0x07
+        self.registers[reg] = (self.registers[reg] + 1) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_inc_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        self.write_byte(addr, (self.memory[addr] + 1) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
 
     # DEC
-    elif opcode == 0x3A:  # DEC REG
-        reg = fetch_byte() & 0x07
-        old = int(registers[reg])
-        registers[reg] = (registers[reg] - 1) & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"DEC R{reg} | {old} - 1 = {registers[reg]}")
-
-    elif opcode == 0x3B:  # DEC ADDR
-        addr = effective_address(fetch_byte())
-        old = int(memory[addr])
-        memory[addr] = (memory[addr] - 1) & 0xFF
-        set_zero_flag(memory[addr])
-        print(f"DEC MEM[{addr}] | {old} - 1 = {memory[addr]}")
+    def op_dec_reg(self):
+        reg = self.fetch_byte() & 0x07
+        self.registers[reg] = (self.registers[reg] - 1) & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_dec_addr(self):
+        addr = self.effective_address(self.fetch_byte())
+        self.write_byte(addr, (self.memory[addr] - 1) & 0xFF)
+        self.set_zero_flag(self.memory[addr])
 
     # === JUMPING ===
-    elif opcode == 0x40:  # JMP IMM
-        addr = effective_address(fetch_byte())
-        # Print the addr in hex
-        print(f"JMP {addr:#04x} | jumping to {addr}")
-        if 0 <= addr < len(memory):
-            pc = addr
-
-    elif opcode == 0x41:  # JMP REG
-        reg = fetch_byte() & 0x07
-        print(f"JMP R{reg} | jumping to {registers[reg]}")
-        if 0 <= registers[reg] < len(memory):
-            pc = registers[reg]
-
-    elif opcode == 0x42:  # JIF IMM, IMM
-        imm1 = fetch_byte()
-        imm2 = effective_address(fetch_byte())
+    def op_jmp_imm(self):
+        addr = self.effective_address(self.fetch_byte())
+        if 0 <= addr < len(self.memory):
+            self.pc = addr
+
+    def op_jmp_reg(self):
+        reg = self.fetch_byte() & 0x07
+        if 0 <= self.registers[reg] < len(self.memory):
+            self.pc = self.registers[reg]
+
+    def op_jif_imm_imm(self):
+        imm1 = self.fetch_byte()
+        imm2 = self.effective_address(self.fetch_byte())
         cond = bool(imm1 & 0b00000001)
-        taken = cond and get_zero_flag()
-        print(f"JIF {imm1}, {imm2:#04x} | cond={cond}, ZF={get_zero_flag()} -> {'taken' if taken else 'not taken'}")
-        if taken and 0 <= imm2 < len(memory):
-            pc = imm2
-
-    elif opcode == 0x43:  # JIF IMM, REG
-        imm = fetch_byte()
-        reg = fetch_byte() & 0x07
+        taken = cond and self.get_zero_flag()
+        if taken and 0 <= imm2 < len(self.memory):
+            self.pc = imm2
+
+    def op_jif_imm_reg(self):
+        imm = self.fetch_byte()
+        reg = self.fetch_byte() & 0x07
         cond = bool(imm & 0b00000001)
-        taken = cond and get_zero_flag()
-        print(f"JIF {imm}, R{reg} | cond={cond}, ZF={get_zero_flag()} -> {'taken' if taken else 'not taken'}")
-        if taken and 0 <= registers[reg] < len(memory):
-            pc = registers[reg]
-
-    elif opcode == 0x44:  # JNI IMM, IMM
-        imm1 = fetch_byte()
-        imm2 = effective_address(fetch_byte())
+        taken = cond and self.get_zero_flag()
+        if taken and 0 <= self.registers[reg] < len(self.memory):
+            self.pc = self.registers[reg]
+
+    def op_jni_imm_imm(self):
+        imm1 = self.fetch_byte()
+        imm2 = self.effective_address(self.fetch_byte())
         cond = bool(imm1 & 0b00000001)
-        taken = cond and not get_zero_flag()
-        print(f"JNI {imm1}, {imm2:#04x} | cond={cond}, ZF={get_zero_flag()} -> {'taken' if taken else 'not taken'}")
-        if taken and 0 <= imm2 < len(memory):
-            pc = imm2
-
-    elif opcode == 0x45:  # JNI IMM, REG
-        imm = fetch_byte()
-        reg = fetch_byte() & 0x07
+        taken = cond and not self.get_zero_flag()
+        if taken and 0 <= imm2 < len(self.memory):
+            self.pc = imm2
+
+    def op_jni_imm_reg(self):
+        imm = self.fetch_byte()
+        reg = self.fetch_byte() & 0x07
         cond = bool(imm & 0b00000001)
-        taken = cond and not get_zero_flag()
-        print(f"JNI {imm}, R{reg} | cond={cond}, ZF={get_zero_flag()} -> {'taken' if taken else 'not taken'}")
-        if taken and 0 <= registers[reg] < len(memory):
-            pc = effective_address(registers[reg])
+        taken = cond and not self.get_zero_flag()
+        if taken and 0 <= self.registers[reg] < len(self.memory):
+            self.pc = self.effective_address(self.registers[reg])
 
     # --- Move Indirect Location ---
 
-    elif opcode == 0x50:  # MIL REG, IMM
-        reg = fetch_byte() & 0x07
-        imm = fetch_byte() & 0xFF
+    def op_mil_reg_imm(self):
+        reg = self.fetch_byte() & 0x07
+        imm = self.fetch_byte() & 0xFF
         # Set the point in memory referenced by the register to the immediate value
-        addr = effective_address(registers[reg])
-        old = int(memory[addr])
-        memory[addr] = imm
-        set_zero_flag(registers[reg])
-        print(f"MIL R{reg}, {imm} | old={old} -> new={registers[reg]}")
-
-    elif opcode == 0x51:  # MIL REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        addr = effective_address(registers[reg1])
-        old = int(memory[addr])
-        memory[addr] = registers[reg2] & 0xFF
-        set_zero_flag(registers[reg1])
-        print(f"MIL R{reg1}, R{reg2} | old={old} -> new={registers[reg1]}")
-
-    elif opcode == 0x52:  # MIL REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr2 = effective_address(fetch_byte())
-        addr1 = effective_address(registers[reg])
-        old = int(memory[addr1])
-        memory[addr1] = memory[addr2] & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"MIL R{reg}, MEM[{addr2}] | old={old} -> new={registers[reg]}")
-
-    elif opcode == 0x53:  # MIL ADDR, REG
-        addr1 = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        addr2 = effective_address(memory[addr1])
-        old = int(memory[addr2])
-        memory[addr2] = registers[reg] & 0xFF
-        set_zero_flag(memory[addr2])
-        print(f"MIL MEM[{addr1}], R{reg} | old={old} -> new={memory[addr2]}")
+        addr = self.effective_address(self.registers[reg])
+        self.write_byte(addr, imm)
+        self.set_zero_flag(self.registers[reg])
+
+    def op_mil_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        addr = self.effective_address(self.registers[reg1])
+        self.write_byte(addr, self.registers[reg2] & 0xFF)
+        self.set_zero_flag(self.registers[reg1])
+
+    def op_mil_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr2 = self.effective_address(self.fetch_byte())
+        addr1 = self.effective_address(self.registers[reg])
+        self.write_byte(addr1, self.memory[addr2] & 0xFF)
+        self.set_zero_flag(self.registers[reg])
+
+    def op_mil_addr_reg(self):
+        addr1 = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        addr2 = self.effective_address(self.memory[addr1])
+        self.write_byte(addr2, self.registers[reg] & 0xFF)
+        self.set_zero_flag(self.memory[addr2])
 
     # --- Move From Indirect ---
 
-    elif opcode == 0x54:  # MFI REG, REG
-        reg1 = fetch_byte() & 0x07
-        reg2 = fetch_byte() & 0x07
-        old = int(registers[reg1])
-        registers[reg1] = memory[effective_address(registers[reg2])]
-        set_zero_flag(registers[reg1])
-        print(f"MFI R{reg1}, R{reg2} | old={old} -> new={registers[reg1]}")
-
-    elif opcode == 0x55:  # MFI REG, ADDR
-        reg = fetch_byte() & 0x07
-        addr2 = effective_address(fetch_byte())
-        addr1 = effective_address(memory[addr2])
-        old = int(registers[reg])
-        registers[reg] = memory[addr1] & 0xFF
-        set_zero_flag(registers[reg])
-        print(f"MFI R{reg}, MEM[{addr2}] | old={old} -> new={registers[reg]}")
-
-    elif opcode == 0x56:  # MFI ADDR, REG
-        addr1 = effective_address(fetch_byte())
-        reg = fetch_byte() & 0x07
-        addr2 = effective_address(registers[reg])
-        old = int(memory[addr1])
-        memory[addr1] = memory[addr2] & 0xFF
-        set_zero_flag(memory[addr1])
-        print(f"MFI MEM[{addr1}], R{reg} | old={old} -> new={memory[addr1]}")
-
-    elif opcode == 0x57:  # MFI ADDR, ADDR
-        addr1 = effective_address(fetch_byte())
-        addr2 = effective_address(fetch_byte())
-        addr3 = effective_address(memory[addr2])
-        old = int(memory[addr1])
-        memory[addr1] = memory[addr3] & 0xFF
-        set_zero_flag(memory[addr1])
-        print(f"MFI MEM[{addr1}], MEM[{addr2}] | old={old} -> new={memory[addr1]}")
-
-    # Add more opcodes similarly...
+    def op_mfi_reg_reg(self):
+        reg1 = self.fetch_byte() & 0x07
+        reg2 = self.fetch_byte() & 0x07
+        self.registers[reg1] = self.memory[self.effective_address(self.registers[reg2])]
+        self.set_zero_flag(self.registers[reg1])
+
+    def op_mfi_reg_addr(self):
+        reg = self.fetch_byte() & 0x07
+        addr2 = self.effective_address(self.fetch_byte())
+        addr1 = self.effective_address(self.memory[addr2])
+        self.registers[reg] = self.memory[addr1] & 0xFF
+        self.set_zero_flag(self.registers[reg])
+
+    def op_mfi_addr_reg(self):
+        addr1 = self.effective_address(self.fetch_byte())
+        reg = self.fetch_byte() & 0x07
+        addr2 = self.effective_address(self.registers[reg])
+        self.write_byte(addr1, self.memory[addr2] & 0xFF)
+        self.set_zero_flag(self.memory[addr1])
+
+    def op_mfi_addr_addr(self):
+        addr1 = self.effective_address(self.fetch_byte())
+        addr2 = self.effective_address(self.fetch_byte())
+        addr3 = self.effective_address(self.memory[addr2])
+        self.write_byte(addr1, self.memory[addr3] & 0xFF)
+        self.set_zero_flag(self.memory[addr1])
+
+    # Trap for every opcode without a handler
+    def op_unknown(self, opcode):
+        if self.on_unknown is not None:
+            self.on_unknown(self, self.pc - 1, opcode)
+        else:
+            print(f"Unknown opcode: 0x{opcode:02X}")
+
+
+def _build_dispatch_table():
+    # Every opcode in the ISA runs the method named after its syntax
+    # (op_mov_reg_imm for MOV REG, IMM), so a missing one fails at import
+    table = []
+    for code in range(256):
+        if code in OPCODE_SYNTAX:
+            handler = getattr(QCOM, handler_name(code))
+        else:
+            handler = lambda machine, code=code: machine.op_unknown(code)
+        table.append(handler)
+    return tuple(table)
+
+
+# 256-entry opcode -> handler table, built once at import
+QCOM.DISPATCH = _build_dispatch_table()
 
-    else:
-        print(f"Unknown opcode: 0x{opcode:02X}")
 
+# ============================
+# Block Translation Cache
+# ============================
+#
+# Straight-line runs of code (up to and including the next JMP/JIF/JNI/BRK)
+# are decoded once into a generated Python function, cached by start address
+# and replayed without re-fetching or re-decoding operand bytes. Any write
+# into a byte covered by a cached block throws that block away; a block that
+# writes into cached code returns straight after the write so the rest of it
+# is re-decoded from the new bytes.
+
+MAX_BLOCK_LENGTH = 64  # instructions
+
+
+def _ea(offset):
+    return f"(((regs[7] & 0xF0) << 4) | {offset})"
+
+
+def _zf(value):
+    return f"regs[7] = regs[7] | 1 if {value} == 0 else regs[7] & 0xFE"
+
+
+def _reg_result(reg, expr):
+    return [f"v = {expr}", f"regs[{reg}] = v", _zf("v")]
+
+
+def _mem_result(offset, expr):
+    # ``x`` is the current value at the address, ``v`` the new one
+    return [f"a = {_ea(offset)}", "x = mem[a]", f"v = {expr}", "mem[a] = v", _zf("v")]
+
+
+def _binary(op):
+    """Templates for the four forms of a two-operand ALU instruction."""
+    def wrap(expr):
+        return expr if op in "&|^" else f"({expr}) & 0xFF"
+    return (
+        lambda a, b: _reg_result(a & 7, wrap(f"regs[{a & 7}] {op} {b}")),                   # REG, IMM
+        lambda a, b: _mem_result(a, wrap(f"x {op} regs[{b & 7}]")),                        # ADDR, REG
+        lambda a, b: _reg_result(a & 7, wrap(f"regs[{a & 7}] {op} mem[{_ea(b)}]")),        # REG, ADDR
+        lambda a, b: _reg_result(a & 7, wrap(f"regs[{a & 7}] {op} regs[{b & 7}]")),        # REG, REG
+    )
+
+
+def _unary(expr):
+    """Templates for the REG and ADDR forms of a one-operand instruction."""
+    return (
+        lambda a, b: [f"x = regs[{a & 7}]"] + _reg_result(a & 7, expr),
+        lambda a, b: _mem_result(a, expr),
+    )
+
+
+def _build_templates():
+    t = {
+        0x01: lambda a, b: [f"machine.display_value = {a}"],
+        0x02: lambda a, b: [f"machine.display_value = regs[{a & 7}]"],
+        0x03: lambda a, b: [f"machine.display_value = mem[{_ea(a)}]"],
+        0x04: lambda a, b: _reg_result(a & 7, f"mem[{CONTROLLER_ADDR}]"),
+        0x05: lambda a, b: [f"if machine.on_out is not None: machine.on_out({a}, {b})"],
+        0x06: lambda a, b: [f"if machine.on_out is not None: machine.on_out({a}, regs[{b & 7}])"],
+        0x07: lambda a, b: [f"if machine.on_out is not None: machine.on_out({a}, mem[{_ea(b)}])"],
+        0x10: lambda a, b: [f"regs[{a & 7}] = {b}", "regs[7] |= 1" if b == 0 else "regs[7] &= 0xFE"],
+        0x11: lambda a, b: _mem_result(a, f"regs[{b & 7}]"),
+        0x12: lambda a, b: _reg_result(a & 7, f"mem[{_ea(b)}]"),
+        0x13: lambda a, b: _reg_result(a & 7, f"regs[{b & 7}]"),
+        0x15: lambda a, b: [],
+        # MIL: ZF follows the pointer register, except for MIL ADDR, REG
+        0x50: lambda a, b: [f"a = {_ea(f'regs[{a & 7}]')}", f"mem[a] = {b}", _zf(f"regs[{a & 7}]")],
+        0x51: lambda a, b: [f"a = {_ea(f'regs[{a & 7}]')}", f"mem[a] = regs[{b & 7}]", _zf(f"regs[{a & 7}]")],
+        0x52: lambda a, b: [f"x = mem[{_ea(b)}]", f"a = {_ea(f'regs[{a & 7}]')}", "mem[a] = x",
+                            _zf(f"regs[{a & 7}]")],
+        0x53: lambda a, b: [f"a = {_ea(f'mem[{_ea(a)}]')}", f"v = regs[{b & 7}]", "mem[a] = v", _zf("v")],
+        # MFI
+        0x54: lambda a, b: _reg_result(a & 7, f"mem[{_ea(f'regs[{b & 7}]')}]"),
+        0x55: lambda a, b: _reg_result(a & 7, f"mem[{_ea(f'mem[{_ea(b)}]')}]"),
+        0x56: lambda a, b: _mem_result(a, f"mem[{_ea(f'regs[{b & 7}]')}]"),
+        0x57: lambda a, b: _mem_result(a, f"mem[{_ea(f'mem[{_ea(b)}]')}]"),
+    }
+    for base, op in ((0x20, "&"), (0x24, "|"), (0x28, "^"), (0x30, "+"), (0x34, "-")):
+        for i, template in enumerate(_binary(op)):
+            t[base + i] = template
+    for base, expr in ((0x18, "(x << 1) & 0xFF"), (0x1A, "x >> 1"),
+                       (0x1C, "((x << 1) & 0xFF) | (x >> 7)"), (0x1E, "(x >> 1) | ((x & 1) << 7)"),
+                       (0x2C, "x ^ 0xFF"), (0x38, "(x + 1) & 0xFF"), (0x3A, "(x - 1) & 0xFF")):
+        t[base], t[base + 1] = _unary(expr)
+    return t
+
+
+# Opcode -> function(operand1, operand2) returning the body lines
+BLOCK_TEMPLATES = _build_templates()
+
+
+def _terminator(opcode, a, b, nxt, k):
+    """Lines that end a block: BRK and the jumps."""
+    if opcode == 0x0F:
+        return ["machine.halted = True", f"return {nxt}, {k}"]
+    if opcode == 0x40:
+        return [f"return {_ea(a)}, {k}"]
+    if opcode == 0x41:
+        return [f"return regs[{a & 7}], {k}"]
+    zf = "regs[7] & 1" if opcode in (0x42, 0x43) else "not regs[7] & 1"
+    if not a & 1:
+        return [f"return {nxt}, {k}"]
+    if opcode in (0x42, 0x44):
+        return [f"if {zf}: return {_ea(b)}, {k}", f"return {nxt}, {k}"]
+    target = f"regs[{b & 7}]" if opcode == 0x43 else _ea(f"regs[{b & 7}]")
+    return [f"if {zf}: return {target}, {k}", f"return {nxt}, {k}"]
+
+
+BLOCK_TERMINATORS = frozenset((0x0F,)) | BRANCH_OPCODES
+
+# Block source -> compiled code, shared by every machine in the process:
+# code that comes back (a rewind, a reloaded ROM, a fuzzer undoing a
+# mutation) is not compiled again
+_BLOCK_CODE = {}
+BLOCK_CODE_CACHE_SIZE = 8192
+
+
+def _stop_at_breakpoint(machine, regs, mem, watch):
+    """Block installed at a breakpoint address: runs nothing and stops."""
+    machine.debug_stop(("breakpoint", machine.pc))
+    return machine.pc, 0
+
+
+def translate_block(memory, start, profile=None, stops=()):
+    """Decode the straight-line run of code at ``start`` into a function.
+
+    Returns ``(function, length, end)`` where ``function(machine, regs, mem,
+    watch)`` runs the block and returns ``(next_pc, instructions_run)``,
+    ``length`` is the number of instructions in the block and ``end`` is one
+    past the last byte decoded. Returns None if the first instruction
+    cannot be translated (unknown opcode, or operands running off the end of
+    memory); the interpreter handles those.
+
+    With a ``profile`` the block also counts its memory accesses into it,
+    and a fourth item, the block's id in the profile, is returned. The
+    block ends early in front of any address in ``stops`` (breakpoints).
+    """
+    n = len(memory)
+    lines = []
+    ops = []
+    pc = start
+    k = 0
+    while k < MAX_BLOCK_LENGTH:
+        if pc >= n or (k and pc in stops):
+            break
+        opcode = memory[pc]
+        length = OPCODE_LENGTHS[opcode]
+        if not length or pc + length > n:
+            break
+        a = memory[pc + 1] if length > 1 else 0
+        b = memory[pc + 2] if length > 2 else 0
+        nxt = pc + length
+        k += 1
+        if profile is not None:
+            ops.append((pc, opcode))
+            reads, writes = MEMORY_ACCESSES.get(opcode, _no_access)(a, b)
+            lines.extend(f"rd[{addr}] += 1" for addr in reads)
+            lines.extend(f"wr[{addr}] += 1" for addr in writes)
+
+        if opcode in BLOCK_TERMINATORS:
+            lines.extend(_terminator(opcode, a, b, nxt, k))
+            pc = nxt
+            break
+
+        if opcode == 0x14:  # SHW hands control to the front-end, so sync pc first
+            lines.append(f"if machine.on_show is not None: machine.pc = {nxt}; machine.on_show(machine)")
+        else:
+            body = BLOCK_TEMPLATES[opcode](a, b)
+            lines.extend(body)
+            if any(line.startswith("mem[a] = ") for line in body):
+                # Watched store; leave now if it hit translated code
+                lines.append(f"if watch[a] and machine.watched_write(a): return {nxt}, {k}")
+        pc = nxt
+
+    if k == 0:
+        return None
+    if not lines or not lines[-1].startswith("return"):
+        lines.append(f"return {pc}, {k}")
+
+    source = "def block(machine, regs, mem, watch):\n" + "".join(f"    {line}\n" for line in lines)
+    code = _BLOCK_CODE.get(source)
+    if code is None:
+        if len(_BLOCK_CODE) >= BLOCK_CODE_CACHE_SIZE:
+            _BLOCK_CODE.clear()
+        code = _BLOCK_CODE[source] = compile(source, f"<qcom block 0x{start:03X}>", "exec")
+    if profile is None:
+        namespace = {}
+        exec(code, namespace)
+        return namespace["block"], k, pc
+    namespace = {"rd": profile.reads, "wr": profile.writes}
+    exec(code, namespace)
+    return namespace["block"], k, pc, profile.add_block(ops)
 
 
 # ============================
-# Pygame Setup
+# Profiler
 # ============================
-pygame.init()
-WIDTH, HEIGHT = 640, 480
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Simple Emulator Display")
 
-clock = pygame.time.Clock()
-fps_font = pygame.font.SysFont("Arial", 18)
-show_fps = False
+def _no_access(a, b):
+    return (), ()
+
+
+def _read_modify_write(a, b):
+    return (_ea(a),), (_ea(a),)
+
+
+def _build_accesses():
+    t = {
+        0x03: lambda a, b: ((_ea(a),), ()),
+        0x04: lambda a, b: ((str(CONTROLLER_ADDR),), ()),
+        0x07: lambda a, b: ((_ea(b),), ()),
+        0x11: lambda a, b: ((), (_ea(a),)),
+        0x12: lambda a, b: ((_ea(b),), ()),
+        0x50: lambda a, b: ((), (_ea(f"regs[{a & 7}]"),)),
+        0x51: lambda a, b: ((), (_ea(f"regs[{a & 7}]"),)),
+        0x52: lambda a, b: ((_ea(b),), (_ea(f"regs[{a & 7}]"),)),
+        0x53: lambda a, b: ((_ea(a),), (_ea(f"mem[{_ea(a)}]"),)),
+        0x54: lambda a, b: ((_ea(f"regs[{b & 7}]"),), ()),
+        0x55: lambda a, b: ((_ea(b), _ea(f"mem[{_ea(b)}]")), ()),
+        0x56: lambda a, b: ((_ea(f"regs[{b & 7}]"),), (_ea(a),)),
+        0x57: lambda a, b: ((_ea(b), _ea(f"mem[{_ea(b)}]")), (_ea(a),)),
+    }
+    for base in (0x18, 0x1A, 0x1C, 0x1E, 0x2C, 0x38, 0x3A):
+        t[base + 1] = _read_modify_write
+    for base in (0x20, 0x24, 0x28, 0x30, 0x34):
+        t[base + 1] = _read_modify_write
+        t[base + 2] = lambda a, b: ((_ea(b),), ())
+    return t
+
+
+# Opcode -> function(operand1, operand2) returning (reads, writes): address
+# expressions, evaluated against the registers and memory as they are
+# *before* the instruction runs
+MEMORY_ACCESSES = _build_accesses()
+
+
+def _syntax_text(opcode):
+    if opcode not in OPCODE_SYNTAX:
+        return f"DB 0x{opcode:02X}"
+    mnemonic, kinds = OPCODE_SYNTAX[opcode]
+    return f"{mnemonic} {', '.join(kinds)}".strip()
+
+
+class Profile:
+    """Execution, branch and memory-access counts gathered while a QCOM runs.
+
+    A translated block counts one run per execution and its memory accesses
+    inline; per-instruction counts are only expanded when a report is
+    built, so profiling is cheap enough to leave on for long runs.
+    """
+
+    def __init__(self):
+        self.reads = [0] * MEMORY_SIZE
+        self.writes = [0] * MEMORY_SIZE
+        self.block_ops = []            # block id -> ((pc, opcode), ...)
+        self.block_hits = []           # block id -> runs
+        self.block_branch = []         # block id -> pc of its closing branch, or -1
+        self.partial_runs = Counter()  # (block id, instructions run) for blocks left early
+        self.steps = Counter()         # (pc, opcode) run by the interpreter
+        self.back_edges = Counter()    # (branch pc, target) for branches taken backwards
+        self._access = {}              # (opcode, a, b) -> access function, for the interpreter
+
+    def add_block(self, ops):
+        self.block_ops.append(tuple(ops))
+        self.block_hits.append(0)
+        pc, opcode = ops[-1]
+        self.block_branch.append(pc if opcode in BRANCH_OPCODES else -1)
+        return len(self.block_ops) - 1
+
+    def count_block(self, entry, k, next_pc):
+        if not k:
+            return  # stopped at a breakpoint
+        block_id = entry[3]
+        self.block_hits[block_id] += 1
+        if k != entry[1]:
+            self.partial_runs[(block_id, k)] += 1
+        elif next_pc <= self.block_branch[block_id]:
+            self.back_edges[(self.block_branch[block_id], next_pc)] += 1
+
+    def count_step(self, machine, pc):
+        """Count one interpreted instruction; call before it runs."""
+        memory = machine.memory
+        opcode = memory[pc]
+        self.steps[(pc, opcode)] += 1
+        if opcode not in MEMORY_ACCESSES:
+            return
+        a = memory[pc + 1] if pc + 1 < len(memory) else 0
+        b = memory[pc + 2] if pc + 2 < len(memory) else 0
+        access = self._access.get((opcode, a, b))
+        if access is None:
+            reads, writes = MEMORY_ACCESSES[opcode](a, b)
+            access = eval(f"lambda regs, mem: (({''.join(r + ', ' for r in reads)}), "
+                          f"({''.join(w + ', ' for w in writes)}))")
+            self._access[(opcode, a, b)] = access
+        reads, writes = access(machine.registers, memory)
+        for addr in reads:
+            self.reads[addr] += 1
+        for addr in writes:
+            self.writes[addr] += 1
+
+    def count_branch(self, pc, target):
+        if target <= pc:
+            self.back_edges[(pc, target)] += 1
+
+    def instruction_counts(self):
+        """Return a Counter of (pc, opcode) -> times executed."""
+        counts = Counter(self.steps)
+        left_early = Counter()
+        for (block_id, k), runs in self.partial_runs.items():
+            left_early[block_id] += runs
+            for op in self.block_ops[block_id][:k]:
+                counts[op] += runs
+        for block_id, ops in enumerate(self.block_ops):
+            runs = self.block_hits[block_id] - left_early[block_id]
+            if runs:
+                for op in ops:
+                    counts[op] += runs
+        return counts
+
+    def report(self, memory, source_map=None, top=20, file=None):
+        """Print hot addresses, hot loops, the instruction mix and memory traffic."""
+        counts = self.instruction_counts()
+        total = sum(counts.values())
+
+        def out(line=""):
+            print(line.rstrip(), file=file)
+
+        def where(addr):
+            return source_map.describe(addr) if source_map is not None else ""
+
+        out(f"=== QCOM profile: {total:,} instructions ===")
+        if not total:
+            return
+
+        out()
+        out(f"Hot addresses (top {top})")
+        for (pc, opcode), n in counts.most_common(top):
+            text = disassemble(memory, pc)[0] if memory[pc] == opcode else _syntax_text(opcode)
+            out(f"  {pc:03X} {n:>12,} {100 * n / total:6.2f}%  {text:<22} {where(pc)}")
+
+        out()
+        out("Hot loops (backward branches taken)")
+        for (branch, target), n in self.back_edges.most_common(top):
+            body = sum(c for (pc, _), c in counts.items() if target <= pc <= branch)
+            out(f"  {branch:03X} -> {target:03X} {n:>10,} iterations {100 * body / total:6.2f}% "
+                f"of instructions  {where(target)}")
+
+        out()
+        out("Instruction mix")
+        mix = Counter()
+        for (pc, opcode), n in counts.items():
+            mix[opcode] += n
+        for opcode, n in mix.most_common():
+            out(f"  {_syntax_text(opcode):<16} {n:>12,} {100 * n / total:6.2f}%")
+
+        out()
+        out(f"Memory traffic (top {top})")
+        busiest = sorted(range(MEMORY_SIZE), key=lambda a: self.reads[a] + self.writes[a], reverse=True)
+        for addr in busiest[:top]:
+            if not self.reads[addr] + self.writes[addr]:
+                break
+            out(f"  {addr:03X} reads {self.reads[addr]:>10,} writes {self.writes[addr]:>10,}  {where(addr)}")
+
+
+# A QCOMpiler source map sits next to the ROM as <rom>.map.json:
+#   {"source": "Painter.txt",
+#    "ranges": [{"start": 144, "end": 150, "line": 3, "text": "MOV R0 $1", "kind": "code"}, ...],
+#    "labels": {"#1": 160, ...}}
+# ``kind`` is "code" for the programmer's instruction and "page_setup" for
+# the R7 page bytes the assembler injects ahead of a label operand.
+SOURCE_MAP_SUFFIX = ".map.json"
+
+
+class SourceMap:
+    """Attributes ROM addresses to assembly source lines and labels."""
+
+    def __init__(self, ranges, labels, source=None):
+        self.ranges = sorted(ranges, key=lambda r: r["start"])
+        self.labels = labels
+        self.source = source
+        self._starts = [r["start"] for r in self.ranges]
+        self._labels = sorted((addr, name) for name, addr in labels.items())
+        self._label_starts = [addr for addr, _ in self._labels]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["ranges"], data.get("labels", {}), data.get("source"))
+
+    def lookup(self, addr):
+        """Return the range covering ``addr``, or None."""
+        i = bisect_right(self._starts, addr) - 1
+        if i >= 0 and addr < self.ranges[i]["end"]:
+            return self.ranges[i]
+        return None
+
+    def label_before(self, addr):
+        """Return the nearest label at or before ``addr`` as (name, address)."""
+        i = bisect_right(self._label_starts, addr) - 1
+        if i < 0:
+            return None
+        address, name = self._labels[i]
+        return name, address
+
+    def describe(self, addr):
+        entry = self.lookup(addr)
+        if entry is None:
+            return ""
+        text = f"line {entry['line']}"
+        label = self.label_before(addr)
+        if label is not None:
+            name, address = label
+            text += f" {name}" + (f"+{addr - address}" if addr != address else "")
+        text += f": {entry['text']}"
+        if entry["kind"] == "page_setup":
+            text += " (page setup)"
+        return text
 
-BOARD_SIZE = 16
-board_pixels = min(WIDTH, HEIGHT)
-cell_size = board_pixels // BOARD_SIZE
 
-board_x = (WIDTH - board_pixels) // 2
-board_y = (HEIGHT - board_pixels) // 2
+# ============================
+# Frame Scheduler
+# ============================
+
+MIN_SPEED = 1 / 64
+MAX_SPEED = 64
+UNTHROTTLED_CHUNK = 5000  # instructions between clock checks when unthrottled
+
+
+class Scheduler:
+    """Decides how many instructions the CPU gets per host frame.
+
+    Throttled, the budget is ``hz * speed / fps`` (the fractional part is
+    carried over so the long-run rate is exact). Unthrottled, the CPU runs
+    flat out for one frame's worth of wall time.
+    """
+
+    def __init__(self, hz=1000, fps=60, unthrottled=False):
+        self.hz = hz
+        self.fps = fps
+        self.unthrottled = unthrottled
+        self.speed = 1.0  # turbo / slow-motion multiplier
+        self._carry = 0.0
+
+    def faster(self):
+        self.speed = min(self.speed * 2, MAX_SPEED)
+
+    def slower(self):
+        self.speed = max(self.speed / 2, MIN_SPEED)
+
+    def reset_speed(self):
+        self.speed = 1.0
+
+    def run_frame(self, machine):
+        """Run one frame's worth of instructions. Returns the number run."""
+        if self.unthrottled:
+            deadline = time.perf_counter() + 1.0 / self.fps
+            ran = 0
+            while not machine.halted and time.perf_counter() < deadline:
+                ran += machine.run(UNTHROTTLED_CHUNK)
+            return ran
+
+        self._carry += self.hz * self.speed / self.fps
+        budget = int(self._carry)
+        self._carry -= budget
+        return machine.run(budget)
+
 
 # ============================
-# Main Loop
+# Rewind Buffer
 # ============================
-running = True
-while running:
-    # --- Handle Events ---
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_f:
-                show_fps = not show_fps
-
-        # --- Update Controller State ---
-    keys = pygame.key.get_pressed()
-    controller_byte = 0
-
-    if keys[pygame.K_w]: controller_byte |= (1 << 7)
-    if keys[pygame.K_s]: controller_byte |= (1 << 6)
-    if keys[pygame.K_a]: controller_byte |= (1 << 5)
-    if keys[pygame.K_d]: controller_byte |= (1 << 4)
-    if keys[pygame.K_SPACE]: controller_byte |= (1 << 3)
-    if keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT]: controller_byte |= (1 << 2)
-    if keys[pygame.K_RETURN]: controller_byte |= (1 << 1)
-    if keys[pygame.K_BACKSPACE]: controller_byte |= (1 << 0)
-
-    memory[0x80] = controller_byte
-
-    # --- Emulation Step ---
-    if pc < len(memory):
-        opcode = memory[pc]
-        pc += 1
-        handle_instruction(opcode)
 
-    # --- Render Display ---
-    # screen.fill((0, 0, 0))
+def _xor_bytes(a, b):
+    n = len(a)
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(n, "little")
+
+
+class Rewind:
+    """Bounded ring buffer of recent machine states, newest last.
+
+    Snapshots are grouped behind a keyframe stored whole (zlib). The rest of
+    a group is stored as the zlib-compressed XOR against that keyframe,
+    which is nearly all zeros when little changed, so any snapshot restores
+    with one decompress and one XOR. Whole groups are dropped, oldest
+    first, once the buffer holds more than ``max_bytes``.
+    """
+
+    def __init__(self, keyframe_interval=30, max_bytes=4 << 20):
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._groups = deque()  # [keyframe, [delta, ...]], all zlib-compressed
+        self._key = None        # raw state of the newest keyframe
+
+    def __len__(self):
+        return sum(1 + len(deltas) for _, deltas in self._groups)
+
+    def push(self, machine):
+        """Snapshot ``machine`` onto the buffer."""
+        raw = machine.state_bytes()
+        if not self._groups or 1 + len(self._groups[-1][1]) >= self.keyframe_interval:
+            packed = zlib.compress(raw, 1)
+            self._groups.append([packed, []])
+            self._key = raw
+        else:
+            packed = zlib.compress(_xor_bytes(raw, self._key), 1)
+            self._groups[-1][1].append(packed)
+        self.nbytes += len(packed)
+        while self.nbytes > self.max_bytes and len(self._groups) > 1:
+            key, deltas = self._groups.popleft()
+            self.nbytes -= len(key) + sum(map(len, deltas))
+
+    def pop(self, machine):
+        """Restore the newest snapshot into ``machine`` and drop it.
+
+        Returns False if the buffer is empty.
+        """
+        if not self._groups:
+            return False
+        key, deltas = self._groups[-1]
+        if deltas:
+            packed = deltas.pop()
+            raw = _xor_bytes(zlib.decompress(packed), self._key)
+        else:
+            packed = key
+            raw = self._key
+            self._groups.pop()
+            self._key = zlib.decompress(self._groups[-1][0]) if self._groups else None
+        self.nbytes -= len(packed)
+        machine.restore_state_bytes(raw)
+        return True
+
+    def clear(self):
+        self._groups.clear()
+        self._key = None
+        self.nbytes = 0
 
-    # if show_fps:
-    #     fps = clock.get_fps()
-    #     fps_text = fps_font.render(f"FPS: {fps:.2f}", True, (255, 255, 255))
-    #     screen.blit(fps_text, (10, 10))
 
-    # # Display the display_value in top-right corner:
-    # bin_str = f"{display_value:08b}"  # 8-bit binary string
-    # hex_str = f"0x{display_value:02X}"
+# ============================
+# Input Recording
+# ============================
+
+INPUT_MAGIC = b"QCIN"
+INPUT_VERSION = 1
+# magic, version, end cycle, start state length; then the start state, then
+# (cycle delta varint, controller byte) pairs until EOF
+INPUT_HEADER = struct.Struct("<4sBQI")
+
+
+def _append_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class InputRecording:
+    """Controller changes stamped with the cycle they took effect at.
+
+    ``start_state`` is the save state the session began from, so a
+    recording started after a state load still replays exactly.
+    ``events`` holds (cycle, controller byte) pairs in cycle order.
+    """
+
+    def __init__(self, start_state, events=(), end_cycle=0):
+        self.start_state = start_state
+        self.events = list(events)
+        self.end_cycle = end_cycle
+
+    def to_bytes(self):
+        out = bytearray(INPUT_HEADER.pack(INPUT_MAGIC, INPUT_VERSION, self.end_cycle,
+                                          len(self.start_state)))
+        out += self.start_state
+        last = STATE_HEADER.unpack_from(self.start_state)[5]  # cycles at start
+        for cycle, controller_byte in self.events:
+            _append_varint(out, cycle - last)
+            out.append(controller_byte)
+            last = cycle
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < INPUT_HEADER.size:
+            raise ValueError("Not a QCOM input recording (too short)")
+        magic, version, end_cycle, state_len = INPUT_HEADER.unpack_from(data)
+        if magic != INPUT_MAGIC or version != INPUT_VERSION:
+            raise ValueError("Not a QCOM input recording (or an unsupported version)")
+        pos = INPUT_HEADER.size
+        start_state = data[pos:pos + state_len]
+        if state_len < STATE_HEADER.size or pos + state_len > len(data):
+            raise ValueError("Truncated QCOM input recording")
+        pos += state_len
+        cycle = STATE_HEADER.unpack_from(start_state)[5]
+        events = []
+        try:
+            while pos < len(data):
+                delta, pos = _read_varint(data, pos)
+                cycle += delta
+                events.append((cycle, data[pos]))
+                pos += 1
+        except IndexError:
+            raise ValueError("Truncated QCOM input recording")
+        return cls(start_state, events, end_cycle)
+
+
+class InputRecorder:
+    """Feeds controller bytes to a machine and logs the ones that change."""
+
+    def __init__(self, machine):
+        self.restart(machine)
+
+    def restart(self, machine):
+        """Start a fresh recording from the machine's current state."""
+        self.start_state = machine.save_state()
+        self.events = []
+        self._last = None
+
+    def set_controller(self, machine, controller_byte):
+        if controller_byte != self._last:
+            self.events.append((machine.cycles, controller_byte))
+            self._last = controller_byte
+        machine.set_controller(controller_byte)
+
+    def rewound(self, machine):
+        """Forget input after the machine's (restored) cycle count."""
+        cycle = machine.cycles
+        while self.events and self.events[-1][0] >= cycle:
+            self.events.pop()
+        # Pin the controller byte the restored state holds
+        self._last = machine.memory[CONTROLLER_ADDR]
+        self.events.append((cycle, self._last))
+
+    def recording(self, machine):
+        return InputRecording(self.start_state, self.events, machine.cycles)
+
+
+def replay(machine, recording):
+    """Run ``recording`` on ``machine`` headless, as fast as the CPU allows.
+
+    Each controller change lands at exactly the cycle it was recorded at.
+    Returns the number of cycles run.
+    """
+    machine.load_state(recording.start_state)
+    start = machine.cycles
+    for cycle, controller_byte in recording.events:
+        if cycle > machine.cycles:
+            machine.run(cycle - machine.cycles)
+        if machine.halted:
+            break
+        machine.set_controller(controller_byte)
+    if recording.end_cycle > machine.cycles:
+        machine.run(recording.end_cycle - machine.cycles)
+    return machine.cycles - start
 
-    # # Create text surfaces
-    # bin_text = fps_font.render(bin_str, True, (255, 255, 255))
-    # hex_text = fps_font.render(hex_str, True, (255, 255, 255))
 
-    # # Position at top right, with some padding
-    # padding = 10
-    # bin_pos = (WIDTH - bin_text.get_width() - padding, padding)
-    # hex_pos = (WIDTH - hex_text.get_width() - padding, padding + bin_text.get_height())
+# ============================
+# Frame Capture
+# ============================
 
-    # screen.blit(bin_text, bin_pos)
-    # screen.blit(hex_text, hex_pos)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png_bytes(rgb, width, height):
+    """Encode packed 8-bit RGB as a PNG file."""
+    stride = width * 3
+    # Filter type 0 (None) in front of every scanline
+    raw = b"".join(b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (PNG_SIGNATURE + _png_chunk(b"IHDR", header)
+            + _png_chunk(b"IDAT", zlib.compress(raw)) + _png_chunk(b"IEND", b""))
+
+
+class FrameCapture:
+    """Writes every frame a machine shows: raw RGB, numbered PNGs and/or a hash log.
+
+    Pass ``capture.on_show`` as the machine's on_show. Unless
+    ``keep_duplicates``, a frame identical to the one before is skipped;
+    take_frame() already knows, without hashing frames nobody wrote to.
+
+    ``raw`` is a binary file that gets ``side * side * 3`` bytes per frame,
+    where side is 16 * ``scale``. ``png_dir`` gets frame-000000.png and on.
+    ``hash_log`` is a text file with one "frame shw sha1" line per frame:
+    the frame number, how many SHWs had run when it was shown and the
+    SHA-1 of its 128 framebuffer bytes. SHWs rather than cycles, because
+    run() only brings ``cycles`` up to date when it returns.
+    """
+
+    def __init__(self, raw=None, png_dir=None, hash_log=None, scale=1, keep_duplicates=False):
+        self.raw = raw
+        self.png_dir = png_dir
+        self.hash_log = hash_log
+        self.scale = scale
+        self.keep_duplicates = keep_duplicates
+        self.side = FRAME_SIDE * scale
+        self.frames = 0
+        self.shows = 0
+        self._pixels = tuple(bytes(c1 * scale + c2 * scale) for c1, c2 in map(byte_to_pixels, range(256)))
+
+    def on_show(self, machine):
+        self.shows += 1
+        if self.keep_duplicates:
+            frame = bytes(machine.memory[:FRAMEBUFFER_SIZE])
+        else:
+            frame = machine.take_frame()
+            if frame is None:
+                return
+        self.write(frame)
+
+    def write(self, frame):
+        n = self.frames
+        self.frames += 1
+        if self.hash_log is not None:
+            self.hash_log.write(f"{n} {self.shows} {hashlib.sha1(frame).hexdigest()}\n")
+        if self.raw is None and self.png_dir is None:
+            return
+        rgb = self.rgb(frame)
+        if self.raw is not None:
+            self.raw.write(rgb)
+        if self.png_dir is not None:
+            with open(os.path.join(self.png_dir, f"frame-{n:06d}.png"), "wb") as f:
+                f.write(png_bytes(rgb, self.side, self.side))
+
+    def rgb(self, frame):
+        """The frame as packed RGB, each pixel blown up to ``scale`` x ``scale``."""
+        if self.scale == 1:
+            return frame_to_rgb(frame)
+        pixels = self._pixels
+        return b"".join(b"".join(map(pixels.__getitem__, frame[y:y + 8])) * self.scale
+                        for y in range(0, FRAMEBUFFER_SIZE, 8))
+
+
+# ============================
+# Library API
+# ============================
 
-    # # --- Draw Game Board ---
-    # addr = 0x80
-    # for y in range(BOARD_SIZE):
-    #     for x in range(0, BOARD_SIZE, 2):  # 2 pixels per byte
-    #         byte_val = memory[addr]
-    #         addr += 1
-    #         color1, color2 = byte_to_pixels(byte_val)
+DEFAULT_RUN_CYCLES = 1_000_000
+
+
+def run(rom, cycles=DEFAULT_RUN_CYCLES, inputs=(), **options):
+    """Run ``rom`` headless in a fresh machine and return the machine.
+
+    Stops at BRK or after ``cycles`` instructions. ``inputs`` is either a
+    controller byte held from the start or (cycle, controller byte) pairs,
+    each applied exactly when the machine reaches that cycle. ``options``
+    go to QCOM(), e.g. block_cache or profile.
+    """
+    machine = QCOM(rom, **options)
+    if isinstance(inputs, int):
+        inputs = [(0, inputs)]
+    for cycle, controller_byte in sorted(inputs):
+        if cycle >= cycles:
+            break
+        if cycle > machine.cycles:
+            machine.run(cycle - machine.cycles)
+        if machine.halted:
+            break
+        machine.set_controller(controller_byte)
+    if cycles > machine.cycles:
+        machine.run(cycles - machine.cycles)
+    return machine
 
-    #         # Left pixel
-    #         rect1 = pygame.Rect(board_x + x*cell_size, board_y + y*cell_size, cell_size, cell_size)
-    #         pygame.draw.rect(screen, color1, rect1)
 
-    #         # Right pixel
-    #         rect2 = pygame.Rect(board_x + (x+1)*cell_size, board_y + y*cell_size, cell_size, cell_size)
-    #         pygame.draw.rect(screen, color2, rect2)
+# ============================
+# CPU Worker Process
+# ============================
+#
+# With --worker the CPU runs in its own process, so window drags, the FPS
+# overlay and display.flip() no longer stall emulation. The worker
+# publishes the machine into a shared memory segment after every slice:
+#
+#   [0, STATE_SIZE)   the state_bytes() image: STATE_HEADER, then memory
+#   SHARED_TAIL       state sequence, frame sequence, controller byte
+#   FRAMEBUFFER_SIZE  the framebuffer as of the last SHW that changed it
+#
+# A sequence number is odd while the worker is writing its part, so a
+# reader that sees the same even number before and after reading got a
+# consistent copy. The controller byte is the only thing the front-end
+# writes. Other tools (memory viewers) attach by name, read-only, with
+# SharedState.attach(name, readonly=True).
+
+STATE_SIZE = STATE_HEADER.size + MEMORY_SIZE
+SHARED_TAIL = struct.Struct("<IIB")
+SHARED_SEQ = struct.Struct("<I")
+STATE_SEQ_OFFSET = STATE_SIZE
+FRAME_SEQ_OFFSET = STATE_SIZE + 4
+CONTROLLER_OFFSET = STATE_SIZE + 8
+SHARED_FRAME = STATE_SIZE + SHARED_TAIL.size
+SHARED_SIZE = SHARED_FRAME + FRAMEBUFFER_SIZE
+WORKER_JOIN_TIMEOUT = 2.0  # seconds to wait for a worker to quit before killing it
+
+
+class SharedState:
+    """View of a machine published in a shared memory segment.
+
+    ``memory`` and ``frame`` are memoryviews straight into the segment, so
+    reading them copies nothing.
+    """
+
+    def __init__(self, shm, readonly=False):
+        self.shm = shm
+        self.buf = shm.buf.toreadonly() if readonly else shm.buf
+        self.memory = self.buf[STATE_HEADER.size:STATE_SIZE]
+        self.frame = self.buf[SHARED_FRAME:SHARED_SIZE]
+        self._state_seq = 0
+        self._frame_seq = 0
+
+    @classmethod
+    def create(cls, name=None):
+        from multiprocessing import shared_memory
+        return cls(shared_memory.SharedMemory(name=name, create=True, size=SHARED_SIZE))
+
+    @classmethod
+    def attach(cls, name, readonly=False, track=False):
+        """Attach to an existing segment.
+
+        Before Python 3.13 every process that attaches registers the segment
+        with its resource tracker, which unlinks it when that process exits.
+        Tools outside the emulator's process tree must not do that, so
+        ``track`` is off unless the caller was started by the emulator.
+        """
+        from multiprocessing import shared_memory, resource_tracker
+        if track:
+            return cls(shared_memory.SharedMemory(name=name), readonly)
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, readonly)
+
+    def close(self):
+        # Views into the segment must go before the mapping can
+        self.frame.release()
+        self.memory.release()
+        if self.buf is not self.shm.buf:
+            self.buf.release()
+        self.shm.close()
+
+    # --- Worker side ---
+
+    def publish(self, machine):
+        """Copy the machine's registers and memory into the segment."""
+        self._state_seq += 1
+        SHARED_SEQ.pack_into(self.buf, STATE_SEQ_OFFSET, self._state_seq)
+        self.buf[:STATE_HEADER.size] = machine.state_header()
+        self.memory[:] = machine.memory
+        self._state_seq += 1
+        SHARED_SEQ.pack_into(self.buf, STATE_SEQ_OFFSET, self._state_seq)
+
+    def publish_frame(self, frame):
+        self._frame_seq += 1
+        SHARED_SEQ.pack_into(self.buf, FRAME_SEQ_OFFSET, self._frame_seq)
+        self.frame[:] = frame
+        self._frame_seq += 1
+        SHARED_SEQ.pack_into(self.buf, FRAME_SEQ_OFFSET, self._frame_seq)
+
+    # --- Reader side ---
+
+    @property
+    def state_seq(self):
+        return SHARED_SEQ.unpack_from(self.buf, STATE_SEQ_OFFSET)[0]
+
+    @property
+    def frame_seq(self):
+        return SHARED_SEQ.unpack_from(self.buf, FRAME_SEQ_OFFSET)[0]
+
+    @property
+    def controller(self):
+        return self.buf[CONTROLLER_OFFSET]
+
+    @controller.setter
+    def controller(self, value):
+        self.buf[CONTROLLER_OFFSET] = value & 0xFF
+
+    def header(self):
+        """STATE_HEADER fields as last published (not checked for tearing)."""
+        return STATE_HEADER.unpack_from(self.buf)
+
+    @property
+    def display_value(self):
+        return self.header()[3]
+
+    @property
+    def halted(self):
+        return bool(self.header()[4])
+
+    def snapshot(self):
+        """A consistent state_bytes() image, retried while the worker is mid-publish."""
+        while True:
+            seq = self.state_seq
+            if not seq & 1:
+                raw = bytes(self.buf[:STATE_SIZE])
+                if self.state_seq == seq:
+                    return raw
+            time.sleep(0)
+
+
+def cpu_worker(shm_name, rom, conn, hz, fps, unthrottled, dump_on_brk, options):
+    """Body of the worker process: run the CPU and publish it until told to quit.
+
+    Commands arrive on ``conn`` as (command, argument) pairs. ``speed`` and
+    ``quit`` get no reply; ``save`` answers with a save state, ``load`` and
+    ``rom`` with None or an error message.
+    """
+    shared = SharedState.attach(shm_name, track=True)
+
+    def on_show(machine):
+        frame = machine.take_frame()
+        if frame is not None:
+            shared.publish_frame(frame)
+
+    def on_out(port, value):
+        print(f"OUT port {port}, value {value}")
+
+    machine = QCOM(rom, on_show=on_show, on_out=on_out, **options)
+    scheduler = Scheduler(hz=hz, fps=fps, unthrottled=unthrottled)
+    on_show(machine)
+    shared.publish(machine)
+    next_slice = time.perf_counter()
+    try:
+        while True:
+            while conn.poll():
+                command, arg = conn.recv()
+                if command == "quit":
+                    if machine.halted and dump_on_brk:
+                        machine.dump_history()
+                    return
+                elif command == "speed":
+                    scheduler.speed = arg
+                elif command == "save":
+                    conn.send(machine.save_state())
+                elif command in ("load", "rom"):
+                    try:
+                        if command == "load":
+                            machine.load_state(arg)
+                        else:
+                            machine.load_rom(*arg)
+                    except ValueError as e:
+                        conn.send(str(e))
+                    else:
+                        conn.send(None)
+                    on_show(machine)
+
+            if not machine.halted:
+                machine.set_controller(shared.controller)
+                scheduler.run_frame(machine)
+            shared.publish(machine)
+
+            next_slice += 1.0 / fps
+            delay = next_slice - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_slice = time.perf_counter()  # fell behind; don't try to catch up
+    except Exception:
+        machine.dump_history(sys.stderr)
+        raise
+    finally:
+        shared.close()
+
+
+class CPUWorker:
+    """The front-end's handle on a CPU running in a worker process."""
+
+    def __init__(self, rom, hz=1000, fps=60, unthrottled=False, dump_on_brk=False, name=None, **options):
+        import multiprocessing
+        # spawn, not fork: the worker must not inherit pygame's state
+        context = multiprocessing.get_context("spawn")
+        self.shared = SharedState.create(name)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=cpu_worker, daemon=True,
+            args=(self.shared.shm.name, rom, child_conn, hz, fps, unthrottled, dump_on_brk, options))
+        self.process.start()
+        child_conn.close()
+
+    @property
+    def name(self):
+        return self.shared.shm.name
+
+    def send(self, command, arg=None):
+        self.conn.send((command, arg))
+
+    def request(self, command, arg=None):
+        self.send(command, arg)
+        return self.conn.recv()
+
+    def close(self):
+        """Stop the worker and remove the segment."""
+        if self.process.is_alive():
+            try:
+                self.send("quit")
+            except OSError:
+                pass
+            self.process.join(WORKER_JOIN_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.conn.close()
+        self.shared.close()
+        self.shared.shm.unlink()
 
-    # pygame.display.flip()
-    clock.tick(1000)
 
 # ============================
-# Cleanup
+# Pygame Front-end
 # ============================
-pygame.quit()
-sys.exit()
+
+SOURCE_EXTENSIONS = (".asm", ".txt")
+WATCH_INTERVAL = 0.25  # seconds between checks of a --watch ROM
+
+
+def read_rom(rom_path, cache=None):
+    """ROM bytes from a .qcom file, or assembled from a QCOMpiler source."""
+    if rom_path.endswith(SOURCE_EXTENSIONS):
+        import QCOMpiler
+        with open(rom_path, "r") as f:
+            return QCOMpiler.assemble(f.read(), cache=cache)
+    with open(rom_path, "rb") as f:
+        return f.read()
+
+
+def write_profile(machine, rom_path, args):
+    source_map = None
+    map_path = args.source_map or os.path.splitext(rom_path)[0] + SOURCE_MAP_SUFFIX
+    if args.source_map or os.path.exists(map_path):
+        try:
+            source_map = SourceMap.load(map_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: ignoring source map '{map_path}': {e}")
+    if args.profile == "-":
+        machine.profile.report(machine.memory, source_map)
+    else:
+        with open(args.profile, "w") as f:
+            machine.profile.report(machine.memory, source_map, file=f)
+        print(f"Profile written to '{args.profile}'")
+
+
+def run_headless(rom_path, args):
+    """--replay, --headless and frame capture: no window, full speed."""
+    # Raw frames on stdout push the messages over to stderr
+    log = sys.stderr if args.raw_out == "-" else sys.stdout
+    files = []
+    capture = recording = None
+    try:
+        if args.raw_out or args.png_dir or args.hash_log:
+            raw = hash_log = None
+            if args.raw_out == "-":
+                raw = sys.stdout.buffer
+            elif args.raw_out:
+                raw = open(args.raw_out, "wb")
+                files.append(raw)
+            if args.hash_log == "-":
+                hash_log = sys.stdout
+            elif args.hash_log:
+                hash_log = open(args.hash_log, "w")
+                files.append(hash_log)
+            if args.png_dir:
+                os.makedirs(args.png_dir, exist_ok=True)
+            capture = FrameCapture(raw, args.png_dir, hash_log, scale=args.scale,
+                                   keep_duplicates=args.keep_duplicates)
+        if args.replay:
+            with open(args.replay, "rb") as f:
+                recording = InputRecording.from_bytes(f.read())
+        machine = QCOM(read_rom(rom_path), history=args.history,
+                       on_show=capture.on_show if capture is not None else None,
+                       block_cache=not args.no_block_cache,
+                       profile=Profile() if args.profile else None)
+        start = time.perf_counter()
+        if recording is not None:
+            ran = replay(machine, recording)
+        else:
+            ran = machine.run(args.cycles)
+        elapsed = time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=log)
+        sys.exit(1)
+    finally:
+        for f in files:
+            f.close()
+    rate = ran / elapsed if elapsed > 0 else 0
+    if recording is not None:
+        print(f"Replayed {len(recording.events)} input changes over {ran} cycles "
+              f"in {elapsed:.3f}s ({rate:,.0f} instr/s)", file=log)
+    else:
+        print(f"Ran {ran} cycles in {elapsed:.3f}s ({rate:,.0f} instr/s)", file=log)
+    if capture is not None:
+        fps = capture.frames / elapsed if elapsed > 0 else 0
+        print(f"Captured {capture.frames} frames from {capture.shows} SHWs ({fps:,.0f} frames/s)", file=log)
+    regs = " ".join(f"{r:02X}" for r in machine.registers)
+    print(f"Final state: PC=0x{machine.pc:03X} R=[{regs}] DIS=0x{machine.display_value:02X} "
+          f"halted={machine.halted} sha1={hashlib.sha1(machine.state_bytes()).hexdigest()}", file=log)
+    if machine.halted and args.dump_on_brk:
+        machine.dump_history(log)
+    if args.profile:
+        write_profile(machine, rom_path, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QCOM emulator")
+    parser.add_argument("rom_file")
+    parser.add_argument("--hz", type=int, default=1000,
+                        help="target CPU clock in instructions per second (default: 1000)")
+    parser.add_argument("--fps", type=int, default=60,
+                        help="host frames per second; input is polled once per frame (default: 60)")
+    parser.add_argument("--unthrottled", action="store_true",
+                        help="run the CPU as fast as the host allows")
+    parser.add_argument("--trace", choices=sorted(TRACE_LEVELS), default="off",
+                        help="instruction trace verbosity (default: off)")
+    parser.add_argument("--history", type=int, default=64,
+                        help="recent instructions kept for crash dumps, 0 to disable (default: 64)")
+    parser.add_argument("--dump-on-brk", action="store_true",
+                        help="print the recent instruction history when the program halts")
+    parser.add_argument("--no-block-cache", action="store_true",
+                        help="interpret every instruction instead of running translated blocks")
+    parser.add_argument("--rewind-mb", type=float, default=8,
+                        help="memory for the rewind buffer (hold R), 0 to disable (default: 8)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record controller input to FILE for --replay")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="replay recorded input headless at full speed and exit (works with the capture options)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="count executions and memory traffic, write a report to FILE ('-' for stdout) on exit")
+    parser.add_argument("--source-map", metavar="FILE",
+                        help=f"QCOMpiler source map for the profile (default: <rom>{SOURCE_MAP_SUFFIX} if present)")
+    parser.add_argument("--watch", action="store_true",
+                        help="reload the ROM (or reassemble the source) whenever the file changes")
+    parser.add_argument("--keep-ram", action="store_true",
+                        help="with --watch, keep memory outside the program across reloads")
+    parser.add_argument("--worker", action="store_true",
+                        help="run the CPU in a separate process and publish it in shared memory (no rewind)")
+    parser.add_argument("--shm-name", metavar="NAME",
+                        help="with --worker, name of the shared memory segment (default: chosen by the OS)")
+    parser.add_argument("--debug", metavar="ADDRESS",
+                        help="serve the debug protocol (see QCOMDebug.py) on PORT, HOST:PORT or unix:PATH")
+    parser.add_argument("--debug-wait", action="store_true",
+                        help="with --debug, start paused until a debugger continues")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without a window at full speed until BRK or --cycles, then exit")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_RUN_CYCLES,
+                        help=f"with --headless, instructions to run (default: {DEFAULT_RUN_CYCLES:,})")
+    parser.add_argument("--raw-out", metavar="FILE",
+                        help="write each frame as raw RGB24 to FILE ('-' for stdout); implies --headless")
+    parser.add_argument("--png-dir", metavar="DIR",
+                        help="write each frame as DIR/frame-NNNNNN.png; implies --headless")
+    parser.add_argument("--hash-log", metavar="FILE",
+                        help="write 'frame shw sha1' per frame to FILE ('-' for stdout); implies --headless")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="pixels per side of each QCOM pixel in --raw-out and --png-dir (default: 1)")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="capture every SHW, not only frames that differ from the one before")
+    args = parser.parse_args()
+    if args.raw_out or args.png_dir or args.hash_log:
+        args.headless = True
+    if args.raw_out == "-" and args.hash_log == "-":
+        parser.error("--raw-out and --hash-log cannot both go to stdout")
+    if args.scale < 1:
+        parser.error("--scale must be at least 1")
+    if args.headless and (args.worker or args.debug or args.record or args.watch):
+        parser.error("--headless cannot be combined with --worker, --debug, --record or --watch")
+    if args.worker and (args.record or args.replay or args.profile or args.trace != "off" or args.debug):
+        parser.error("--worker cannot be combined with --record, --replay, --profile, --trace or --debug")
+    if args.debug and args.replay:
+        parser.error("--debug cannot be combined with --replay")
+
+    # ============================
+    # Check for ROM argument
+    # ============================
+    rom_path = args.rom_file
+    if not os.path.exists(rom_path):
+        print(f"Error: File '{rom_path}' does not exist.")
+        sys.exit(1)
+
+    if args.replay or args.headless:
+        run_headless(rom_path, args)
+        return
+
+    import pygame
+
+    # ============================
+    # Pygame Setup
+    # ============================
+    pygame.init()
+    WIDTH, HEIGHT = 640, 480
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Simple Emulator Display")
+
+    clock = pygame.time.Clock()
+    fps_font = pygame.font.SysFont("Arial", 18)
+    show_fps = False
+
+    BOARD_SIZE = 16
+    board_pixels = min(WIDTH, HEIGHT)
+    cell_size = board_pixels // BOARD_SIZE
+
+    board_x = (WIDTH - board_pixels) // 2
+    board_y = (HEIGHT - board_pixels) // 2
+    board_view = screen.subsurface((board_x, board_y, cell_size * BOARD_SIZE, cell_size * BOARD_SIZE))
+
+    def render(rgb, display_value):
+        # --- Render Display ---
+        screen.fill((0, 0, 0))
+
+        # --- Draw Game Board ---
+        # Build the 16x16 image from the byte -> pixel-pair table (frame_to_rgb)
+        # and scale it onto the window in one blit instead of 256 rect fills.
+        board = pygame.image.frombuffer(rgb, (BOARD_SIZE, BOARD_SIZE), "RGB")
+        pygame.transform.scale(board, board_view.get_size(), board_view)
+
+        if show_fps:
+            fps = clock.get_fps()
+            fps_text = fps_font.render(f"FPS: {fps:.2f}  x{scheduler.speed:g}", True, (255, 255, 255))
+            screen.blit(fps_text, (10, 10))
+
+            # Display the display_value in top-right corner:
+            bin_str = f"{display_value:08b}"  # 8-bit binary string
+            hex_str = f"0x{display_value:02X}"
+
+            bin_text = fps_font.render(bin_str, True, (255, 255, 255))
+            hex_text = fps_font.render(hex_str, True, (255, 255, 255))
+
+            padding = 10
+            bin_pos = (WIDTH - bin_text.get_width() - padding, padding)
+            hex_pos = (WIDTH - hex_text.get_width() - padding, padding + bin_text.get_height())
+
+            screen.blit(bin_text, bin_pos)
+            screen.blit(hex_text, hex_pos)
+
+        pygame.display.flip()
+
+    # SHW can fire many times per host frame. Snapshot the framebuffer when
+    # it does and draw only the latest snapshot once the frame's budget is spent.
+    # take_frame() returns None when nothing was written since the last SHW,
+    # so an unchanged frame is neither copied nor redrawn.
+    pending_frame = None
+
+    def on_show(machine):
+        nonlocal pending_frame
+        frame = machine.take_frame()
+        if frame is not None:
+            pending_frame = frame
+
+    # ============================
+    # Load ROM into memory
+    # ============================
+    def on_out(port, value):
+        print(f"OUT port {port}, value {value}")
+
+    # One cache across reloads, so a watched source is reassembled incrementally
+    compile_cache = None
+    if rom_path.endswith(SOURCE_EXTENSIONS):
+        import QCOMpiler
+        compile_cache = QCOMpiler.CompileCache()
+
+    scheduler = Scheduler(hz=args.hz, fps=args.fps, unthrottled=args.unthrottled)
+    machine = worker = None
+    try:
+        rom = read_rom(rom_path, compile_cache)
+        if args.worker:
+            worker = CPUWorker(rom, hz=args.hz, fps=args.fps, unthrottled=args.unthrottled,
+                               dump_on_brk=args.dump_on_brk, name=args.shm_name,
+                               history=args.history, block_cache=not args.no_block_cache)
+        else:
+            machine = QCOM(rom, on_show=on_show, on_out=on_out,
+                           trace_level=TRACE_LEVELS[args.trace], history=args.history,
+                           block_cache=not args.no_block_cache,
+                           profile=Profile() if args.profile else None)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if worker is not None:
+        print(f"CPU running in process {worker.process.pid}, shared memory segment '{worker.name}'")
+        # The worker keeps its own Scheduler; this one only tracks the speed keys
+        worker_speed = scheduler.speed
+        last_frame_seq = 0
+    debug_server = None
+    if args.debug:
+        import QCOMDebug
+        try:
+            debug_server = QCOMDebug.ThreadedDebugServer(QCOMDebug.Debugger(machine), args.debug)
+        except (OSError, ValueError) as e:
+            print(f"Error: debug server: {e}")
+            sys.exit(1)
+        print(f"Debug server listening on {debug_server.describe()}")
+        if args.debug_wait:
+            machine.debug_stop(("pause", machine.pc))
+            debug_server.debugger.stop_event()  # nobody is connected to hear it yet
+    rewind = None
+    if args.rewind_mb > 0 and worker is None:
+        rewind = Rewind(max_bytes=int(args.rewind_mb * (1 << 20)))
+    state_path = os.path.splitext(rom_path)[0] + ".state"
+    recorder = InputRecorder(machine) if args.record else None
+    rom_stamp = os.stat(rom_path).st_mtime_ns
+    next_watch = 0.0
+
+    def reload_rom():
+        """Load the changed ROM into the running machine; pygame stays up."""
+        try:
+            rom = read_rom(rom_path, compile_cache)
+            if worker is not None:
+                error = worker.request("rom", (rom, args.keep_ram))
+                if error is not None:
+                    raise ValueError(error)
+            else:
+                machine.load_rom(rom, keep_ram=args.keep_ram)
+        except (OSError, ValueError) as e:
+            print(f"Error reloading '{rom_path}': {e}")
+            return
+        print(f"Reloaded '{rom_path}' ({len(rom)} bytes)")
+        if machine is not None:
+            on_show(machine)
+        # The new program starts a new timeline
+        if rewind is not None:
+            rewind.clear()
+        if recorder is not None:
+            recorder.restart(machine)
+
+    # ============================
+    # Main Loop
+    # ============================
+    running = True
+    try:
+        while running:
+            # --- Handle Events ---
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_f:
+                        show_fps = not show_fps
+                    elif event.key in (pygame.K_EQUALS, pygame.K_KP_PLUS):
+                        scheduler.faster()
+                    elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                        scheduler.slower()
+                    elif event.key in (pygame.K_0, pygame.K_KP0):
+                        scheduler.reset_speed()
+                    elif event.key == pygame.K_F5:
+                        data = worker.request("save") if worker is not None else machine.save_state()
+                        with open(state_path, "wb") as f:
+                            f.write(data)
+                        print(f"Saved state to '{state_path}'")
+                    elif event.key == pygame.K_F9:
+                        try:
+                            with open(state_path, "rb") as f:
+                                data = f.read()
+                            if worker is not None:
+                                error = worker.request("load", data)
+                                if error is not None:
+                                    raise ValueError(error)
+                            else:
+                                machine.load_state(data)
+                            print(f"Loaded state from '{state_path}'")
+                            # The loaded state starts a new timeline
+                            if rewind is not None:
+                                rewind.clear()
+                            if recorder is not None:
+                                recorder.restart(machine)
+                                print("Recording restarted from the loaded state")
+                        except (OSError, ValueError) as e:
+                            print(f"Error loading state: {e}")
+
+            # --- Hot reload ---
+            if args.watch and time.perf_counter() >= next_watch:
+                next_watch = time.perf_counter() + WATCH_INTERVAL
+                try:
+                    stamp = os.stat(rom_path).st_mtime_ns
+                except OSError:
+                    stamp = rom_stamp  # mid-replace; try again next time
+                if stamp != rom_stamp:
+                    rom_stamp = stamp
+                    reload_rom()
+
+            # --- Update Controller State ---
+            keys = pygame.key.get_pressed()
+            controller_byte = 0
+
+            if keys[pygame.K_w]: controller_byte |= (1 << 7)
+            if keys[pygame.K_s]: controller_byte |= (1 << 6)
+            if keys[pygame.K_a]: controller_byte |= (1 << 5)
+            if keys[pygame.K_d]: controller_byte |= (1 << 4)
+            if keys[pygame.K_SPACE]: controller_byte |= (1 << 3)
+            if keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT]: controller_byte |= (1 << 2)
+            if keys[pygame.K_RETURN]: controller_byte |= (1 << 1)
+            if keys[pygame.K_BACKSPACE]: controller_byte |= (1 << 0)
+
+            # --- Emulation ---
+            if debug_server is not None:
+                debug_server.poll()
+            if worker is not None:
+                # The worker runs on its own clock; hand it the input and
+                # draw whatever frame it last published
+                worker.shared.controller = controller_byte
+                if scheduler.speed != worker_speed:
+                    worker_speed = scheduler.speed
+                    worker.send("speed", worker_speed)
+                seq = worker.shared.frame_seq
+                if seq != last_frame_seq and not seq & 1:
+                    rgb = frame_to_rgb(worker.shared.frame)
+                    if worker.shared.frame_seq == seq:  # else torn; redraw next tick
+                        render(rgb, worker.shared.display_value)
+                        last_frame_seq = seq
+                if not worker.process.is_alive():
+                    print(f"Error: CPU worker exited with code {worker.process.exitcode}")
+                    running = False
+                elif worker.shared.halted and not args.watch:
+                    running = False
+            elif rewind is not None and keys[pygame.K_r]:
+                # Step back one frame; take_frame() picks up the restored screen
+                if rewind.pop(machine):
+                    on_show(machine)
+                    if recorder is not None:
+                        recorder.rewound(machine)
+            else:
+                if recorder is not None:
+                    recorder.set_controller(machine, controller_byte)
+                else:
+                    machine.set_controller(controller_byte)
+                scheduler.run_frame(machine)
+                if rewind is not None:
+                    rewind.push(machine)
+            if machine is not None and machine.halted and not (args.watch or args.debug):
+                # a watched or debugged program stays on screen until the next edit or command
+                running = False
+
+            if pending_frame is not None:
+                render(frame_to_rgb(pending_frame), machine.display_value)
+                pending_frame = None
+
+            if scheduler.unthrottled:
+                clock.tick()
+            else:
+                clock.tick(scheduler.fps)
+    except Exception:
+        if machine is not None:
+            machine.dump_history(sys.stderr)
+        raise
+    finally:
+        if debug_server is not None:
+            debug_server.close()
+        if worker is not None:
+            halted = worker.shared.halted
+            worker.close()
+        else:
+            halted = machine.halted and machine.break_reason is None
+        if recorder is not None:
+            with open(args.record, "wb") as f:
+                f.write(recorder.recording(machine).to_bytes())
+            print(f"Recorded {len(recorder.events)} input changes to '{args.record}'")
+        if args.profile:
+            write_profile(machine, rom_path, args)
+
+    if halted:
+        print("BRK - Break / Halt")
+        if args.dump_on_brk and machine is not None:
+            machine.dump_history()  # a worker dumps its own on the way out
+
+    # ============================
+    # Cleanup
+    # ============================
+    pygame.quit()
+    sys.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import sys
+import os
+import json
+import time
+import random
+import argparse
+
+from QCOMEmulator import QCOM, InputRecording, STATE_HEADER, MEMORY_SIZE, PROGRAM_START, read_rom
+from QCOMISA import disassemble
+
+# QCOM coverage-guided fuzzer
+#
+# Mutates controller input sequences (the byte at 0x80) and, with
+# --mutate-rom, the program bytes, runs every case headless for a short
+# cycle budget and keeps the cases that reach new control-flow edges. An
+# edge is a branch together with where execution went next, so a branch
+# taken and the same branch not taken are different edges.
+#
+# Unknown opcodes, running off the end of memory and exceptions inside the
+# emulator are crashes. Each distinct one is saved as an input recording
+# that reproduces it with:  python QCOMEmulator.py ROM --replay crash-000.rec
+
+DEFAULT_CYCLES = 2000
+MAX_EVENTS = 64
+ROM_MUTATION_RATE = 0.25  # share of cases that also get ROM bytes mutated
+BUTTONS = tuple(1 << bit for bit in range(8))
+
+
+class Fuzzer:
+    """Corpus, coverage and crash bookkeeping around one reusable machine.
+
+    A case is (state, events): a raw state as QCOM.state_bytes() returns it
+    and (cycle, controller byte) pairs in cycle order. Every execution
+    restores the state into the same machine, which keeps translated blocks
+    whose bytes did not change, so only mutated code is re-translated.
+    """
+
+    def __init__(self, rom, cycles=DEFAULT_CYCLES, mutate_rom=False, seed=0):
+        self.rng = random.Random(seed)
+        self.cycles = cycles
+        self.mutate_rom = mutate_rom
+        self.coverage = set()
+        # the last two history runs tell which block led into a crash
+        self.machine = QCOM(rom, coverage=self.coverage, on_unknown=self._unknown, history=2)
+        self.start_state = self.machine.state_bytes()
+        self.rom_end = max(len(rom), PROGRAM_START + 1)
+        self.corpus = []
+        self.crashes = {}   # (kind, origin, detail) -> ((kind, pc, detail, origin), case)
+        self.execs = 0
+        self.growth = []    # (seconds, executions, edges)
+        self._fault = None
+
+    def _unknown(self, machine, pc, opcode):
+        self._fault = self._make_fault("unknown-opcode", pc, f"0x{opcode:02X}", back=2)
+        machine.halted = True
+
+    def _make_fault(self, kind, pc, detail, back=1):
+        # ``origin`` is the block that ran (or jumped) into the fault; wild
+        # jumps into data land on many addresses but share one origin
+        history = self.machine.history
+        origin = history[-back][0] if len(history) >= back else pc
+        return kind, pc, detail, origin
+
+    def execute(self, state, events):
+        """Run one case. Returns (edges it added, fault or None)."""
+        machine = self.machine
+        machine.restore_state_bytes(state)
+        # crash origins must come from this case's history, not the last one's
+        machine.history.clear()
+        self._fault = None
+        before = len(self.coverage)
+        try:
+            for cycle, controller_byte in events:
+                if cycle > machine.cycles:
+                    machine.run(cycle - machine.cycles)
+                if machine.halted:
+                    break
+                machine.set_controller(controller_byte)
+            if self.cycles > machine.cycles:
+                machine.run(self.cycles - machine.cycles)
+            if self._fault is None and machine.pc >= MEMORY_SIZE:
+                self._fault = self._make_fault("off-end", machine.pc, "")
+        except Exception as e:
+            self._fault = self._make_fault("exception", machine.pc, f"{type(e).__name__}: {e}")
+        self.execs += 1
+        return len(self.coverage) - before, self._fault
+
+    # ============================
+    # Mutations
+    # ============================
+
+    def mutate_events(self, events):
+        # random() scaled by hand: randrange() would cost more than a short run
+        rand = self.rng.random
+        events = list(events)
+        for _ in range(1 + int(rand() * 4)):
+            roll = int(rand() * 6)
+            if roll == 0 or not events:
+                value = BUTTONS[int(rand() * 8)] if rand() < 0.5 else int(rand() * 256)
+                events.append((int(rand() * self.cycles), value))
+                continue
+            i = int(rand() * len(events))
+            cycle, value = events[i]
+            if roll == 1:
+                del events[i]
+            elif roll == 2:
+                events[i] = (cycle, value ^ BUTTONS[int(rand() * 8)])
+            elif roll == 3:
+                events[i] = (max(0, cycle + int(rand() * 129) - 64), value)
+            elif roll == 4:
+                events[i] = (cycle, 0)
+            else:
+                # splice: keep ours up to ``cycle``, then another case's tail
+                _, other = self.corpus[int(rand() * len(self.corpus))]
+                events = events[:i] + [event for event in other if event[0] >= cycle]
+        events.sort()
+        return events[:MAX_EVENTS]
+
+    def mutate_state(self, state):
+        rng = self.rng
+        raw = bytearray(state)
+        for _ in range(rng.randint(1, 2)):
+            addr = STATE_HEADER.size + rng.randrange(PROGRAM_START, self.rom_end)
+            if rng.random() < 0.5:
+                raw[addr] ^= 1 << rng.randrange(8)
+            else:
+                raw[addr] = rng.randrange(256)
+        return bytes(raw)
+
+    # ============================
+    # Main loop
+    # ============================
+
+    def run(self, seconds=None, max_execs=None, on_status=None, interval=1.0):
+        """Fuzz until ``seconds`` or ``max_execs`` runs out (or Ctrl+C)."""
+        start = time.perf_counter()
+        next_status = start + interval
+        if not self.corpus:
+            self._consider(self.start_state, [])
+            if not self.corpus:
+                self.corpus.append((self.start_state, []))
+        try:
+            while ((max_execs is None or self.execs < max_execs)
+                   and (seconds is None or time.perf_counter() - start < seconds)):
+                state, events = self.corpus[int(self.rng.random() * len(self.corpus))]
+                events = self.mutate_events(events)
+                if self.mutate_rom and self.rng.random() < ROM_MUTATION_RATE:
+                    state = self.mutate_state(state)
+                self._consider(state, events)
+                now = time.perf_counter()
+                if now >= next_status:
+                    next_status = now + interval
+                    self.growth.append((now - start, self.execs, len(self.coverage)))
+                    if on_status is not None:
+                        on_status(self, now - start)
+        except KeyboardInterrupt:
+            pass
+        elapsed = time.perf_counter() - start
+        self.growth.append((elapsed, self.execs, len(self.coverage)))
+        return elapsed
+
+    def _consider(self, state, events):
+        new_edges, fault = self.execute(state, events)
+        if fault is not None:
+            kind, _, detail, origin = fault
+            self.crashes.setdefault((kind, origin, detail), (fault, (state, events)))
+        elif new_edges:
+            self.corpus.append((state, events))
+
+    def recording(self, case):
+        """An InputRecording that replays ``case`` in the emulator."""
+        state, events = case
+        scratch = QCOM()
+        scratch.restore_state_bytes(state)
+        return InputRecording(scratch.save_state(), events, self.cycles)
+
+    def describe(self, fault, case):
+        kind, pc, detail, origin = fault
+        where = f"0x{pc:03X}"
+        if pc < MEMORY_SIZE:
+            where += f" ({disassemble(case[0][STATE_HEADER.size:], pc)[0]})"
+        text = f"{kind} at {where}"
+        if detail and kind != "unknown-opcode":
+            text += f": {detail}"
+        if origin != pc:
+            text += f", reached from 0x{origin:03X}"
+        return text
+
+
+def print_status(fuzzer, elapsed):
+    rate = fuzzer.execs / elapsed if elapsed > 0 else 0
+    print(f"[{elapsed:7.1f}s] {fuzzer.execs:>10,} execs {rate:>9,.0f}/s  "
+          f"edges {len(fuzzer.coverage):>5}  corpus {len(fuzzer.corpus):>4}  crashes {len(fuzzer.crashes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coverage-guided fuzzing of a QCOM ROM's controller input.")
+    parser.add_argument("rom", help="ROM (.qcom) or assembly source")
+    parser.add_argument("--seconds", type=float, default=10.0,
+                        help="how long to fuzz (default: 10)")
+    parser.add_argument("--execs", type=int,
+                        help="stop after this many executions instead")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES,
+                        help=f"cycle budget per execution (default: {DEFAULT_CYCLES})")
+    parser.add_argument("--mutate-rom", action="store_true",
+                        help="also mutate program bytes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", metavar="DIR",
+                        help="write a replayable recording of each crash to DIR")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write the summary, coverage growth and crashes as JSON to FILE")
+    args = parser.parse_args()
+
+    try:
+        rom = read_rom(args.rom)
+        fuzzer = Fuzzer(rom, args.cycles, args.mutate_rom, args.seed)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    seconds = None if args.execs else args.seconds
+    elapsed = fuzzer.run(seconds, args.execs, on_status=print_status)
+    print_status(fuzzer, elapsed)
+
+    crashes = []
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    for n, (fault, case) in enumerate(sorted(fuzzer.crashes.values(), key=lambda item: item[0][1])):
+        record = {"kind": fault[0], "pc": fault[1], "detail": fault[2], "origin": fault[3],
+                  "description": fuzzer.describe(fault, case)}
+        if args.out:
+            record["file"] = os.path.join(args.out, f"crash-{n:03d}.rec")
+            with open(record["file"], "wb") as f:
+                f.write(fuzzer.recording(case).to_bytes())
+        crashes.append(record)
+        print(f"CRASH  {record['description']}" + (f"  -> {record['file']}" if args.out else ""))
+
+    if args.json:
+        summary = {
+            "rom": args.rom,
+            "executions": fuzzer.execs,
+            "seconds": round(elapsed, 6),
+            "executions_per_second": round(fuzzer.execs / elapsed, 1) if elapsed > 0 else 0,
+            "edges": len(fuzzer.coverage),
+            "corpus": len(fuzzer.corpus),
+            "growth": [{"seconds": round(t, 3), "executions": n, "edges": e} for t, n, e in fuzzer.growth],
+            "crashes": crashes,
+        }
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if crashes:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
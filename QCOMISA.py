@@ -0,0 +1,184 @@
+import sys
+import argparse
+
+# QCOM instruction set
+#
+# The one opcode table, as given in the QCOM ISA specification (appendix
+# 4.0). QCOMpiler's INSTRUCTION_MODES, the emulator's decode tables and the
+# disassembler below are all generated from it, so an opcode added or
+# changed here reaches every tool at once.
+
+REG = "REG"
+IMM = "IMM"
+ADDR = "ADDR"
+
+PROGRAM_START = 0x90
+
+# (opcode, syntax, sets ZF)
+ISA = (
+    # I/O and system
+    (0x01, "DIS IMM", False),
+    (0x02, "DIS REG", False),
+    (0x03, "DIS ADDR", False),
+    (0x04, "IN REG", True),
+    (0x05, "OUT IMM, IMM", False),
+    (0x06, "OUT IMM, REG", False),
+    (0x07, "OUT IMM, ADDR", False),
+    (0x0F, "BRK", False),
+    # Data transfer
+    (0x10, "MOV REG, IMM", True),
+    (0x11, "MOV ADDR, REG", True),
+    (0x12, "MOV REG, ADDR", True),
+    (0x13, "MOV REG, REG", True),
+    (0x14, "SHW", False),
+    (0x15, "CLS IMM", False),
+    # Shifts and rotates
+    (0x18, "SBL REG", True),
+    (0x19, "SBL ADDR", True),
+    (0x1A, "SBR REG", True),
+    (0x1B, "SBR ADDR", True),
+    (0x1C, "RBL REG", True),
+    (0x1D, "RBL ADDR", True),
+    (0x1E, "RBR REG", True),
+    (0x1F, "RBR ADDR", True),
+    # Logic
+    (0x20, "AND REG, IMM", True),
+    (0x21, "AND ADDR, REG", True),
+    (0x22, "AND REG, ADDR", True),
+    (0x23, "AND REG, REG", True),
+    (0x24, "OR REG, IMM", True),
+    (0x25, "OR ADDR, REG", True),
+    (0x26, "OR REG, ADDR", True),
+    (0x27, "OR REG, REG", True),
+    (0x28, "XOR REG, IMM", True),
+    (0x29, "XOR ADDR, REG", True),
+    (0x2A, "XOR REG, ADDR", True),
+    (0x2B, "XOR REG, REG", True),
+    (0x2C, "NOT REG", True),
+    (0x2D, "NOT ADDR", True),
+    # Arithmetic
+    (0x30, "ADD REG, IMM", True),
+    (0x31, "ADD ADDR, REG", True),
+    (0x32, "ADD REG, ADDR", True),
+    (0x33, "ADD REG, REG", True),
+    (0x34, "SUB REG, IMM", True),
+    (0x35, "SUB ADDR, REG", True),
+    (0x36, "SUB REG, ADDR", True),
+    (0x37, "SUB REG, REG", True),
+    (0x38, "INC REG", True),
+    (0x39, "INC ADDR", True),
+    (0x3A, "DEC REG", True),
+    (0x3B, "DEC ADDR", True),
+    # Control flow
+    (0x40, "JMP IMM", False),
+    (0x41, "JMP REG", False),
+    (0x42, "JIF IMM, IMM", False),
+    (0x43, "JIF IMM, REG", False),
+    (0x44, "JNI IMM, IMM", False),
+    (0x45, "JNI IMM, REG", False),
+    # Indirect memory
+    (0x50, "MIL REG, IMM", True),
+    (0x51, "MIL REG, REG", True),
+    (0x52, "MIL REG, ADDR", True),
+    (0x53, "MIL ADDR, REG", True),
+    (0x54, "MFI REG, REG", True),
+    (0x55, "MFI REG, ADDR", True),
+    (0x56, "MFI ADDR, REG", True),
+    (0x57, "MFI ADDR, ADDR", True),
+)
+
+
+def parse_syntax(syntax):
+    """'MOV REG, IMM' -> ('MOV', ('REG', 'IMM'))"""
+    mnemonic, _, operands = syntax.partition(" ")
+    return mnemonic, tuple(kind.strip() for kind in operands.split(",") if kind.strip())
+
+
+# ============================
+# Generated tables
+# ============================
+
+# Opcode -> (mnemonic, operand kinds)
+OPCODES = {code: parse_syntax(syntax) for code, syntax, _ in ISA}
+# (mnemonic, operand kinds) -> opcode, the assembler's view
+MODES = {syntax: code for code, syntax in OPCODES.items()}
+# Opcodes that leave ZF (R7 bit 0) alone
+NO_FLAG_OPCODES = frozenset(code for code, _, sets_zf in ISA if not sets_zf)
+# 256-entry opcode -> instruction length in bytes, 0 for undefined opcodes
+LENGTHS = tuple(1 + len(OPCODES[code][1]) if code in OPCODES else 0 for code in range(256))
+
+
+def handler_name(code):
+    """Name of the emulator method that executes ``code``, e.g. op_mov_reg_imm."""
+    mnemonic, kinds = OPCODES[code]
+    return "_".join(["op", mnemonic.lower()] + [kind.lower() for kind in kinds])
+
+
+# ============================
+# Disassembler
+# ============================
+
+# Operand kind -> text of each byte value
+OPERAND_TEXT = {
+    REG: tuple(f"R{v & 0x07}" for v in range(256)),
+    IMM: tuple(f"$0x{v:02X}" for v in range(256)),
+    ADDR: tuple(f"0x{v:02X}" for v in range(256)),
+}
+# 256-entry opcode -> (mnemonic, operand text tables), None for undefined opcodes
+FORMATS = tuple((OPCODES[code][0], tuple(OPERAND_TEXT[kind] for kind in OPCODES[code][1]))
+                if code in OPCODES else None for code in range(256))
+
+
+def disassemble(memory, addr):
+    """Return (text, length) for the instruction at ``addr``.
+
+    The text is QCOMpiler syntax. Operands past the end of ``memory`` read
+    as 0; an undefined opcode is a one-byte ``DB``.
+    """
+    opcode = memory[addr]
+    fmt = FORMATS[opcode]
+    if fmt is None:
+        return f"DB 0x{opcode:02X}", 1
+    mnemonic, tables = fmt
+    if not tables:
+        return mnemonic, 1
+    n = len(memory)
+    parts = [mnemonic]
+    for i, table in enumerate(tables, 1):
+        parts.append(table[memory[addr + i] if addr + i < n else 0])
+    return " ".join(parts), 1 + len(tables)
+
+
+def listing(memory, start=PROGRAM_START, end=None):
+    """Yield (address, length, text) for each instruction from ``start`` to ``end``."""
+    end = len(memory) if end is None else min(end, len(memory))
+    addr = start
+    while addr < end:
+        text, length = disassemble(memory, addr)
+        yield addr, length, text
+        addr += length
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Disassemble a QCOM ROM.")
+    parser.add_argument("rom")
+    parser.add_argument("--start", type=lambda s: int(s, 0), default=PROGRAM_START,
+                        help="first address to disassemble (default: 0x90)")
+    parser.add_argument("--end", type=lambda s: int(s, 0),
+                        help="stop before this address (default: end of the ROM)")
+    args = parser.parse_args()
+
+    try:
+        with open(args.rom, "rb") as f:
+            rom = f.read()
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    for addr, length, text in listing(rom, args.start, args.end):
+        raw = " ".join(f"{b:02X}" for b in rom[addr:addr + length])
+        print(f"0x{addr:03X}  {raw:<8}  {text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import sys
+import os
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from QCOMEmulator import run
+import QCOMpiler
+
+# QCOM headless ROM test runner
+#
+# Runs every ROM (.qcom) or assembly source (.asm / .txt, assembled with
+# QCOMpiler) until BRK or a cycle budget, then checks the final state
+# against an optional expectations file named <rom>.expect.json:
+#
+#   {
+#       "cycles": 50000,                  budget override for this ROM
+#       "controller": 0,                  controller byte at start
+#       "halted": true,
+#       "pc": 168,
+#       "display": 42,
+#       "registers": {"R0": 1, "R7": 0},
+#       "memory": {"0x00": 255, "0x10": [1, 2, 3]}
+#   }
+
+ROM_EXTENSIONS = (".qcom",)
+SOURCE_EXTENSIONS = (".asm", ".txt")
+EXPECT_SUFFIX = ".expect.json"
+DEFAULT_CYCLES = 1_000_000
+
+
+def find_roms(paths):
+    """Expand files and directories into a sorted list of runnable paths."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(ROM_EXTENSIONS + SOURCE_EXTENSIONS):
+                    found.append(os.path.join(path, name))
+        else:
+            found.append(path)
+    return found
+
+
+def load_rom(path):
+    if path.endswith(SOURCE_EXTENSIONS):
+        with open(path, "r") as f:
+            return QCOMpiler.assemble(f.read())
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def load_expectations(path):
+    expect_path = os.path.splitext(path)[0] + EXPECT_SUFFIX
+    if not os.path.exists(expect_path):
+        return {}
+    with open(expect_path, "r") as f:
+        return json.load(f)
+
+
+def check_state(machine, expect):
+    """Return a list of human-readable mismatches between machine and expect."""
+    failures = []
+
+    def compare(name, actual, wanted):
+        if actual != wanted:
+            failures.append(f"{name}: expected {wanted!r}, got {actual!r}")
+
+    if "halted" in expect:
+        compare("halted", machine.halted, expect["halted"])
+    if "pc" in expect:
+        compare("pc", machine.pc, expect["pc"])
+    if "display" in expect:
+        compare("display", machine.display_value, expect["display"])
+    for reg, wanted in expect.get("registers", {}).items():
+        compare(reg, machine.registers[int(reg.lstrip("Rr"))], wanted)
+    for addr, wanted in expect.get("memory", {}).items():
+        start = int(addr, 0)
+        if isinstance(wanted, list):
+            actual = list(machine.memory[start:start + len(wanted)])
+        else:
+            actual = machine.memory[start]
+        compare(f"memory[0x{start:03X}]", actual, wanted)
+    return failures
+
+
+def run_rom(path, cycles=DEFAULT_CYCLES):
+    """Run one ROM headless and return its result record."""
+    result = {"rom": path, "status": "pass", "failures": []}
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            expect = load_expectations(path)
+            machine = run(load_rom(path), expect.get("cycles", cycles), expect.get("controller", ()))
+        result["failures"] = check_state(machine, expect)
+        if result["failures"]:
+            result["status"] = "fail"
+        result.update({
+            "halted": machine.halted,
+            "cycles": machine.cycles,
+            "pc": machine.pc,
+            "registers": machine.registers,
+            "display": machine.display_value,
+        })
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def run_all(paths, cycles=DEFAULT_CYCLES, jobs=None):
+    """Run every ROM across a process pool and return the summary dict."""
+    start = time.perf_counter()
+    if jobs == 1:
+        results = [run_rom(path, cycles) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(run_rom, paths, [cycles] * len(paths), chunksize=4))
+    statuses = [r["status"] for r in results]
+    return {
+        "total": len(results),
+        "passed": statuses.count("pass"),
+        "failed": statuses.count("fail"),
+        "errors": statuses.count("error"),
+        "seconds": round(time.perf_counter() - start, 6),
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run QCOM ROMs headless and check their final state.")
+    parser.add_argument("paths", nargs="+", help="ROMs, assembly sources or directories of them")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES,
+                        help="cycle budget per ROM when it does not reach BRK")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="worker processes (1 runs in-process)")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write the JSON summary to FILE ('-' for stdout)")
+    args = parser.parse_args()
+
+    paths = find_roms(args.paths)
+    if not paths:
+        print("Error: no ROMs found.")
+        sys.exit(1)
+
+    summary = run_all(paths, args.cycles, args.jobs)
+
+    if args.json == "-":
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(summary, f, indent=2)
+        for r in summary["results"]:
+            detail = r.get("error") or f"{r['cycles']} cycles{' (BRK)' if r['halted'] else ''}"
+            print(f"{r['status'].upper():<6} {r['rom']:<40} {detail:<24} {r['seconds']:.3f}s")
+            for failure in r["failures"]:
+                print(f"         {failure}")
+        print(f"\n{summary['passed']} passed, {summary['failed']} failed, "
+              f"{summary['errors']} errors in {summary['seconds']:.2f}s")
+
+    if summary["failed"] or summary["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import numpy as np
+
+from QCOMEmulator import QCOM, OPCODE_SYNTAX, MEMORY_SIZE, PROGRAM_START, CONTROLLER_ADDR
+
+# QCOM lockstep engine
+#
+# Runs N copies of one ROM side by side with their state held in NumPy
+# arrays: registers (N x 8), pc (N), memory (N x 4096). Every step fetches
+# one instruction per machine, groups the machines by opcode and runs each
+# group's handler once over the whole group. Semantics follow the handlers
+# in QCOMEmulator.QCOM exactly; only the bookkeeping differs:
+#   - SHW and OUT are counted / reported per machine instead of drawn
+#   - unknown opcodes are counted in ``unknown_opcodes`` and skipped
+
+# Opcode -> total instruction length in bytes (unknown opcodes are 1 byte)
+LENGTHS = np.ones(256, dtype=np.int32)
+for _code, (_mnemonic, _kinds) in OPCODE_SYNTAX.items():
+    LENGTHS[_code] = 1 + len(_kinds)
+
+HANDLERS = {}
+
+
+def handles(*codes):
+    def register(handler):
+        for code in codes:
+            HANDLERS[code] = handler
+        return handler
+    return register
+
+
+class QCOMBatch:
+    """N QCOM machines stepped in lockstep.
+
+    ``rom`` is loaded into every machine. ``memory``, if given, is an
+    (N, 4096) array of initial memory images and overrides the ROM.
+    """
+
+    def __init__(self, rom=b"", count=1, memory=None, on_show=None, on_out=None):
+        self.rom = bytes(rom)
+        if len(self.rom) > MEMORY_SIZE:
+            raise ValueError(f"ROM is {len(self.rom)} bytes; QCOM memory is {MEMORY_SIZE} bytes")
+        self.count = count if memory is None else len(memory)
+        self.on_show = on_show  # on_show(batch, rows)
+        self.on_out = on_out    # on_out(batch, rows, ports, values)
+        self._initial_memory = memory
+        self.reset()
+
+    def reset(self):
+        n = self.count
+        if self._initial_memory is None:
+            self.memory = np.zeros((n, MEMORY_SIZE), dtype=np.uint8)
+            self.memory[:, :len(self.rom)] = np.frombuffer(self.rom, dtype=np.uint8)
+        else:
+            self.memory = np.array(self._initial_memory, dtype=np.uint8)
+            if self.memory.shape != (n, MEMORY_SIZE):
+                raise ValueError(f"memory must have shape ({n}, {MEMORY_SIZE})")
+        self.registers = np.zeros((n, 8), dtype=np.uint8)
+        self.pc = np.full(n, PROGRAM_START, dtype=np.int32)
+        self.display_value = np.zeros(n, dtype=np.uint8)
+        self.halted = np.zeros(n, dtype=bool)
+        self.cycles = np.zeros(n, dtype=np.int64)
+        self.shows = np.zeros(n, dtype=np.int64)
+        self.unknown_opcodes = np.zeros(n, dtype=np.int64)
+
+    def set_controller(self, controller_bytes):
+        """Set the controller byte of every machine (scalar or length-N array)."""
+        self.memory[:, CONTROLLER_ADDR] = np.asarray(controller_bytes) & 0xFF
+
+    def machine(self, i):
+        """Copy machine ``i`` out into a scalar QCOM for inspection."""
+        m = QCOM(self.rom)
+        m.memory[:] = self.memory[i].tobytes()
+        m.flush_blocks()
+        m.registers = [int(r) for r in self.registers[i]]
+        m.pc = int(self.pc[i])
+        m.display_value = int(self.display_value[i])
+        m.halted = bool(self.halted[i])
+        m.cycles = int(self.cycles[i])
+        return m
+
+    # ============================
+    # Execution
+    # ============================
+
+    def step(self):
+        """Execute one instruction on every machine that has not halted."""
+        live = np.flatnonzero(~self.halted)
+        if live.size == 0:
+            return
+        self.cycles[live] += 1
+
+        pc = self.pc[live]
+        fetchable = pc < MEMORY_SIZE
+        rows = live[fetchable]
+        pc = pc[fetchable]
+        if rows.size == 0:
+            return
+
+        mem = self.memory
+        op = mem[rows, pc]
+        length = LENGTHS[op]
+        # fetch_byte() yields 0 past the end of memory and stops advancing pc
+        p1 = pc + 1
+        p2 = pc + 2
+        b1 = np.where((length > 1) & (p1 < MEMORY_SIZE), mem[rows, np.minimum(p1, MEMORY_SIZE - 1)], 0).astype(np.int32)
+        b2 = np.where((length > 2) & (p2 < MEMORY_SIZE), mem[rows, np.minimum(p2, MEMORY_SIZE - 1)], 0).astype(np.int32)
+        self.pc[rows] = np.minimum(pc + length, MEMORY_SIZE)
+
+        for code in np.unique(op):
+            sel = op == code
+            handler = HANDLERS.get(int(code))
+            if handler is None:
+                self.unknown_opcodes[rows[sel]] += 1
+            else:
+                handler(self, int(code), rows[sel], b1[sel], b2[sel])
+
+    def run(self, max_cycles):
+        """Step every machine until all have halted or ``max_cycles`` steps."""
+        for _ in range(max_cycles):
+            if self.halted.all():
+                break
+            self.step()
+
+    # ============================
+    # Helpers
+    # ============================
+
+    def reg(self, rows, r):
+        return self.registers[rows, r].astype(np.int32)
+
+    def ea(self, rows, offset):
+        page_bits = (self.registers[rows, 7].astype(np.int32) & 0xF0) << 4
+        return page_bits | (offset & 0xFF)
+
+    def load(self, rows, addr):
+        return self.memory[rows, addr].astype(np.int32)
+
+    def set_zero_flag(self, rows, value):
+        r7 = self.registers[rows, 7]
+        self.registers[rows, 7] = np.where(value == 0, r7 | 1, r7 & 0xFE)
+
+    def reg_result(self, rows, r, value):
+        self.registers[rows, r] = value
+        self.set_zero_flag(rows, value)
+
+    def mem_result(self, rows, addr, value):
+        self.memory[rows, addr] = value
+        self.set_zero_flag(rows, value)
+
+    def zero_flag(self, rows):
+        return (self.registers[rows, 7] & 1).astype(bool)
+
+
+# ============================
+# Opcode group handlers
+# ============================
+
+# handler(batch, opcode, rows, operand1, operand2)
+
+@handles(0x01, 0x02, 0x03)
+def _dis(b, code, rows, a1, a2):
+    if code == 0x01:
+        b.display_value[rows] = a1
+    elif code == 0x02:
+        b.display_value[rows] = b.registers[rows, a1 & 7]
+    else:
+        b.display_value[rows] = b.memory[rows, b.ea(rows, a1)]
+
+
+@handles(0x04)
+def _in(b, code, rows, a1, a2):
+    b.reg_result(rows, a1 & 7, b.memory[rows, CONTROLLER_ADDR])
+
+
+@handles(0x05, 0x06, 0x07)
+def _out(b, code, rows, a1, a2):
+    if b.on_out is None:
+        return
+    if code == 0x05:
+        values = a2
+    elif code == 0x06:
+        values = b.reg(rows, a2 & 7)
+    else:
+        values = b.load(rows, b.ea(rows, a2))
+    b.on_out(b, rows, a1, values)
+
+
+@handles(0x0F)
+def _brk(b, code, rows, a1, a2):
+    b.halted[rows] = True
+
+
+@handles(0x10, 0x11, 0x12, 0x13)
+def _mov(b, code, rows, a1, a2):
+    if code == 0x10:
+        b.reg_result(rows, a1 & 7, a2)
+    elif code == 0x11:
+        b.mem_result(rows, b.ea(rows, a1), b.reg(rows, a2 & 7))
+    elif code == 0x12:
+        b.reg_result(rows, a1 & 7, b.load(rows, b.ea(rows, a2)))
+    else:
+        b.reg_result(rows, a1 & 7, b.reg(rows, a2 & 7))
+
+
+@handles(0x14)
+def _shw(b, code, rows, a1, a2):
+    b.shows[rows] += 1
+    if b.on_show is not None:
+        b.on_show(b, rows)
+
+
+@handles(0x15)
+def _cls(b, code, rows, a1, a2):
+    pass
+
+
+_UNARY = {
+    0x18: lambda x: (x << 1) & 0xFF,                 # SBL
+    0x1A: lambda x: x >> 1,                          # SBR
+    0x1C: lambda x: ((x << 1) & 0xFF) | (x >> 7),    # RBL
+    0x1E: lambda x: (x >> 1) | ((x & 1) << 7),       # RBR
+    0x2C: lambda x: x ^ 0xFF,                        # NOT
+    0x38: lambda x: (x + 1) & 0xFF,                  # INC
+    0x3A: lambda x: (x - 1) & 0xFF,                  # DEC
+}
+
+
+@handles(*[base + form for base in _UNARY for form in (0, 1)])
+def _unary(b, code, rows, a1, a2):
+    fn = _UNARY[code & ~1]
+    if code & 1:  # ADDR form
+        addr = b.ea(rows, a1)
+        b.mem_result(rows, addr, fn(b.load(rows, addr)))
+    else:
+        r = a1 & 7
+        b.reg_result(rows, r, fn(b.reg(rows, r)))
+
+
+_BINARY = {
+    0x20: np.bitwise_and,
+    0x24: np.bitwise_or,
+    0x28: np.bitwise_xor,
+    0x30: np.add,
+    0x34: np.subtract,
+}
+
+
+@handles(*[base + form for base in _BINARY for form in range(4)])
+def _binary(b, code, rows, a1, a2):
+    fn = _BINARY[code & ~3]
+    form = code & 3
+    if form == 1:  # ADDR, REG
+        addr = b.ea(rows, a1)
+        b.mem_result(rows, addr, fn(b.load(rows, addr), b.reg(rows, a2 & 7)) & 0xFF)
+        return
+    r = a1 & 7
+    if form == 0:    # REG, IMM
+        src = a2
+    elif form == 2:  # REG, ADDR
+        src = b.load(rows, b.ea(rows, a2))
+    else:            # REG, REG
+        src = b.reg(rows, a2 & 7)
+    b.reg_result(rows, r, fn(b.reg(rows, r), src) & 0xFF)
+
+
+@handles(0x40, 0x41, 0x42, 0x43, 0x44, 0x45)
+def _jump(b, code, rows, a1, a2):
+    if code == 0x40:
+        b.pc[rows] = b.ea(rows, a1)
+        return
+    if code == 0x41:
+        b.pc[rows] = b.reg(rows, a1 & 7)
+        return
+    zf = b.zero_flag(rows)
+    taken = ((a1 & 1) == 1) & (zf if code in (0x42, 0x43) else ~zf)
+    rows, a2 = rows[taken], a2[taken]
+    if code in (0x42, 0x44):
+        b.pc[rows] = b.ea(rows, a2)
+    elif code == 0x43:
+        b.pc[rows] = b.reg(rows, a2 & 7)
+    else:
+        b.pc[rows] = b.ea(rows, b.reg(rows, a2 & 7))
+
+
+@handles(0x50, 0x51, 0x52, 0x53)
+def _mil(b, code, rows, a1, a2):
+    if code == 0x53:
+        addr = b.ea(rows, b.load(rows, b.ea(rows, a1)))
+        b.mem_result(rows, addr, b.reg(rows, a2 & 7))
+        return
+    # ZF follows the pointer register, not the value stored
+    r = a1 & 7
+    if code == 0x50:
+        value = a2
+    elif code == 0x51:
+        value = b.reg(rows, a2 & 7)
+    else:
+        value = b.load(rows, b.ea(rows, a2))
+    b.memory[rows, b.ea(rows, b.reg(rows, r))] = value
+    b.set_zero_flag(rows, b.reg(rows, r))
+
+
+@handles(0x54, 0x55, 0x56, 0x57)
+def _mfi(b, code, rows, a1, a2):
+    if code in (0x54, 0x56):
+        pointer = b.reg(rows, a2 & 7)
+    else:
+        pointer = b.load(rows, b.ea(rows, a2))
+    value = b.load(rows, b.ea(rows, pointer))
+    if code in (0x54, 0x55):
+        b.reg_result(rows, a1 & 7, value)
+    else:
+        b.mem_result(rows, b.ea(rows, a1), value)
@@ -1,5 +1,11 @@
 import sys
+import os
 import re
+import json
+import time
+from functools import lru_cache
+
+from QCOMISA import MODES, OPCODES, NO_FLAG_OPCODES
 
 # Operand type constants
 REG = "REG"
@@ -7,90 +13,15 @@ ADDR = "ADDR"
 IMM = "IMM"
 LABEL = "LABEL"
 
-# Instruction modes - updated to accept LABEL where relevant
-INSTRUCTION_MODES = {
-    ("DIS", (IMM,)): 0x01,
-    ("DIS", (REG,)): 0x02,
-    ("DIS", (ADDR,)): 0x03,
-    ("IN", (REG,)): 0x04,
-    ("OUT", (IMM, IMM)): 0x05,
-    ("OUT", (IMM, REG)): 0x06,
-    ("OUT", (IMM, ADDR)): 0x07,
-    ("BRK", ()): 0x0F,
-    ("MOV", (REG, IMM)): 0x10,
-    ("MOV", (ADDR, REG)): 0x11,
-    ("MOV", (REG, ADDR)): 0x12,
-    ("MOV", (REG, REG)): 0x13,
-    ("SHW", ()): 0x14,
-    ("CLS", (IMM,)): 0x15,
-    ("SBL", (REG,)): 0x18,
-    ("SBL", (ADDR,)): 0x19,
-    ("SBR", (REG,)): 0x1A,
-    ("SBR", (ADDR,)): 0x1B,
-    ("RBL", (REG,)): 0x1C,
-    ("RBL", (ADDR,)): 0x1D,
-    ("RBR", (REG,)): 0x1E,
-    ("RBR", (ADDR,)): 0x1F,
-    ("AND", (REG, IMM)): 0x20,
-    ("AND", (ADDR, REG)): 0x21,
-    ("AND", (REG, ADDR)): 0x22,
-    ("AND", (REG, REG)): 0x23,
-    ("OR", (REG, IMM)): 0x24,
-    ("OR", (ADDR, REG)): 0x25,
-    ("OR", (REG, ADDR)): 0x26,
-    ("OR", (REG, REG)): 0x27,
-    ("XOR", (REG, IMM)): 0x28,
-    ("XOR", (ADDR, REG)): 0x29,
-    ("XOR", (REG, ADDR)): 0x2A,
-    ("XOR", (REG, REG)): 0x2B,
-    ("NOT", (REG,)): 0x2C,
-    ("NOT", (ADDR,)): 0x2D,
-    ("NOT", (REG, IMM)): 0x2E,
-    ("NOT", (ADDR, REG)): 0x2F,
-    ("ADD", (REG, IMM)): 0x30,
-    ("ADD", (ADDR, REG)): 0x31,
-    ("ADD", (REG, ADDR)): 0x32,
-    ("ADD", (REG, REG)): 0x33,
-    ("SUB", (REG, IMM)): 0x34,
-    ("SUB", (IMM, REG)): 0x35,
-    ("SUB", (REG, ADDR)): 0x36,
-    ("SUB", (REG, REG)): 0x37,
-    ("INC", (REG,)): 0x38,
-    ("INC", (ADDR,)): 0x39,
-    ("INC", (REG, ADDR)): 0x3A,
-    ("INC", (ADDR, REG)): 0x3B,
-    ("DEC", (REG,)): 0x3C,
-    ("DEC", (ADDR,)): 0x3D,
-    ("DEC", (REG, ADDR)): 0x3E,
-    ("DEC", (ADDR, REG)): 0x3F,
-    ("JMP", (IMM,)): 0x40,
-    ("JMP", (REG,)): 0x41,
-    ("JIF", (IMM, IMM)): 0x42,
-    ("JIF", (IMM, REG)): 0x43,
-    ("JNI", (IMM, IMM)): 0x44,
-    ("JNI", (IMM, REG)): 0x45,
-    ("PSH", (IMM,)): 0x46,
-    ("PSH", (REG,)): 0x47,
-    ("POP", ()): 0x48,
-    ("PIF", (IMM, IMM)): 0x49,
-    ("PIF", (IMM, REG)): 0x4A,
-    ("PNI", (IMM, IMM)): 0x4B,
-    ("PNI", (IMM, REG)): 0x4C,
-    ("MIL", (REG, IMM)): 0x50,
-    ("MIL", (REG, REG)): 0x51,
-    ("MIL", (REG, ADDR)): 0x52,
-    ("MIL", (ADDR, REG)): 0x53,
-    ("MFI", (REG, REG)): 0x54,
-    ("MFI", (REG, ADDR)): 0x55,
-    ("MFI", (ADDR, REG)): 0x56,
-    ("MFI", (ADDR, ADDR)): 0x57,
-}
+# Instruction modes, from the shared ISA table (QCOMISA.py)
+INSTRUCTION_MODES = dict(MODES)
 
 
 def adjust_modes_for_labels():
     new_modes = {}
     for (instr, operands), opcode in INSTRUCTION_MODES.items():
-        if instr in ("JMP", "JIF", "JNI", "PSH", "PIF", "PNI"):
+        # jump targets may also be labels
+        if instr in ("JMP", "JIF", "JNI"):
             operands_with_labels = tuple(LABEL if op == IMM else op for op in operands)
             new_modes[(instr, operands_with_labels)] = opcode
         new_modes[(instr, operands)] = opcode
@@ -100,17 +31,21 @@ def adjust_modes_for_labels():
 INSTRUCTION_MODES = adjust_modes_for_labels()
 
 
+# Page-setup opcodes injected ahead of a label operand
+PAGE_AND = INSTRUCTION_MODES[("AND", (REG, IMM))]
+PAGE_OR = INSTRUCTION_MODES[("OR", (REG, IMM))]
+
+# One compiled pattern classifies an operand; the group name is its type
+OPERAND_PATTERN = re.compile(
+    r"(?P<REG>R[0-7])|(?P<LABEL>#\w+)|(?P<IMM>\$.*)|(?P<ADDR>0x[0-9A-Fa-f]+|0b[01]+)"
+)
+
+
+@lru_cache(maxsize=None)
 def detect_operand_type(operand):
-    if re.fullmatch(r"R[0-7]", operand):
-        return REG
-    elif operand.startswith("#") and re.fullmatch(r"#\w+", operand):
-        return LABEL
-    elif operand.startswith("$"):
-        return IMM
-    elif re.fullmatch(r"0x[0-9A-Fa-f]+", operand):
-        return ADDR
-    elif re.fullmatch(r"0b[01]+", operand):
-        return ADDR
+    match = OPERAND_PATTERN.fullmatch(operand)
+    if match:
+        return match.lastgroup
     elif operand.isdigit():
         return ADDR
     else:
@@ -122,7 +57,6 @@ def parse_operand(operand, operand_type, labels=None, line_num=None, resolve_lab
     try:
         # ===== Handle label reference =====
         if operand.startswith("#"):
-            print(f"Parsing operand '{operand}' on line {line_num}")
             if not resolve_labels:
                 # First pass: return dummy value for label operands
                 return 0
@@ -133,40 +67,65 @@ def parse_operand(operand, operand_type, labels=None, line_num=None, resolve_lab
             return labels[operand]
 
         # ===== Regular operand handling =====
-        if operand_type == REG:
-            return int(operand[1])  # e.g., "R2" -> 2
-
-        elif operand_type == IMM:
-            if operand.startswith("$"):
-                value = operand[1:]  # Remove leading $
-                if value.startswith("0x"):
-                    return int(value, 16)
-                elif value.startswith("0b"):
-                    return int(value, 2)
-                else:
-                    return int(value)  # Decimal
-            else:
-                return int(operand)  # Decimal fallback
+        return parse_number(operand, operand_type)
+
+    except ValueError:
+        raise ValueError(f"Line {line_num}: Invalid number format: {operand}")
+
 
-        elif operand_type == ADDR:
-            if operand.startswith("0x"):
-                return int(operand, 16)
-            elif operand.startswith("0b"):
-                return int(operand, 2)
+@lru_cache(maxsize=None)
+def parse_number(operand, operand_type):
+    """Value of a REG/IMM/ADDR operand (raises ValueError)."""
+    if operand_type == REG:
+        return int(operand[1])  # e.g., "R2" -> 2
+
+    elif operand_type == IMM:
+        if operand.startswith("$"):
+            value = operand[1:]  # Remove leading $
+            if value.startswith("0x"):
+                return int(value, 16)
+            elif value.startswith("0b"):
+                return int(value, 2)
             else:
-                return int(operand)  # Decimal
+                return int(value)  # Decimal
+        else:
+            return int(operand)  # Decimal fallback
 
+    elif operand_type == ADDR:
+        if operand.startswith("0x"):
+            return int(operand, 16)
+        elif operand.startswith("0b"):
+            return int(operand, 2)
         else:
-            raise ValueError(f"Unknown operand type: {operand_type}")
+            return int(operand)  # Decimal
 
-    except ValueError:
-        raise ValueError(f"Line {line_num}: Invalid number format: {operand}")
+    else:
+        raise ValueError(f"Unknown operand type: {operand_type}")
+
+class AssemblyError(ValueError):
+    """A source error. ``line_num`` is 1-based, ``text`` is the offending
+    line without its comment and ``reason`` is the message without the
+    line prefix."""
+
+    def __init__(self, message, line_num, text, reason=None):
+        super().__init__(message)
+        self.line_num = line_num
+        self.text = text
+        prefix = f"Line {line_num}: "
+        if reason is None:
+            reason = message[len(prefix):] if message.startswith(prefix) else message
+        self.reason = reason
 
 def strip_comments(line: str) -> str:
     # Remove everything after the first "/"
     return line.split("/", 1)[0].strip()
 
-def compile_line(line, line_num, labels=None, current_offset=None, resolve_labels=True):
+def parse_line(line, line_num):
+    """Parse one instruction into (compiled bytes, label references).
+
+    Label operands are left as 0 in the compiled bytes; each reference is
+    (byte index, label name) for the backpatch pass to fill in.
+    """
     parts = line.strip().split()
     if len(parts) < 1:
         raise ValueError(f"Line {line_num}: Empty or invalid instruction.")
@@ -181,246 +140,900 @@ def compile_line(line, line_num, labels=None, current_offset=None, resolve_label
     # Treat LABEL as IMM for matching
     match_types = tuple(IMM if t == LABEL else t for t in detected_types)
 
-    matched_key = None
-    for (key_instr, key_operand_types), opcode in INSTRUCTION_MODES.items():
-        if key_instr != instr:
-            continue
-        if len(key_operand_types) != len(operands):
-            continue
-        if key_operand_types == match_types:
-            matched_key = (key_instr, key_operand_types)
-            break
-
-    if not matched_key:
+    opcode = INSTRUCTION_MODES.get((instr, match_types))
+    if opcode is None:
         raise ValueError(f"Line {line_num}: Unsupported instruction or operand types for '{instr}'")
 
-    opcode = INSTRUCTION_MODES[matched_key]
-    compiled_bytes = [opcode]
-
-    injected = bytearray()
+    compiled_bytes = bytearray([opcode])
+    label_refs = []
 
     for op, typ in zip(operands, detected_types):
         if typ == LABEL:
-            if not resolve_labels:
-                # First pass: fake page setup (placeholder page 0)
-                injected.extend([
-                    INSTRUCTION_MODES[("AND", (REG, IMM))], 7, 0x0F,
-                    INSTRUCTION_MODES[("OR",  (REG, IMM))], 7, 0x00
-                ])
-                val = 0x00
-            else:
-                # Second pass: resolve label -> split into page and offset
-                full_addr = parse_operand(op, typ, labels, line_num, resolve_labels=True)
-                page = (full_addr >> 8) & 0x0F
-                offset = full_addr & 0xFF
-
-                injected.extend([
-                    INSTRUCTION_MODES[("AND", (REG, IMM))], 7, 0x0F,
-                    INSTRUCTION_MODES[("OR",  (REG, IMM))], 7, page << 4
-                ])
-                val = offset
+            label_refs.append((len(compiled_bytes), op))
+            val = 0x00
         else:
-            val = parse_operand(op, typ, labels, line_num, resolve_labels=resolve_labels)
-
-        if not (0 <= val <= 0xFF):
-            raise ValueError(f"Line {line_num}: Operand value out of 8-bit range: {val}")
+            val = parse_operand(op, typ, None, line_num)
+            if not (0 <= val <= 0xFF):
+                raise ValueError(f"Line {line_num}: Operand value out of 8-bit range: {val}")
         compiled_bytes.append(val)
 
-    return bytes(injected), bytes(compiled_bytes)
+    return compiled_bytes, label_refs
 
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python compiler.py input_file.txt output_file.qcom")
-        return
+def page_setup(full_addr):
+    """R7 page bytes injected ahead of a label operand."""
+    return bytes([PAGE_AND, 7, 0x0F, PAGE_OR, 7, ((full_addr >> 8) & 0x0F) << 4])
 
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
+def compile_line(line, line_num, labels=None, current_offset=None, resolve_labels=True):
+    compiled, label_refs = parse_line(line, line_num)
+    injected = bytearray()
+    for index, op in label_refs:
+        full_addr = parse_operand(op, LABEL, labels, line_num, resolve_labels=resolve_labels)
+        injected.extend(page_setup(full_addr))
+        compiled[index] = full_addr & 0xFF
+    return bytes(injected), bytes(compiled)
 
-    if not output_file.endswith(".qcom"):
-        print("Error: Output file must end with .qcom")
-        return
+def build_source_map(instrs, labels):
+    """Address ranges -> source lines, from the layout pass.
 
-    try:
-        with open(input_file, 'r') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        print(f"Error: Input file '{input_file}' not found.")
-        return
+    Each instruction gets a "code" range for its own bytes and, when it has
+    a label operand, a "page_setup" range for the injected R7 page bytes.
+    """
+    ranges = []
+    for info in instrs:
+        for kind, start, length in (("page_setup", info["inj_start"], 6 * len(info["label_refs"])),
+                                    ("code", info["code_start"], len(info["code"]))):
+            if start is None or not length:
+                continue
+            ranges.append({
+                "start": start,
+                "end": start + length,
+                "line": info["line_num"],
+                "text": info["text"],
+                "kind": kind,
+            })
+    ranges.sort(key=lambda r: r["start"])
+    return {"ranges": ranges, "labels": dict(labels)}
 
-    # ---------- First pass (fixed) ----------
-    # ---------- First pass (precise layout simulation) ----------
-    # This simulates the final emission order (same rules as second pass)
-    # and records both injection-block and compiled-block start offsets so
-    # labels can be bound to the earliest byte that belongs to the following instruction.
-    base = 0x90
 
-    # collect events and instruction size info (length-only, labels unresolved)
-    events = []   # ('label', label_name) or ('comment',None) or ('instr', instr_idx)
-    instrs = []   # list of {line_num, instr_name, injected_len, compiled_len}
-    for line_num, line in enumerate(lines, 1):
-        stripped = strip_comments(line)
-        if not stripped:
+# ============================
+# Page-setup elimination
+# ============================
+
+# Opcodes whose machine semantics the page pass models; programs with any
+# other byte in their code are left as they are
+PAGE_PASS_OPCODES = frozenset(OPCODES)
+# Opcodes that write their first operand as a register
+REG_WRITE_OPCODES = frozenset((
+    0x04, 0x10, 0x12, 0x13, 0x18, 0x1A, 0x1C, 0x1E, 0x20, 0x22, 0x23, 0x24, 0x26, 0x27,
+    0x28, 0x2A, 0x2B, 0x2C, 0x30, 0x32, 0x33, 0x34, 0x36, 0x37, 0x38, 0x3A, 0x54, 0x55,
+))
+MOV_REG_IMM = INSTRUCTION_MODES[("MOV", (REG, IMM))]
+BRK = INSTRUCTION_MODES[("BRK", ())]
+JMP = INSTRUCTION_MODES[("JMP", (IMM,))]
+# Label jumps -> index of the target operand byte
+LABEL_JUMPS = {0x40: 1, 0x42: 2, 0x44: 2}
+CONDITIONAL_JUMPS = frozenset((0x42, 0x43, 0x44, 0x45))
+
+# Operand types of each opcode, for spotting R7 operands
+OPERAND_TYPES = {opcode: operands for (instr, operands), opcode in INSTRUCTION_MODES.items()
+                 if LABEL not in operands}
+
+UNKNOWN_PAGE = -1
+
+
+def unit_addresses(units, removed, base):
+    """Start address of every layout unit plus the end address, leaving out ``removed``."""
+    addrs = []
+    addr = base
+    for i, (info, is_setup) in enumerate(units):
+        addrs.append(addr)
+        if i not in removed:
+            addr += 6 * len(info["label_refs"]) if is_setup else len(info["code"])
+    addrs.append(addr)
+    return addrs
+
+
+def _page_after(code, page):
+    opcode = code[0]
+    if opcode not in REG_WRITE_OPCODES or code[1] & 7 != 7:
+        return page
+    if opcode == MOV_REG_IMM:
+        return code[2] >> 4
+    if page != UNKNOWN_PAGE and opcode == PAGE_AND:
+        return page & (code[2] >> 4)
+    if page != UNKNOWN_PAGE and opcode == PAGE_OR:
+        return page | (code[2] >> 4)
+    return UNKNOWN_PAGE
+
+
+def _reads_flag(code, halt=True):
+    # Anything that reads R7 sees bit 0; BRK counts too (``halt``), since
+    # the final registers are observable
+    opcode = code[0]
+    if opcode in CONDITIONAL_JUMPS or (halt and opcode == BRK):
+        return True
+    return any(kind == REG and code[1 + j] & 7 == 7
+               for j, kind in enumerate(OPERAND_TYPES[opcode]))
+
+
+def _jump_label(info):
+    index = LABEL_JUMPS[info["code"][0]]
+    for ref_index, label in info["label_refs"]:
+        if ref_index == index:
+            return label
+    return None
+
+
+def layout_units(instrs):
+    """Final emission order as a list of (info, is_page_setup) units.
+
+    Each instruction's bytes are held back one instruction: a following
+    JIF/JNI puts its page setup in front of them, anything else after.
+    """
+    units = []
+    pending = None
+    for info in instrs:
+        has_setup = bool(info["label_refs"])
+        leading = info["instr_name"] in ("JIF", "JNI")
+
+        if pending is None:
+            # first instruction: a JIF/JNI page setup has nothing to precede and is dropped
+            if has_setup and not leading:
+                units.append((info, True))
+        else:
+            if has_setup and leading:
+                units.append((info, True))
+            units.append((pending, False))
+            if has_setup and not leading:
+                units.append((info, True))
+        pending = info
+
+    # emit the last buffered instruction
+    if pending is not None:
+        units.append((pending, False))
+    return units
+
+
+def label_first_units(units, instrs, label_targets):
+    """Label -> index of the earliest unit of the instruction it precedes."""
+    first_unit = {}
+    for i, (info, _) in enumerate(units):
+        first_unit.setdefault(id(info), i)
+    label_units = {}
+    for label_name, idx in label_targets.items():
+        # dangling label at end -> point at end of program
+        label_units[label_name] = first_unit[id(instrs[idx])] if idx < len(instrs) else len(units)
+    return label_units
+
+
+def plain_control_flow(units, label_units):
+    """True if every jump goes to a defined label and every opcode is one the
+    passes model, so the layout can change without changing behaviour."""
+    for i, (info, is_setup) in enumerate(units):
+        if is_setup:
+            continue
+        opcode = info["code"][0]
+        if opcode not in PAGE_PASS_OPCODES or opcode in (0x41, 0x43, 0x45):
+            return False
+        if any(label not in label_units for _, label in info["label_refs"]):
+            return False
+        if opcode in LABEL_JUMPS:
+            if _jump_label(info) is None:
+                return False
+            # the jump's own setup must be what sets its page: directly in
+            # front of it, or in front of a previous instruction that leaves
+            # R7 alone (a JIF/JNI setup's usual place)
+            if i >= 1 and units[i - 1] == (info, True):
+                continue
+            if (i >= 2 and units[i - 2] == (info, True) and not units[i - 1][1]
+                    and not _writes_r7(units[i - 1][0]["code"])):
+                continue
+            return False
+
+    # A setup leaves ZF set or clear depending on whether its label is on
+    # page 0, so a jump reading that flag (no flag-setting instruction in
+    # between) could flip whenever code moves. A later setup passes the flag
+    # on only when its own flag is read, which this catches as well.
+    succs = _unit_successors(units, label_units)
+    _, live_out = _flag_liveness(
+        units, succs,
+        lambda i: not units[i][1] and _reads_flag(units[i][0]["code"], halt=False),
+        lambda i: units[i][1] or units[i][0]["code"][0] not in NO_FLAG_OPCODES,
+        exit_live=False)
+    return not any(live_out[i] for i, (_, is_setup) in enumerate(units) if is_setup)
+
+
+def _unit_successors(units, label_units):
+    succs = []
+    for i, (info, is_setup) in enumerate(units):
+        opcode = info["code"][0]
+        if is_setup:
+            succs.append((i + 1,))
+        elif opcode == BRK:
+            succs.append(())
+        elif opcode in LABEL_JUMPS:
+            target = label_units[_jump_label(info)]
+            succs.append((target,) if opcode == JMP else (i + 1, target))
+        else:
+            succs.append((i + 1,))
+    return succs
+
+
+def _flag_liveness(units, succs, reads, writes, exit_live=True):
+    """(live_in, live_out) lists: is ZF read before being overwritten?"""
+    n = len(units)
+    preds = [[] for _ in range(n)]
+    live_out = [False] * n
+    for i, targets in enumerate(succs):
+        for s in targets:
+            if s < n:
+                preds[s].append(i)
+            elif exit_live:
+                live_out[i] = True   # falls off the end with R7 observable
+
+    live_in = [False] * n
+    work = []
+    for i in range(n):
+        if reads(i) or (live_out[i] and not writes(i)):
+            live_in[i] = True
+            work.append(i)
+    while work:
+        i = work.pop()
+        for p in preds[i]:
+            if live_out[p]:
+                continue
+            live_out[p] = True
+            if not live_in[p] and not writes(p):
+                live_in[p] = True
+                work.append(p)
+    return live_in, live_out
+
+
+def redundant_page_setups(units, label_units, base):
+    """Indices of page-setup units in ``units`` that can be left out.
+
+    A setup is redundant when R7 already holds its page on every path that
+    reaches it and ZF is overwritten before anything reads it. Dropping
+    setups moves labels, so this repeats until the label pages settle.
+    Programs with register or numeric jump targets are left alone, and
+    code is assumed not to modify itself.
+    """
+    if not plain_control_flow(units, label_units):
+        return frozenset()
+
+    removed = frozenset()
+    original_pages = None
+    for _ in range(8):
+        addrs = unit_addresses(units, removed, base)
+        label_pages = {label: (addrs[u] >> 8) & 0x0F for label, u in label_units.items()}
+        if original_pages is None:
+            original_pages = label_pages
+        found, flag_setups = _find_redundant(units, label_units, label_pages)
+        if found == removed:
+            # a kept setup leaves ZF set only for page 0, so one whose ZF is
+            # read must not move onto or off page 0
+            for i in flag_setups:
+                label = units[i][0]["label_refs"][-1][1]
+                if (original_pages[label] == 0) != (label_pages[label] == 0):
+                    return frozenset()
+            return removed
+        removed = found
+    return frozenset()
+
+
+def _find_redundant(units, label_units, label_pages):
+    n = len(units)
+    succs = _unit_successors(units, label_units)
+
+    # ---------- Forward: R7 page on entry to each unit ----------
+    page_in = [None] * n   # None = not reached
+    work = []
+    if n:
+        page_in[0] = 0
+        work.append(0)
+    while work:
+        i = work.pop()
+        info, is_setup = units[i]
+        if is_setup:
+            out = label_pages[info["label_refs"][-1][1]]
+        else:
+            out = _page_after(info["code"], page_in[i])
+        for s in succs[i]:
+            if s >= n:
+                continue
+            old = page_in[s]
+            new = out if old is None or old == out else UNKNOWN_PAGE
+            if new != old:
+                page_in[s] = new
+                work.append(s)
+
+    # every reachable label jump must already be on its label's page
+    for i, (info, is_setup) in enumerate(units):
+        if not is_setup and page_in[i] is not None and info["code"][0] in LABEL_JUMPS:
+            if page_in[i] != label_pages[_jump_label(info)]:
+                return frozenset(), ()
+
+    candidates = set()
+    for i, (info, is_setup) in enumerate(units):
+        page = page_in[i]
+        if is_setup and page is not None and page != UNKNOWN_PAGE:
+            if all(label_pages[label] == page for _, label in info["label_refs"]):
+                candidates.add(i)
+
+    # ---------- Backward: is ZF live after each unit? ----------
+    # Candidates are treated as already gone; putting a live one back only
+    # overwrites ZF again, so the rest stay safe to drop.
+    def reads(i):
+        info, is_setup = units[i]
+        if i in candidates:
+            return False
+        if is_setup:
+            # the final OR leaves ZF clear for any page but 0
+            return label_pages[info["label_refs"][-1][1]] == 0
+        return _reads_flag(info["code"])
+
+    def writes(i):
+        info, is_setup = units[i]
+        if i in candidates:
+            return False
+        return is_setup or info["code"][0] not in NO_FLAG_OPCODES
+
+    _, live_out = _flag_liveness(units, succs, reads, writes)
+
+    removed = frozenset(i for i in candidates if not live_out[i])
+    flag_setups = [i for i, (_, is_setup) in enumerate(units)
+                   if is_setup and live_out[i] and i not in removed]
+    return removed, flag_setups
+
+
+# ============================
+# Peephole passes
+# ============================
+
+# Each pass takes (instrs, label_targets) and returns the new pair and how
+# many changes it made. Passes only run on programs with plain control flow
+# (see plain_control_flow()), since every change moves code.
+
+MOV_REG_REG = INSTRUCTION_MODES[("MOV", (REG, REG))]
+
+# REG, IMM opcode -> how a second immediate on the same register combines
+ADD_IMM = INSTRUCTION_MODES[("ADD", (REG, IMM))]
+SUB_IMM = INSTRUCTION_MODES[("SUB", (REG, IMM))]
+IMMEDIATE_FOLDS = {
+    (INSTRUCTION_MODES[("AND", (REG, IMM))],) * 2: lambda a, b: a & b,
+    (INSTRUCTION_MODES[("OR", (REG, IMM))],) * 2: lambda a, b: a | b,
+    (INSTRUCTION_MODES[("XOR", (REG, IMM))],) * 2: lambda a, b: a ^ b,
+    (ADD_IMM, ADD_IMM): lambda a, b: a + b,
+    (ADD_IMM, SUB_IMM): lambda a, b: a - b,
+    (SUB_IMM, SUB_IMM): lambda a, b: a + b,
+    (SUB_IMM, ADD_IMM): lambda a, b: a - b,
+}
+# MOV R $a followed by any of these becomes MOV R $(a op b)
+MOV_FOLDS = {
+    INSTRUCTION_MODES[("AND", (REG, IMM))]: lambda a, b: a & b,
+    INSTRUCTION_MODES[("OR", (REG, IMM))]: lambda a, b: a | b,
+    INSTRUCTION_MODES[("XOR", (REG, IMM))]: lambda a, b: a ^ b,
+    ADD_IMM: lambda a, b: a + b,
+    SUB_IMM: lambda a, b: a - b,
+}
+
+
+def _has_leading_setup(info):
+    return bool(info["label_refs"]) and info["instr_name"] in ("JIF", "JNI")
+
+
+def _writes_r7(code):
+    return code[0] in REG_WRITE_OPCODES and code[1] & 7 == 7
+
+
+def _prepare(instrs, label_targets):
+    """(units, label_units) if the program is safe to rewrite, else None."""
+    units = layout_units(instrs)
+    label_units = label_first_units(units, instrs, label_targets)
+    if not plain_control_flow(units, label_units):
+        return None
+    return units, label_units
+
+
+def _entry_points(instrs, label_targets):
+    """Indices of instructions some jump can land on."""
+    referenced = {label for info in instrs for _, label in info["label_refs"]}
+    entries = set()
+    for label, idx in label_targets.items():
+        if label not in referenced:
             continue
+        entries.add(idx)
+        # a label on a JIF/JNI lands on its page setup, which sits in front
+        # of the previous instruction
+        if 0 < idx < len(instrs) and _has_leading_setup(instrs[idx]):
+            entries.add(idx - 1)
+    return entries
+
+
+def _drop(instrs, label_targets, dead):
+    """Remove instruction indices ``dead``; their labels move to the next survivor."""
+    if not dead:
+        return instrs, label_targets
+    new_index = []
+    kept = []
+    for idx, info in enumerate(instrs):
+        new_index.append(len(kept))
+        if idx not in dead:
+            kept.append(info)
+    new_index.append(len(kept))
+    return kept, {label: new_index[idx] for label, idx in label_targets.items()}
 
-        # numbered label (keep your isalpha rule)
-        if stripped.startswith("#") and len(stripped) > 1 and not stripped[1].isalpha():
-            events.append(("label", stripped))
+
+def thread_jumps(instrs, label_targets):
+    """Point jumps that land on a ``JMP #label`` straight at its final target."""
+    prepared = _prepare(instrs, label_targets)
+    if prepared is None:
+        return instrs, label_targets, 0
+    units, label_units = prepared
+    succs = _unit_successors(units, label_units)
+    # setups count as reads: whether they clear ZF depends on the final layout
+    live_in, _ = _flag_liveness(
+        units, succs,
+        lambda i: units[i][1] or _reads_flag(units[i][0]["code"]),
+        lambda i: units[i][1] or units[i][0]["code"][0] not in NO_FLAG_OPCODES)
+
+    # label -> target of the JMP it lands on
+    forward = {}
+    for label, idx in label_targets.items():
+        if idx < len(instrs) and instrs[idx]["code"][0] == JMP:
+            forward[label] = _jump_label(instrs[idx])
+
+    changes = 0
+    for info in instrs:
+        opcode = info["code"][0]
+        if opcode not in LABEL_JUMPS:
             continue
-        if stripped.startswith("#"):
-            events.append(("comment", None))
+        label = _jump_label(info)
+        target = label
+        seen = {label}
+        while target in forward and forward[target] not in seen:
+            target = forward[target]
+            seen.add(target)
+        if target == label:
+            continue
+        # skipping the JMP's setup changes ZF on arrival
+        target_unit = label_units[target]
+        if target_unit >= len(units) or live_in[target_unit]:
             continue
+        index = LABEL_JUMPS[opcode]
+        info["label_refs"] = [(i, target if i == index else op) for i, op in info["label_refs"]]
+        changes += 1
+    return instrs, label_targets, changes
 
-        injected, compiled = compile_line(stripped, line_num, labels=None, resolve_labels=False)
-        info = {
-            "line_num": line_num,
-            "instr_name": stripped.split()[0].upper(),
-            "injected_len": len(injected),
-            "compiled_len": len(compiled),
-        }
-        instr_idx = len(instrs)
-        instrs.append(info)
-        events.append(("instr", instr_idx))
-
-    # simulate final emission exactly (recording injection and compiled starts)
-    compiled_size = 0
-    pending_prev = None            # instr_idx of buffered previous instruction
-    instr_positions = {}          # instr_idx -> {'inj_start': x or None, 'compiled_start': y or None}
-
-    for ev in events:
-        if ev[0] != "instr":
+
+def remove_unreachable(instrs, label_targets):
+    """Drop code after an unconditional JMP or BRK that no label leads into."""
+    if _prepare(instrs, label_targets) is None:
+        return instrs, label_targets, 0
+    entries = _entry_points(instrs, label_targets)
+    dead = set()
+    i = 0
+    while i < len(instrs):
+        if instrs[i]["code"][0] not in (JMP, BRK):
+            i += 1
             continue
-        idx = ev[1]
-        info = instrs[idx]
-        inj = info["injected_len"]
-        comp = info["compiled_len"]
-        name = info["instr_name"]
-
-        if pending_prev is None:
-            # first instruction: injection (if any and not JIF/JNI) emits immediately
-            if inj > 0 and name not in ("JIF", "JNI"):
-                instr_positions[idx] = {'inj_start': compiled_size, 'compiled_start': None}
-                compiled_size += inj
-            else:
-                instr_positions[idx] = {'inj_start': None, 'compiled_start': None}
-            pending_prev = idx
-        else:
-            prev_idx = pending_prev
-            prev_comp = instrs[prev_idx]['compiled_len']
-
-            if inj > 0:
-                if name in ("JIF", "JNI"):
-                    # injection for this JIF/JNI emits now, then previous compiled emits
-                    instr_positions.setdefault(idx, {'inj_start': None, 'compiled_start': None})['inj_start'] = compiled_size
-                    compiled_size += inj
-                    instr_positions.setdefault(prev_idx, {})['compiled_start'] = compiled_size
-                    compiled_size += prev_comp
-                    pending_prev = idx
-                else:
-                    # append previous compiled now, then emit this instruction's injection
-                    instr_positions.setdefault(prev_idx, {})['compiled_start'] = compiled_size
-                    compiled_size += prev_comp
-                    instr_positions[idx] = {'inj_start': compiled_size, 'compiled_start': None}
-                    compiled_size += inj
-                    pending_prev = idx
-            else:
-                # no injection: append previous compiled now
-                instr_positions.setdefault(prev_idx, {})['compiled_start'] = compiled_size
-                compiled_size += prev_comp
-                instr_positions[idx] = {'inj_start': None, 'compiled_start': None}
-                pending_prev = idx
-
-    # append final pending compiled block
-    if pending_prev is not None:
-        instr_positions.setdefault(pending_prev, {})['compiled_start'] = compiled_size
-        compiled_size += instrs[pending_prev]['compiled_len']
-
-    # compute earliest-emitted byte for each instruction
-    first_emit = {}
-    for idx, pos in instr_positions.items():
-        inj_s = pos.get('inj_start')
-        comp_s = pos.get('compiled_start')
-        if inj_s is None:
-            first_emit[idx] = comp_s
-        elif comp_s is None:
-            first_emit[idx] = inj_s
-        else:
-            first_emit[idx] = min(inj_s, comp_s)
+        j = i + 1
+        while j < len(instrs) and j not in entries:
+            j += 1
+        region = list(range(i + 1, j))
+        # a JIF/JNI page setup is emitted ahead of the instruction before it,
+        # so keep the neighbours such setups are attached to
+        if region and _has_leading_setup(instrs[region[0]]):
+            region = region[1:]
+        if region and j < len(instrs) and _has_leading_setup(instrs[j]):
+            region = region[:-1]
+        dead.update(region)
+        i = j
+    instrs, label_targets = _drop(instrs, label_targets, dead)
+    return instrs, label_targets, len(dead)
 
-    # finally map numbered labels to the earliest byte of the following instruction
-    labels = {}
-    for i, ev in enumerate(events):
-        if ev[0] != "label":
+
+def _fold_pair(first, second):
+    """Code for ``first`` followed by ``second`` as one instruction, or None."""
+    a, b = first["code"], second["code"]
+    if len(a) != 3 or len(b) != 3 or a[1] & 7 == 7 or a[1] != b[1]:
+        return None
+    if (a[0], b[0]) in IMMEDIATE_FOLDS:
+        return bytearray([a[0], a[1], IMMEDIATE_FOLDS[(a[0], b[0])](a[2], b[2]) & 0xFF])
+    if a[0] == MOV_REG_IMM and b[0] in MOV_FOLDS:
+        return bytearray([a[0], a[1], MOV_FOLDS[b[0]](a[2], b[2]) & 0xFF])
+    return None
+
+
+def fold_immediates(instrs, label_targets):
+    """Merge runs of immediate operations on one register (not R7).
+
+    The merged instruction sets ZF from the same final value, so a later
+    JIF/JNI sees the same flag.
+    """
+    if _prepare(instrs, label_targets) is None:
+        return instrs, label_targets, 0
+    entries = _entry_points(instrs, label_targets)
+    dead = set()
+    last = None
+    for idx, info in enumerate(instrs):
+        folded = None
+        if last is not None and idx not in entries and not info["label_refs"]:
+            folded = _fold_pair(last, info)
+        if folded is None:
+            last = info
             continue
-        label_name = ev[1]
-        next_first = None
-        for j in range(i + 1, len(events)):
-            if events[j][0] == "instr":
-                next_idx = events[j][1]
-                next_first = first_emit[next_idx]
-                break
-        if next_first is None:
-            # dangling label at end -> point at end of program
-            next_first = compiled_size
-        labels[label_name] = base + next_first
-
-    # ---------- Second pass: compile with labels resolved ----------
-    compiled_binary = bytearray(b"\x00" * 0x90)
-    prev_compiled_bytes = None
-    prev_instr = None
+        last["code"] = folded
+        last["text"] = f"{last['text']} ; {info['text']}"
+        dead.add(idx)
+    instrs, label_targets = _drop(instrs, label_targets, dead)
+    return instrs, label_targets, len(dead)
+
+
+def drop_redundant_moves(instrs, label_targets):
+    """Drop ``MOV Ry Rx`` (or a repeated ``MOV Rx Ry``) right after ``MOV Rx Ry``.
+
+    The second move copies a value that is already in place and sets ZF
+    from that same value, so it changes nothing. R7 is left alone.
+    """
+    if _prepare(instrs, label_targets) is None:
+        return instrs, label_targets, 0
+    entries = _entry_points(instrs, label_targets)
+    dead = set()
+    last = None
+    for idx, info in enumerate(instrs):
+        code = info["code"]
+        if (last is not None and idx not in entries and code[0] == MOV_REG_REG
+                and last["code"][0] == MOV_REG_REG):
+            x, y = last["code"][1] & 7, last["code"][2] & 7
+            if 7 not in (x, y) and (code[1] & 7, code[2] & 7) in ((y, x), (x, y)):
+                dead.add(idx)
+                continue
+        last = info
+    instrs, label_targets = _drop(instrs, label_targets, dead)
+    return instrs, label_targets, len(dead)
+
+
+# Pass name -> function, in pipeline order. "pages" is the page-setup
+# elimination above, which runs on the final layout.
+PASSES = {
+    "thread": thread_jumps,
+    "unreachable": remove_unreachable,
+    "fold": fold_immediates,
+    "moves": drop_redundant_moves,
+    "pages": None,
+}
+
+OPT_LEVELS = {
+    0: (),
+    1: ("fold", "moves"),
+    2: ("thread", "unreachable", "fold", "moves", "pages"),
+}
+
+
+def run_passes(instrs, label_targets, passes, pass_report=None):
+    """Run the named peephole passes in pipeline order."""
+    for name, run in PASSES.items():
+        if name not in passes or run is None:
+            continue
+        start = time.perf_counter()
+        instrs, label_targets, changes = run(instrs, label_targets)
+        if pass_report is not None:
+            pass_report[name] = {"changes": changes, "seconds": time.perf_counter() - start}
+    return instrs, label_targets
+
+
+# ============================
+# Incremental compilation
+# ============================
+
+class CompileCache:
+    """Encodings and layouts kept between builds of the same source.
+
+    Instructions are cached by their text, so after an edit only the
+    changed lines are encoded again. The label layout (page setups removed
+    and label addresses) is cached by the parts of the program it depends
+    on; editing an operand that does not move anything reuses it.
+    """
+
+    def __init__(self):
+        self.lines = {}     # instruction text -> (code, label_refs)
+        self.layouts = {}   # layout key -> (removed, labels)
+        self.encoded = 0    # lines encoded by the last build
+        self.reused = 0     # lines taken from the cache by the last build
+        self.layout_hit = False
+
+    def parse(self, text, line_num):
+        entry = self.lines.get(text)
+        if entry is None:
+            code, label_refs = parse_line(text, line_num)
+            entry = self.lines[text] = (bytes(code), tuple(label_refs))
+            self.encoded += 1
+        else:
+            self.reused += 1
+        return entry
+
+    def start(self):
+        self.encoded = self.reused = 0
+        self.layout_hit = False
+
+    def finish(self, instrs):
+        # forget lines that are no longer in the source once they pile up
+        if len(self.lines) > 2 * len(instrs) + 256:
+            live = {info["text"] for info in instrs}
+            self.lines = {text: entry for text, entry in self.lines.items() if text in live}
+        if len(self.layouts) > 8:
+            self.layouts.clear()
+
+
+def layout_key(instrs, label_targets, elide):
+    """What the layout of ``instrs`` depends on.
+
+    Without page-setup elimination only the instruction sizes and JIF/JNI
+    placement matter; the elimination also looks at every byte.
+    """
+    if elide:
+        body = tuple((bytes(info["code"]), tuple(info["label_refs"])) for info in instrs)
+    else:
+        body = tuple((info["code"][0], len(info["code"]), len(info["label_refs"])) for info in instrs)
+    return elide, body, tuple(label_targets.items())
+
+
+def compile_lines(lines, source_map=None, elide_pages=False, page_report=None,
+                  passes=(), pass_report=None, cache=None):
+    """Assemble QCOM source lines into a ROM image (raises AssemblyError).
 
+    If a dict is passed as ``source_map`` it is filled with the final layout
+    (see build_source_map()). ``elide_pages`` drops redundant R7 page setups
+    (see redundant_page_setups()); a ``page_report`` dict receives how many
+    were removed, the bytes and instructions saved and the addresses the
+    removed instructions had without the elimination.
+
+    ``passes`` names the optimization passes to run (see PASSES and
+    OPT_LEVELS); a ``pass_report`` dict receives each one's changes and time.
+    Passing the same CompileCache to every build of a source makes rebuilds
+    after small edits incremental.
+    """
+    base = 0x90
+    if cache is not None:
+        cache.start()
+
+    # ---------- Parse: each line once, label operands left unresolved ----------
+    instrs = []          # list of {line_num, text, instr_name, code, label_refs}
+    label_targets = {}   # label name -> index of the instruction it precedes
     for line_num, line in enumerate(lines, 1):
         stripped = strip_comments(line)
         if not stripped:
             continue
-        if stripped.startswith("#") and len(stripped) > 1 and not stripped[1].isalpha():
-            continue
+
+        # numbered label (keep your isalpha rule); "#name" lines are comments
         if stripped.startswith("#"):
+            if len(stripped) > 1 and not stripped[1].isalpha():
+                label_targets[stripped] = len(instrs)
             continue
 
         try:
-            injected, compiled = compile_line(stripped, line_num, labels=labels, resolve_labels=True)
-            instr = stripped.split()[0].upper()
-
-            if prev_compiled_bytes is None:
-                # First instruction
-                if len(injected) > 0 and instr not in ("JIF", "JNI"):
-                    compiled_binary.extend(injected)
-                prev_compiled_bytes = compiled
-                prev_instr = instr
+            if cache is not None:
+                code, label_refs = cache.parse(stripped, line_num)
             else:
-                if len(injected) > 0:
-                    if instr in ("JIF", "JNI"):
-                        # For JIF/JNI: inject before previous instruction
-                        compiled_binary.extend(injected)
-                        compiled_binary.extend(prev_compiled_bytes)
-                        prev_compiled_bytes = compiled
-                    else:
-                        # For all others: inject before *this* instruction
-                        compiled_binary.extend(prev_compiled_bytes)
-                        compiled_binary.extend(injected)
-                        prev_compiled_bytes = compiled
-                else:
-                    compiled_binary.extend(prev_compiled_bytes)
-                    prev_compiled_bytes = compiled
-                prev_instr = instr
-
+                code, label_refs = parse_line(stripped, line_num)
         except ValueError as e:
-            print(f"Second pass error at line {line_num}: {e}")
-            print(f"Faulty line: '{stripped}'")
-            return
+            raise AssemblyError(str(e), line_num, stripped) from e
+        instrs.append({
+            "line_num": line_num,
+            "text": stripped,
+            "instr_name": stripped.split()[0].upper(),
+            "code": code,
+            "label_refs": label_refs,
+            "inj_start": None,
+            "code_start": None,
+        })
 
-    # emit the last buffered instruction
-    if prev_compiled_bytes is not None:
-        compiled_binary.extend(prev_compiled_bytes)
-    
-        # Attempt to write the compiled ROM to disk
+    instrs, label_targets = run_passes(instrs, label_targets, passes, pass_report)
+
+    # ---------- Layout: final emission order ----------
+    units = layout_units(instrs)
+    label_units = label_first_units(units, instrs, label_targets)
+
+    start = time.perf_counter()
+    elide = elide_pages or "pages" in passes
+    layout = None
+    if cache is not None:
+        key = layout_key(instrs, label_targets, elide)
+        layout = cache.layouts.get(key)
+        cache.layout_hit = layout is not None
+    if layout is None:
+        removed = redundant_page_setups(units, label_units, base) if elide else frozenset()
+        addrs = unit_addresses(units, removed, base)
+        labels = {label_name: addrs[u] for label_name, u in label_units.items()}
+        if cache is not None:
+            cache.layouts[key] = (removed, labels)
+    else:
+        removed, labels = layout
+    if pass_report is not None and "pages" in passes:
+        pass_report["pages"] = {"changes": len(removed), "seconds": time.perf_counter() - start}
+
+    if page_report is not None:
+        original = unit_addresses(units, frozenset(), base)
+        setup_addrs = [original[i] + 6 * slot + offset for i in sorted(removed)
+                       for slot in range(len(units[i][0]["label_refs"])) for offset in (0, 3)]
+        page_report.update({
+            "removed": len(removed),
+            "bytes": 3 * len(setup_addrs),
+            "instructions": len(setup_addrs),
+            "addresses": setup_addrs,
+        })
+
+    compiled_binary = bytearray(base)
+    for i, (info, is_setup) in enumerate(units):
+        if not is_setup:
+            info["code_start"] = len(compiled_binary)
+            compiled_binary += info["code"]
+        elif i not in removed:
+            info["inj_start"] = len(compiled_binary)
+            compiled_binary += page_setup(0) * len(info["label_refs"])
+
+    if source_map is not None:
+        source_map.update(build_source_map(instrs, labels))
+
+    # ---------- Backpatch: label offsets and page bytes ----------
+    for info in instrs:
+        for slot, (index, op) in enumerate(info["label_refs"]):
+            line_num = info["line_num"]
+            try:
+                full_addr = parse_operand(op, LABEL, labels, line_num)
+            except ValueError as e:
+                reason = f"Undefined label reference: {op}" if op not in labels else None
+                raise AssemblyError(f"Second pass error at line {line_num}: {e}\nFaulty line: '{info['text']}'",
+                                    line_num, info["text"], reason) from e
+            compiled_binary[info["code_start"] + index] = full_addr & 0xFF
+            if info["inj_start"] is not None:
+                compiled_binary[info["inj_start"] + 6 * slot + 5] = ((full_addr >> 8) & 0x0F) << 4
+
+    if cache is not None:
+        cache.finish(instrs)
+    return compiled_binary
+
+def assemble(source, passes=(), elide_pages=False, source_map=None, cache=None):
+    """Assemble QCOM source into ROM bytes, without touching the filesystem.
+
+    ``source`` is the program text or a list of its lines. Errors raise
+    AssemblyError. The other arguments are as for compile_lines().
+    """
+    lines = source.splitlines() if isinstance(source, str) else source
+    return bytes(compile_lines(lines, source_map, elide_pages=elide_pages,
+                               passes=passes, cache=cache))
+
+def write_outputs(input_file, output_file, compiled_binary, source_map=None):
+    """Write the ROM (and its source map sidecar); False after reporting an error."""
+    # Written beside the target and renamed over it, so an emulator
+    # watching the ROM never reads half a file
     try:
-        with open(output_file, "wb") as out_f:
+        with open(output_file + ".tmp", "wb") as out_f:
             out_f.write(compiled_binary)
+        os.replace(output_file + ".tmp", output_file)
     except OSError as e:
         print(f"Error writing output file '{output_file}': {e}")
+        return False
+
+    if source_map is not None:
+        # Sidecar read by the emulator's profiler: <rom>.map.json
+        map_file = os.path.splitext(output_file)[0] + ".map.json"
+        source_map = {"version": 1, "source": os.path.basename(input_file),
+                      "rom": os.path.basename(output_file), **source_map}
+        try:
+            with open(map_file, "w") as map_f:
+                json.dump(source_map, map_f, separators=(",", ":"))
+        except OSError as e:
+            print(f"Error writing source map '{map_file}': {e}")
+            return False
+        print(f"Source map written to '{map_file}'")
+    return True
+
+def watch(input_file, output_file, passes=(), write_map=False, interval=0.2):
+    """Rebuild ``output_file`` every time ``input_file`` changes, until Ctrl+C.
+
+    Run the emulator with --watch on the same ROM to have each build
+    loaded into it.
+    """
+    cache = CompileCache()
+    stamp = None
+    print(f"Watching '{input_file}' (Ctrl+C to stop)")
+    try:
+        while True:
+            try:
+                st = os.stat(input_file)
+                current = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                current = None
+            if current is not None and current != stamp:
+                stamp = current
+                start = time.perf_counter()
+                try:
+                    with open(input_file, "r") as f:
+                        lines = f.readlines()
+                    source_map = {} if write_map else None
+                    compiled_binary = compile_lines(lines, source_map, passes=passes, cache=cache)
+                except (OSError, ValueError) as e:
+                    print(e)
+                else:
+                    if write_outputs(input_file, output_file, compiled_binary, source_map):
+                        elapsed = (time.perf_counter() - start) * 1000
+                        layout = "reused" if cache.layout_hit else "rebuilt"
+                        print(f"Built '{output_file}' in {elapsed:.1f} ms "
+                              f"({cache.encoded} of {cache.encoded + cache.reused} lines encoded, layout {layout})")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    usage = ("Usage: python compiler.py input_file.txt output_file.qcom [--map] [-O0|-O1|-O2]\n"
+             "       [--enable=PASS,...] [--disable=PASS,...] [--elide-pages] [--time-passes] [--watch]")
+    flags = set()
+    level = 0
+    enable, disable = [], []
+    args = []
+    for arg in sys.argv[1:]:
+        if arg in ("--map", "--elide-pages", "--time-passes", "--watch"):
+            flags.add(arg)
+        elif arg in ("-O0", "-O1", "-O2"):
+            level = int(arg[2])
+        elif arg.startswith(("--enable=", "--disable=")):
+            names = [name for name in arg.split("=", 1)[1].split(",") if name]
+            for name in names:
+                if name not in PASSES:
+                    print(f"Error: Unknown pass '{name}' (passes: {', '.join(PASSES)})")
+                    return
+            (enable if arg.startswith("--enable=") else disable).extend(names)
+        else:
+            args.append(arg)
+    if len(args) != 2:
+        print(usage)
         return
-    
+    write_map = "--map" in flags
+    if "--elide-pages" in flags:
+        enable.append("pages")
+    passes = [name for name in PASSES
+              if (name in OPT_LEVELS[level] or name in enable) and name not in disable]
+
+    input_file = args[0]
+    output_file = args[1]
+
+    if not output_file.endswith(".qcom"):
+        print("Error: Output file must end with .qcom")
+        return
+
+    try:
+        with open(input_file, 'r') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        print(f"Error: Input file '{input_file}' not found.")
+        return
+
+    if "--watch" in flags:
+        watch(input_file, output_file, passes, write_map)
+        return
+
+    source_map = {} if write_map else None
+    page_report = {}
+    pass_report = {}
+    try:
+        compiled_binary = compile_lines(lines, source_map, page_report=page_report,
+                                        passes=passes, pass_report=pass_report)
+    except ValueError as e:
+        print(e)
+        return
+
+    if "--time-passes" in flags:
+        for name, result in pass_report.items():
+            print(f"  {name:<12} {result['changes']:>6} changes {result['seconds'] * 1000:>9.2f} ms")
+    if "pages" in passes:
+        print(f"Page setups removed: {page_report['removed']} "
+              f"({page_report['bytes']} bytes, {page_report['instructions']} instructions)")
+
+    if not write_outputs(input_file, output_file, compiled_binary, source_map):
+        return
+
     print(f"\nCompilation complete. Output written to '{output_file}'")
 
 if __name__ == "__main__":